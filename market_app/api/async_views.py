@@ -0,0 +1,162 @@
+"""
+async-native list / retrieve for products, sellers and markets on Django's async ORM.
+
+DRF views are synchronous, so under ASGI every request to them occupies a thread. These views
+serve GET from the event loop and hand every other method to the sync DRF view. Which routes use
+them is chosen with MARKET_API_ASYNC_ROUTES (see market_app.api.urls).
+Each route builds an instance of its sync view for the request and runs that view's filter_backends,
+?fields= / ?expand= selection, KeysetPagination and ETag, only the queries go through the async ORM:
+filters, orderings, cursors and validators are the same as on the sync route, and so are the bytes.
+?ids= lookups, the ?since= feed, invalid parameters (their 400) and other formats than JSON
+(the browsable API) are answered by the sync view.
+"""
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.urls import path
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import APIException, NotAcceptable
+from rest_framework.request import Request
+
+from .fast import represent
+from .renderers import FastJSONRenderer
+from .views import MarketsView, MarketSingleView, SellerViewSet, ProductViewSet
+
+
+def json_response(view, data, status=200):
+    # same bytes and headers (Allow, Vary) as the DRF view
+    response = HttpResponse(FastJSONRenderer().render(data), content_type='application/json', status=status)
+    for key, value in view.default_response_headers.items():
+        response[key] = value
+    return response
+
+
+def conditional_response(view, get_data, etag, last_modified):
+    """
+    304 for a matching If-None-Match / If-Modified-Since, else the data with the validators, like ConditionalMixin.
+    lists come without last_modified from get_validators(), so only their ETag counts
+    """
+    response = get_conditional_response(
+        view.request, etag=etag, last_modified=last_modified and int(last_modified.timestamp())
+    )
+    if response is not None:
+        for key, value in view.default_response_headers.items():
+            response[key] = value
+        return response
+    response = json_response(view, get_data())
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    return response
+
+
+class AsyncReadRoute:
+    """ async list / retrieve of one resource, everything else is answered by the sync DRF views """
+
+    def __init__(self, prefix, sync_list, sync_detail):
+        self.prefix = prefix
+        self.sync_list = sync_list
+        self.sync_detail = sync_detail
+
+    def get_view(self, sync_view, request, **kwargs):
+        """
+        an instance of the sync view set up for request as as_view() and dispatch() would, without running
+        a handler. None when the sync view has to answer: another format than plain JSON or a 406
+        """
+        view = sync_view.cls(**sync_view.initkwargs)
+        actions = getattr(sync_view, 'actions', None)
+        if actions:
+            # ViewSet.as_view() binds the handlers per instance, Allow lists them
+            view.action_map = actions
+            for method, action in actions.items():
+                setattr(view, method, getattr(view, action))
+            view.action = actions.get('get')
+        view.args, view.kwargs, view.format_kwarg = (), kwargs, None
+        view.request = Request(request, parsers=view.get_parsers(), negotiator=view.get_content_negotiator())
+        view.headers = view.default_response_headers
+        try:
+            renderer, media_type = view.perform_content_negotiation(view.request)
+        except NotAcceptable:
+            return None
+        if not isinstance(renderer, FastJSONRenderer) or media_type != renderer.media_type:
+            # the browsable API, ?format= and indented JSON stay with DRF
+            return None
+        view.request.accepted_renderer, view.request.accepted_media_type = renderer, media_type
+        return view
+
+    async def list(self, request):
+        # ?ids= lookups and the ?since= feed are answered by the sync view's mixins
+        if request.method != 'GET' or 'ids' in request.GET or 'since' in request.GET:
+            return await sync_to_async(self.sync_list)(request)
+        view = self.get_view(self.sync_list, request)
+        if view is None:
+            return await sync_to_async(self.sync_list)(request)
+
+        try:
+            # CachedListMixin.get_page_keys, with the page run on the async ORM
+            queryset = view.filter_queryset(view.get_queryset()).annotate(**view.get_key_annotations())
+            paginator = view.paginator
+            page = paginator.get_page_queryset(queryset, view.request, view)
+            serializer_class = view.get_serializer_class()
+            context = view.get_serializer_context()
+        except APIException:
+            # the sync view answers the invalid parameter
+            return await sync_to_async(self.sync_list)(request)
+
+        # aiterator() runs prefetch_related per chunk, one chunk holds the whole page
+        rows = paginator.set_page([obj async for obj in page.aiterator(chunk_size=paginator.page_size + 1)])
+        view._page_keys = (True, rows)
+        etag, last_modified = view.get_validators(view.request)
+        return conditional_response(
+            view, lambda: paginator.get_paginated_response(represent(serializer_class, rows, context)).data,
+            etag, last_modified,
+        )
+
+    async def detail(self, request, pk):
+        if request.method != 'GET':
+            return await sync_to_async(self.sync_detail)(request, pk=pk)
+        view = self.get_view(self.sync_detail, request, pk=pk)
+        if view is None:
+            return await sync_to_async(self.sync_detail)(request, pk=pk)
+
+        try:
+            # ConditionalMixin.get_unprefetched_object, with the prefetches of get_queryset()
+            queryset = view.filter_queryset(view.get_queryset()).annotate(**view.get_key_annotations())
+            serializer_class = view.get_serializer_class()
+            context = view.get_serializer_context()
+        except APIException:
+            return await sync_to_async(self.sync_detail)(request, pk=pk)
+        try:
+            obj = await queryset.aget(pk=pk)
+        except queryset.model.DoesNotExist:
+            return json_response(view, {'detail': f'No {queryset.model._meta.object_name} matches the given query.'}, status=404)
+
+        view._object = obj
+        etag, last_modified = view.get_validators(view.request)
+        return conditional_response(view, lambda: represent(serializer_class, [obj], context)[0], etag, last_modified)
+
+    def urls(self):
+        return [
+            path(f'{self.prefix}/', csrf_exempt(self.list)),
+            path(f'{self.prefix}/<int:pk>/', csrf_exempt(self.detail)),
+        ]
+
+
+ROUTES = {
+    'products': AsyncReadRoute(
+        'products',
+        ProductViewSet.as_view({'get': 'list'}),
+        ProductViewSet.as_view({'get': 'retrieve'}),
+    ),
+    'sellers': AsyncReadRoute(
+        'sellers',
+        SellerViewSet.as_view({'get': 'list', 'post': 'create'}),
+        SellerViewSet.as_view({'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'}),
+    ),
+    'markets': AsyncReadRoute(
+        'market',
+        MarketsView.as_view(),
+        MarketSingleView.as_view(),
+    ),
+}
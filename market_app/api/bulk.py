@@ -0,0 +1,231 @@
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import serializers
+
+from market_app import counters, stats
+from market_app.models import Market, Seller, Product
+from market_app.signals import MarketSellers, counts_changed, invalidate_markets, touch
+from .cache import get_fragment_cache
+from .serializers import ProductBulkRowSerializer, SellerBulkRowSerializer
+
+
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def existing_ids(model, ids):
+    """ returns the subset of ids that exist, with one IN query (split only at the backend's parameter limit) """
+    ids = list(ids)
+    found = set()
+    for part in chunked(ids, connection.features.max_query_params or len(ids) or 1):
+        found.update(model.objects.filter(pk__in=part).values_list('pk', flat=True))
+    return found
+
+
+def run_row_validation(child, rows):
+    """ the field validation of every row with one serializer instance, returns (valid rows as (index, data), errors) """
+    valid, errors = [], []
+    for index, row in enumerate(rows):
+        try:
+            valid.append((index, child.run_validation(row)))
+        except serializers.ValidationError as exc:
+            errors.append({'index': index, 'errors': exc.detail})
+    return valid, errors
+
+
+def validate_rows(rows):
+    """
+    validates the fields of every row with one serializer instance and checks all referenced
+    markets and sellers set-based; returns (valid rows as (index, data), errors)
+    """
+    valid, errors = run_row_validation(ProductBulkRowSerializer(), rows)
+
+    market_ids = existing_ids(Market, {data['market_id'] for _, data in valid})
+    seller_ids = existing_ids(Seller, {data['seller_id'] for _, data in valid})
+
+    checked = []
+    for index, data in valid:
+        row_errors = {}
+        if data['market_id'] not in market_ids:
+            row_errors['market_id'] = ['Market not found']
+        if data['seller_id'] not in seller_ids:
+            row_errors['seller_id'] = ['Seller not found']
+        if row_errors:
+            errors.append({'index': index, 'errors': row_errors})
+        else:
+            checked.append((index, data))
+    return checked, errors
+
+
+def product_key(data):
+    return (data['seller_id'], data['name'], data['market_id'])
+
+
+def drop_duplicate_keys(checked):
+    """
+    an upsert matches rows on (seller, name, market), so a key repeated in the upload would only keep its
+    last row. the first row of a key is written, the repeats are reported as row errors
+    """
+    first, unique, errors = {}, [], []
+    for index, data in checked:
+        key = product_key(data)
+        if key in first:
+            errors.append({'index': index, 'errors': {'non_field_errors': [
+                f'Duplicate of row {first[key]} (same seller_id, name and market_id)'
+            ]}})
+        else:
+            first[key] = index
+            unique.append((index, data))
+    return unique, errors
+
+
+def matching_products(keys):
+    """
+    the products with one of the (seller_id, name, market_id) keys, each key is matched as a whole
+    in OR'd batches that stay below the backend's parameter limit
+    """
+    keys = list(keys)
+    batch_size = max(1, (connection.features.max_query_params or 999) // 3)
+    for batch in chunked(keys, batch_size):
+        match = Q()
+        for seller_id, name, market_id in batch:
+            match |= Q(seller_id=seller_id, name=name, market_id=market_id)
+        yield from Product.objects.filter(match).only('id', 'seller_id', 'name', 'market_id', 'price', 'updated_at')
+
+
+def upsert_chunk(chunk):
+    """
+    updates price and description of products matching (seller, name, market), inserts the rest.
+    the model does not make the key unique, so every product with a matching key is updated.
+    returns (created, updated, previous) with previous the (market_id, price) of the updated rows before the update
+    """
+    by_key = {product_key(data): data for _, data in chunk}
+
+    to_update, previous, matched = [], [], set()
+    now = timezone.now()
+    for product in matching_products(by_key):
+        key = (product.seller_id, product.name, product.market_id)
+        data = by_key[key]
+        matched.add(key)
+        previous.append((product.market_id, product.price))
+        product.price = data['price']
+        product.description = data['description']
+        # bulk_update skips auto_now
+        product.updated_at = now
+        to_update.append(product)
+
+    Product.objects.bulk_update(to_update, ['price', 'description', 'updated_at'])
+    created = Product.objects.bulk_create([Product(**data) for key, data in by_key.items() if key not in matched])
+    return created, to_update, previous
+
+
+def products_written(created, updated, previous=()):
+    """ bulk_create and bulk_update send no signals, so the bulk path does what the receivers would """
+    stats.apply_products(
+        added=[(product.market_id, product.price) for product in created + updated], removed=previous
+    )
+    # the upsert never moves a product, only the created ones count
+    owners = [(product.market_id, product.seller_id) for product in created]
+    counters.apply_products(added=owners)
+    counts_changed({market_id for market_id, _ in owners}, {seller_id for _, seller_id in owners})
+    fragment_cache = get_fragment_cache()
+    if fragment_cache is not None:
+        fragment_cache.invalidate(Product, [product.pk for product in created + updated])
+
+
+def ingest_products(rows, upsert=False, chunk_size=None):
+    """
+    writes a supplier price list with chunked bulk_create, one transaction per chunk.
+    invalid rows and failing chunks are reported per row and never abort the other rows
+    """
+    chunk_size = chunk_size or getattr(settings, 'MARKET_API_BULK_CHUNK_SIZE', 1000)
+    checked, errors = validate_rows(rows)
+    if upsert:
+        checked, duplicates = drop_duplicate_keys(checked)
+        errors += duplicates
+    created = updated = 0
+
+    for chunk in chunked(checked, chunk_size):
+        try:
+            with transaction.atomic():
+                if upsert:
+                    chunk_created, chunk_updated, previous = upsert_chunk(chunk)
+                else:
+                    chunk_created = Product.objects.bulk_create([Product(**data) for _, data in chunk])
+                    chunk_updated, previous = [], []
+                products_written(chunk_created, chunk_updated, previous)
+        except DatabaseError as exc:
+            errors.extend({'index': index, 'errors': {'non_field_errors': [str(exc)]}} for index, _ in chunk)
+            continue
+        created += len(chunk_created)
+        updated += len(chunk_updated)
+
+    errors.sort(key=lambda error: error['index'])
+    return {'created': created, 'updated': updated, 'errors': errors}
+
+
+def validate_seller_rows(rows):
+    """ like validate_rows for sellers: the market ids of all rows are checked with one query """
+    valid, errors = run_row_validation(SellerBulkRowSerializer(), rows)
+    market_ids = existing_ids(Market, {market_id for _, data in valid for market_id in data['market_ids']})
+
+    checked = []
+    for index, data in valid:
+        missing = [market_id for market_id in data['market_ids'] if market_id not in market_ids]
+        if missing:
+            errors.append({'index': index, 'errors': {'market_ids': [f'Market {pk} not found' for pk in missing]}})
+        else:
+            checked.append((index, data))
+    return checked, errors
+
+
+def onboard_sellers(rows, chunk_size=None):
+    """
+    creates sellers with their market links set-based: one existence check for all market ids,
+    then per chunk one bulk_create for the sellers and one for the link rows, in one transaction.
+    returns the created seller ids in row order
+    """
+    chunk_size = chunk_size or getattr(settings, 'MARKET_API_BULK_CHUNK_SIZE', 1000)
+    checked, errors = validate_seller_rows(rows)
+    ids, linked = [], set()
+
+    for chunk in chunked(checked, chunk_size):
+        try:
+            with transaction.atomic():
+                sellers = Seller.objects.bulk_create(
+                    [
+                        # the market ids were checked to exist, so every distinct one counts
+                        Seller(
+                            name=data['name'], contact_info=data['contact_info'],
+                            market_count=len(set(data['market_ids'])),
+                        )
+                        for _, data in chunk
+                    ]
+                )
+                links = [
+                    MarketSellers(seller_id=seller.pk, market_id=market_id)
+                    for seller, (_, data) in zip(sellers, chunk)
+                    for market_id in dict.fromkeys(data['market_ids'])
+                ]
+                MarketSellers.objects.bulk_create(links)
+                # what the m2m_changed receiver would do for the markets
+                market_ids = {link.market_id for link in links}
+                touch(Market, market_ids)
+                stats.refresh_seller_counts(market_ids)
+                counters.recount_markets(market_ids, fields=['seller_count'])
+        except DatabaseError as exc:
+            errors.extend({'index': index, 'errors': {'non_field_errors': [str(exc)]}} for index, _ in chunk)
+            continue
+        ids += [seller.pk for seller in sellers]
+        linked |= market_ids
+
+    # once for all chunks: every seller of these markets nests their seller links
+    fragment_cache = get_fragment_cache()
+    if fragment_cache is not None and linked:
+        invalidate_markets(fragment_cache, linked)
+
+    errors.sort(key=lambda error: error['index'])
+    return {'created': len(ids), 'ids': ids, 'errors': errors}
@@ -0,0 +1,203 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .fast import represent
+
+
+class LocMemLRUBackend:
+    """
+    process-local fragment store, evicts the least recently used entry beyond max_entries and drops
+    entries older than timeout seconds. the signal invalidation only reaches the process that wrote,
+    so other workers rely on the version check of FragmentCache, use it for single process setups
+    """
+
+    def __init__(self, max_entries=10000, timeout=300):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        found = {}
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                if key not in self._data:
+                    continue
+                expires, value = self._data[key]
+                if expires is not None and expires <= now:
+                    del self._data[key]
+                    continue
+                self._data.move_to_end(key)
+                found[key] = value
+        return found
+
+    def set_many(self, mapping):
+        expires = time.monotonic() + self.timeout if self.timeout is not None else None
+        with self._lock:
+            for key, value in mapping.items():
+                self._data[key] = (expires, value)
+                self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class DjangoCacheBackend:
+    """ fragment store on one of the CACHES aliases, shared between processes e.g. with memcached or redis """
+
+    def __init__(self, alias='default', timeout=300):
+        self.alias = alias
+        self.timeout = timeout
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get_many(self, keys):
+        return self.cache.get_many(keys)
+
+    def set_many(self, mapping):
+        self.cache.set_many(mapping, timeout=self.timeout)
+
+    def delete_many(self, keys):
+        self.cache.delete_many(keys)
+
+    def clear(self):
+        self.cache.clear()
+
+
+def serialize_pks(serializer_class, queryset, pks, context):
+    """ loads the rows with one queryset.filter(pk__in=...) and returns their representations by pk """
+    objs = list(queryset.filter(pk__in=pks))
+    items = represent(serializer_class, objs, context)
+    return {obj.pk: item for obj, item in zip(objs, items)}
+
+
+# model -> serializers whose representations are cached, filled by @fragment_cached at import time
+registry = {}
+
+
+def fragment_cached(serializer_class):
+    """ class decorator: list views cache this serializer's representation per object """
+    registry.setdefault(serializer_class.Meta.model, []).append(serializer_class)
+    return serializer_class
+
+
+class FragmentCache:
+    """
+    stores the serialized dict of every object, keyed by serializer, model, pk and VERSION.
+    every fragment carries the version of its row (the updated_at values the view selects with the keys)
+    and is only served for that version, so a copy stored by a slow reader after an invalidation or a
+    process that missed the signal is never rendered. market_app.signals drops outdated entries early
+    """
+
+    def __init__(self, backend, version=1):
+        self.backend = backend
+        self.version = version
+
+    def is_cached(self, serializer_class):
+        return serializer_class in registry.get(serializer_class.Meta.model, ())
+
+    def key(self, serializer_class, pk):
+        model = serializer_class.Meta.model
+        return f'fragment:v{self.version}:{serializer_class.__name__}:{model._meta.label_lower}:{pk}'
+
+    def get_or_serialize(self, serializer_class, queryset, versions, context):
+        """ the representations of the pks of versions ({pk: row version}) in order, rows that do not exist are left out """
+        data = self.get_or_serialize_by_pk(serializer_class, queryset, versions, context)
+        return [data[pk] for pk in versions if pk in data]
+
+    def get_or_serialize_by_pk(self, serializer_class, queryset, versions, context):
+        """
+        returns the representations of the pks of versions ({pk: row version}) by pk. hits of the same
+        version come from the backend, misses are loaded with one queryset.filter(pk__in=...) and serialized together.
+        fragments are always the full representation: a ?fields= selection (context['selection'])
+        is cut out of the hits and its narrower misses are not stored, ?expand= bypasses the cache
+        """
+        selection = context.get('selection')
+        if selection is not None and selection.expand:
+            return serialize_pks(serializer_class, queryset, list(versions), context)
+
+        request = context.get('request')
+        # hyperlinks are absolute, so a fragment is only valid for the host it was built for
+        variant = request.build_absolute_uri('/') if request is not None else ''
+        keys = {pk: self.key(serializer_class, pk) for pk in versions}
+        cached = self.backend.get_many(list(keys.values()))
+
+        data = {}
+        for pk, key in keys.items():
+            entry = cached.get(key)
+            if entry is not None and entry[0] == variant and entry[1] == versions[pk]:
+                data[pk] = entry[2] if selection is None else selection.project(entry[2])
+
+        missing = [pk for pk in versions if pk not in data]
+        if missing:
+            # fragments outlive the request, a lagging read replica would store a stale copy
+            # right after the invalidation, so they are built from the primary
+            fresh = serialize_pks(serializer_class, queryset.using(DEFAULT_DB_ALIAS), missing, context)
+            if selection is None:
+                self.backend.set_many({keys[pk]: (variant, versions[pk], item) for pk, item in fresh.items()})
+            data.update(fresh)
+        return data
+
+    def invalidate(self, model, pks):
+        """ drops every cached representation of the given rows, again on commit to close the race with readers """
+        pks = list(pks)
+        if not pks:
+            return
+        keys = [self.key(serializer_class, pk) for serializer_class in registry.get(model, ()) for pk in pks]
+        if not keys:
+            return
+        self.backend.delete_many(keys)
+        if transaction.get_connection().in_atomic_block:
+            transaction.on_commit(lambda: self.backend.delete_many(keys))
+
+    def clear(self):
+        self.backend.clear()
+
+
+_fragment_cache = None
+
+
+def get_fragment_cache():
+    """
+    the FragmentCache configured by MARKET_FRAGMENT_CACHE, or None if caching is disabled:
+
+        MARKET_FRAGMENT_CACHE = {
+            'BACKEND': 'market_app.api.cache.DjangoCacheBackend',
+            'OPTIONS': {'alias': 'fragments', 'timeout': 300},
+            'VERSION': 1,
+        }
+    """
+    global _fragment_cache
+    if _fragment_cache is None:
+        config = getattr(settings, 'MARKET_FRAGMENT_CACHE', None)
+        if not config:
+            return None
+        backend = import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+        _fragment_cache = FragmentCache(backend, version=config.get('VERSION', 1))
+    return _fragment_cache
+
+
+@receiver(setting_changed)
+def reset_fragment_cache(*, setting, **kwargs):
+    global _fragment_cache
+    if setting == 'MARKET_FRAGMENT_CACHE':
+        _fragment_cache = None
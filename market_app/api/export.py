@@ -0,0 +1,44 @@
+import csv
+import json
+
+from django.conf import settings
+
+# same keys as ProductSerializer, market and seller are their names
+EXPORT_FIELDS = ['id', 'name', 'description', 'price', 'market', 'seller']
+EXPORT_COLUMNS = ['id', 'name', 'description', 'price', 'market__name', 'seller__name']
+
+
+class Echo:
+    """ file-like object for csv.writer that hands back the line instead of buffering it """
+
+    def write(self, value):
+        return value
+
+
+def export_rows(queryset):
+    """
+    yields one tuple per product. market and seller names are joined in the same query
+    and rows are fetched in chunks, so memory stays flat regardless of catalog size
+    """
+    chunk_size = getattr(settings, 'MARKET_API_EXPORT_CHUNK_SIZE', 2000)
+    rows = queryset.order_by('id').values_list(*EXPORT_COLUMNS).iterator(chunk_size=chunk_size)
+    for row in rows:
+        yield row[:3] + (format(row[3], 'f'),) + row[4:]
+
+
+def ndjson_lines(queryset):
+    for row in export_rows(queryset):
+        yield json.dumps(dict(zip(EXPORT_FIELDS, row))) + '\n'
+
+
+def csv_lines(queryset):
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in export_rows(queryset):
+        yield writer.writerow(row)
+
+
+EXPORT_FORMATS = {
+    'ndjson': (ndjson_lines, 'application/x-ndjson'),
+    'csv': (csv_lines, 'text/csv'),
+}
@@ -0,0 +1,206 @@
+"""
+read-only fast path for the list endpoints.
+
+FastSerializer is built from an existing serializer's readable fields once per page and turns every
+field into a (getter, converter) pair: plain attribute lookups for model fields, int / str for
+integer and char fields, a precomputed quantize context for decimals and a URL template for hyperlinks.
+The loop per row is the one of Serializer.to_representation without the per-field dispatch, so the
+output is the same; every field it does not know keeps DRF's own get_attribute / to_representation.
+"""
+import decimal
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ObjectDoesNotExist
+from django.db.models.manager import BaseManager
+from rest_framework import fields, relations, serializers
+from rest_framework.fields import SkipField
+from rest_framework.relations import Hyperlink, PKOnlyObject
+from rest_framework.settings import api_settings
+
+from .links import CachedHyperlinkMixin, link_template
+from .timing import measure
+
+# get_attribute implementations that come down to getattr(instance, source) for a model field
+PLAIN_GET_ATTRIBUTE = (
+    fields.Field.get_attribute, relations.RelatedField.get_attribute, relations.ManyRelatedField.get_attribute
+)
+
+
+def overrides(field, base, *names):
+    """ True if the field's class replaced one of the given methods of base """
+    return any(getattr(type(field), name) is not getattr(base, name) for name in names)
+
+
+def is_plain_serializer(serializer):
+    return isinstance(serializer, serializers.Serializer) and not overrides(
+        serializer, serializers.Serializer, 'to_representation'
+    )
+
+
+def model_field_name(field, model):
+    """ the source of field if it is a field of model that DRF would read with a plain getattr() """
+    if model is None or len(field.source_attrs) != 1 or type(field).get_attribute not in PLAIN_GET_ATTRIBUTE:
+        return None
+    try:
+        model._meta.get_field(field.source_attrs[0])
+    except FieldDoesNotExist:
+        return None
+    return field.source_attrs[0]
+
+
+def attribute_getter(field, model):
+    """ getattr() for a source that is a field of the model, DRF's get_attribute for everything else """
+    if field.source == '*':
+        return lambda instance: instance
+    name = model_field_name(field, model)
+    if name is None:
+        return field.get_attribute
+
+    def get(instance):
+        try:
+            return getattr(instance, name)
+        except (AttributeError, ObjectDoesNotExist):
+            # defaults, SkipField and the error message are DRF's business
+            return field.get_attribute(instance)
+    return get
+
+
+def decimal_converter(field):
+    coerce_to_string = getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+    if field.decimal_places is None or field.localize or field.normalize_output or not coerce_to_string:
+        return field.to_representation
+
+    exponent = decimal.Decimal('.1') ** field.decimal_places
+    context = decimal.getcontext().copy()
+    if field.max_digits is not None:
+        context.prec = field.max_digits
+    rounding = field.rounding
+
+    def convert(value):
+        if type(value) is not decimal.Decimal:
+            return field.to_representation(value)
+        return format(value.quantize(exponent, rounding=rounding, context=context), 'f')
+    return convert
+
+
+def hyperlink_converter(field):
+    """ the URL template of the request (market_app.api.links), every row only fills in its own pk """
+    request = field.context.get('request')
+    custom_url = overrides(field, relations.HyperlinkedRelatedField, 'get_url') and not isinstance(
+        field, CachedHyperlinkMixin
+    )
+    if request is None or field.lookup_field != 'pk' or custom_url:
+        return field.to_representation
+
+    format = field.context.get('format')
+    if format and field.format and field.format != format:
+        format = field.format
+    template = link_template(request, field.view_name, field.lookup_url_kwarg, format)
+    if template is None:
+        return field.to_representation
+    prefix, suffix = template
+
+    def convert(value):
+        pk = getattr(value, 'pk', None)
+        if type(pk) is not int or pk < 0:
+            return field.to_representation(value)
+        return Hyperlink(f'{prefix}{pk}{suffix}', value)
+    return convert
+
+
+def field_converter(field):
+    """ the callable that replaces field.to_representation """
+    if isinstance(field, serializers.ListSerializer) and is_plain_serializer(field.child) and not overrides(
+        field, serializers.ListSerializer, 'to_representation'
+    ):
+        child = FastSerializer(field.child).to_representation
+        return lambda data: [child(item) for item in (data.all() if isinstance(data, BaseManager) else data)]
+    if is_plain_serializer(field):
+        return FastSerializer(field).to_representation
+    if isinstance(field, relations.ManyRelatedField) and not overrides(
+        field, relations.ManyRelatedField, 'to_representation'
+    ):
+        child = field_converter(field.child_relation)
+        return lambda iterable: [child(value) for value in iterable]
+    if isinstance(field, fields.SerializerMethodField):
+        return getattr(field.parent, field.method_name)
+
+    plain = {
+        fields.IntegerField: int,
+        fields.CharField: str,
+        relations.StringRelatedField: str,
+    }
+    for base, convert in plain.items():
+        if isinstance(field, base) and not overrides(field, base, 'to_representation'):
+            return convert
+    if isinstance(field, fields.DecimalField) and not overrides(field, fields.DecimalField, 'to_representation'):
+        return decimal_converter(field)
+    if isinstance(field, relations.HyperlinkedRelatedField) and not overrides(
+        field, relations.HyperlinkedRelatedField, 'to_representation'
+    ):
+        return hyperlink_converter(field)
+    return field.to_representation
+
+
+def field_getter(field, model):
+    if isinstance(field, relations.ManyRelatedField):
+        name = model_field_name(field, model)
+        if name is None:
+            return field.get_attribute
+
+        def get_related(instance):
+            if instance.pk is None:
+                return []
+            try:
+                relationship = getattr(instance, name)
+            except (AttributeError, ObjectDoesNotExist):
+                return field.get_attribute(instance)
+            return relationship.all() if hasattr(relationship, 'all') else relationship
+        return get_related
+    if isinstance(field, relations.RelatedField) and field.use_pk_only_optimization():
+        return field.get_attribute
+    return attribute_getter(field, model)
+
+
+class FastSerializer:
+    """
+    read-only stand-in for a bound serializer instance:
+
+        FastSerializer(ProductSerializer(context=context)).many(products)
+
+    returns what ProductSerializer(products, many=True, context=context).data would
+    """
+
+    def __init__(self, serializer):
+        meta = getattr(serializer, 'Meta', None)
+        model = getattr(meta, 'model', None)
+        self.entries = [
+            (field.field_name, field_getter(field, model), field_converter(field))
+            for field in serializer._readable_fields
+        ]
+
+    def to_representation(self, instance):
+        ret = {}
+        for name, get, convert in self.entries:
+            try:
+                attribute = get(instance)
+            except SkipField:
+                continue
+            if attribute is None or (isinstance(attribute, PKOnlyObject) and attribute.pk is None):
+                ret[name] = None
+            else:
+                ret[name] = convert(attribute)
+        return ret
+
+    def many(self, instances):
+        to_representation = self.to_representation
+        return [to_representation(instance) for instance in instances]
+
+
+def represent(serializer_class, instances, context):
+    """ the list representation of instances, through FastSerializer if MARKET_API_FAST_SERIALIZERS is on """
+    with measure('serialize'):
+        serializer = serializer_class(context=context)
+        if not getattr(settings, 'MARKET_API_FAST_SERIALIZERS', False) or not is_plain_serializer(serializer):
+            return serializer_class(instances, many=True, context=context).data
+        return FastSerializer(serializer).many(instances)
@@ -0,0 +1,114 @@
+import re
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import F
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+
+def int_param(request, name):
+    value = request.query_params.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValidationError({name: ['A valid integer is required.']})
+
+
+def decimal_param(request, name):
+    value = request.query_params.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        raise ValidationError({name: ['A valid number is required.']})
+
+
+def decimal_bounds(field):
+    """ the smallest and largest value a DecimalField can hold """
+    largest = Decimal('9' * (field.max_digits - field.decimal_places) + '.' + '9' * field.decimal_places)
+    return -largest, largest
+
+
+class ProductFilter(BaseFilterBackend):
+    """
+    ?market=<id>, ?seller=<id>, ?price_min= and ?price_max= for product lists and the export.
+    every combination is served by one of the Product.Meta.indexes
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        market = int_param(request, 'market')
+        if market is not None:
+            queryset = queryset.filter(market_id=market)
+        seller = int_param(request, 'seller')
+        if seller is not None:
+            queryset = queryset.filter(seller_id=seller)
+        price_min = decimal_param(request, 'price_min')
+        price_max = decimal_param(request, 'price_max')
+        if price_min is not None or price_max is not None:
+            # always both bounds: SQLite takes a one-sided range for a quarter of the table and would
+            # rather scan the whole name index for ?ordering=name than search the price index and sort
+            field = queryset.model._meta.get_field('price')
+            lowest, highest = decimal_bounds(field)
+            queryset = queryset.filter(price__range=(
+                lowest if price_min is None else price_min, highest if price_max is None else price_max
+            ))
+        return queryset
+
+
+def fts_query(text):
+    """
+    turns free text into an FTS5 query: every word must match, the last one as a prefix (type-ahead).
+    words are quoted, so the FTS5 operators and syntax errors never reach the database
+    """
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    return ' '.join(f'"{word}"' for word in words) + '*'
+
+
+class FullTextSearchFilter(BaseFilterBackend):
+    """
+    ?q= over the FTS5 index of the view (view.search_index is the related name of its index model).
+    results are annotated with their bm25 search_rank, see KeysetOrderingFilter
+    """
+
+    def get_search(self, request):
+        return fts_query(request.query_params.get('q', ''))
+
+    def filter_queryset(self, request, queryset, view):
+        if 'q' not in request.query_params:
+            return queryset
+        query = self.get_search(request)
+        if query is None:
+            return queryset.none()
+        index = view.search_index
+        return queryset.filter(**{f'{index}__document__match': query}).annotate(search_rank=F(f'{index}__rank'))
+
+
+class KeysetOrderingFilter(BaseFilterBackend):
+    """
+    ?ordering=<field> or -<field> out of view.ordering_fields with id as tie-breaker,
+    ?q= searches are ordered by rank and range filters in view.range_orderings by their column,
+    so the index that answers the range also gives the order. the cursor pagination asks this
+    filter for its ordering, None keeps the paginator's own
+    """
+
+    def get_ordering(self, request, queryset, view):
+        ordering = request.query_params.get('ordering')
+        if ordering:
+            if ordering.lstrip('-') not in getattr(view, 'ordering_fields', ()):
+                raise ValidationError({'ordering': [f'Ordering by {ordering} is not supported.']})
+            return (ordering, '-id' if ordering.startswith('-') else 'id')
+        if getattr(view, 'search_index', None) and fts_query(request.query_params.get('q', '')) is not None:
+            return ('search_rank', 'id')
+        for param, field in getattr(view, 'range_orderings', {}).items():
+            if request.query_params.get(param):
+                return (field, 'id')
+        return None
+
+    def filter_queryset(self, request, queryset, view):
+        ordering = self.get_ordering(request, queryset, view)
+        return queryset.order_by(*ordering) if ordering else queryset
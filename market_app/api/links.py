@@ -0,0 +1,76 @@
+"""
+hyperlinks without a reverse() per link.
+
+the URL pattern of a view name is reversed once per process with a placeholder pk and kept as the
+(prefix, suffix) around it; the absolute form (scheme, host, ?format= override) is built once per
+request. a link is then prefix + pk + suffix, the same string DRF's reverse() would give.
+"""
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.urls import NoReverseMatch, get_script_prefix, get_urlconf, reverse
+from rest_framework import relations
+from rest_framework.reverse import preserve_builtin_query_params
+
+# stands in for the pk while reversing a hyperlink once, split off again to get prefix and suffix
+URL_SENTINEL = 987654321
+
+# (urlconf, script prefix, view name, lookup kwarg, format) -> (prefix, suffix) of the path, None if it has no template
+_paths = {}
+
+
+def path_template(view_name, lookup_url_kwarg, format=None):
+    key = (get_urlconf() or settings.ROOT_URLCONF, get_script_prefix(), view_name, lookup_url_kwarg, format)
+    if key not in _paths:
+        kwargs = {lookup_url_kwarg: URL_SENTINEL}
+        if format is not None:
+            kwargs['format'] = format
+        try:
+            parts = reverse(view_name, kwargs=kwargs).split(str(URL_SENTINEL))
+        except NoReverseMatch:
+            parts = None
+        _paths[key] = tuple(parts) if parts is not None and len(parts) == 2 else None
+    return _paths[key]
+
+
+def link_template(request, view_name, lookup_url_kwarg, format=None):
+    """ (prefix, suffix) of the absolute links of view_name for this request, None where reverse() is needed """
+    if getattr(request, 'versioning_scheme', None) is not None:
+        return None
+    templates = request.__dict__.setdefault('_link_templates', {})
+    key = (view_name, lookup_url_kwarg, format)
+    if key not in templates:
+        template = path_template(view_name, lookup_url_kwarg, format)
+        if template is not None:
+            url = request.build_absolute_uri(f'{template[0]}{URL_SENTINEL}{template[1]}')
+            parts = preserve_builtin_query_params(url, request).split(str(URL_SENTINEL))
+            template = tuple(parts) if len(parts) == 2 else None
+        templates[key] = template
+    return templates[key]
+
+
+@receiver(setting_changed)
+def reset_path_templates(*, setting, **kwargs):
+    if setting == 'ROOT_URLCONF':
+        _paths.clear()
+
+
+class CachedHyperlinkMixin:
+    """ get_url() of HyperlinkedRelatedField / HyperlinkedIdentityField from the templates above """
+
+    def get_url(self, obj, view_name, request, format):
+        pk = getattr(obj, 'pk', None)
+        if self.lookup_field != 'pk' or type(pk) is not int or pk < 0:
+            return super().get_url(obj, view_name, request, format)
+        template = link_template(request, view_name, self.lookup_url_kwarg, format)
+        if template is None:
+            return super().get_url(obj, view_name, request, format)
+        return f'{template[0]}{pk}{template[1]}'
+
+
+class CachedHyperlinkedRelatedField(CachedHyperlinkMixin, relations.HyperlinkedRelatedField):
+    pass
+
+
+class CachedHyperlinkedIdentityField(CachedHyperlinkMixin, relations.HyperlinkedIdentityField):
+    pass
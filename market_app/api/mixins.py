@@ -0,0 +1,322 @@
+import hashlib
+
+from django.conf import settings
+from django.db import router, transaction
+from django.db.models import F, Max, prefetch_related_objects
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+from rest_framework import status
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework import serializers
+from rest_framework.decorators import action
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.response import Response
+
+from market_app import changes
+from .cache import get_fragment_cache, serialize_pks
+from .fast import represent
+from .sparse import split_names
+
+
+def row_value(row, name):
+    """ a column of a key row, a values() dict or an annotated model instance """
+    return row[name] if isinstance(row, dict) else getattr(row, name)
+
+
+class KeyQuerysetMixin:
+    """
+    selects the requested page once per request: as plain key rows when the fragment cache serves the
+    representations, otherwise as the page objects themselves, which are then serialized without another query
+    """
+
+    def get_key_queryset(self):
+        """ the rows to list, override to leave out joins and annotations only needed for serializing """
+        return self.get_queryset()
+
+    def get_key_annotations(self):
+        """ extra per-row values selected with the keys """
+        return {}
+
+    def get_row_version(self, row):
+        """ the extra values of a key row, the fragment cache serves a fragment only for the version it was built from """
+        return tuple(row_value(row, name) for name in self.get_key_annotations())
+
+    def get_key_fields(self, queryset):
+        """ the columns the paginator needs to build its cursor from a row """
+        paginator = self.paginator
+        if paginator is None or not hasattr(paginator, 'get_ordering'):
+            return []
+        ordering = paginator.get_ordering(self.request, queryset, self)
+        return [field.lstrip('-') for field in ordering]
+
+    def uses_fragment_cache(self):
+        fragment_cache = get_fragment_cache()
+        return fragment_cache is not None and fragment_cache.is_cached(self.get_serializer_class())
+
+    def get_page_keys(self):
+        """
+        returns (paginated, rows): dicts with at least the pk for the fragment cache, else the loaded
+        page objects. either way the rows carry the get_key_annotations() values
+        """
+        if not hasattr(self, '_page_keys'):
+            if self.uses_fragment_cache():
+                keys = self.filter_queryset(self.get_key_queryset())
+                keys = keys.values('pk', *self.get_key_fields(keys))
+            else:
+                keys = self.filter_queryset(self.get_queryset())
+            annotations = self.get_key_annotations()
+            if annotations:
+                keys = keys.annotate(**annotations)
+            page = self.paginate_queryset(keys)
+            self._page_keys = (page is not None, list(page if page is not None else keys))
+        return self._page_keys
+
+
+class CachedListMixin(KeyQuerysetMixin):
+    """
+    list() assembled from cached per-object fragments: the page is selected on a values() query
+    of the key columns and only the cache misses are loaded and serialized
+    """
+
+    def list(self, request, *args, **kwargs):
+        fragment_cache = get_fragment_cache()
+        serializer_class = self.get_serializer_class()
+        context = self.get_serializer_context()
+        paginated, rows = self.get_page_keys()
+        if self.uses_fragment_cache():
+            versions = {row['pk']: self.get_row_version(row) for row in rows}
+            data = fragment_cache.get_or_serialize(serializer_class, self.get_queryset(), versions, context)
+        else:
+            # ListModelMixin.list with the serializer of market_app.api.fast, on the objects selected as keys
+            data = represent(serializer_class, rows, context)
+        if paginated:
+            return self.get_paginated_response(data)
+        return Response(data)
+
+
+class ConditionalMixin(KeyQuerysetMixin):
+    """
+    strong ETag and Last-Modified from the updated_at columns, selected with the object or the page
+    keys instead of serializing the body: no query of their own next to the one that loads the rows.
+    lists only get the ETag, a deleted row moves no timestamp. If-None-Match / If-Modified-Since
+    answer 304 and If-Match on PUT, PATCH and DELETE
+    answers 412 when the object changed in the meantime.
+    list views combine it with CachedListMixin, which reuses the page keys
+    """
+    # updated_at columns the representation depends on, including nested or named related rows
+    modified_fields = ['updated_at']
+
+    def get_latest(self):
+        return {f'latest_{i}': Max(field) for i, field in enumerate(self.modified_fields)}
+
+    def get_key_annotations(self):
+        # per row, only paths through a to-many relation need Max() and with it a GROUP BY
+        annotations = {}
+        for i, field in enumerate(self.modified_fields):
+            annotations[f'latest_{i}'] = Max(field) if self.is_to_many(field) else F(field)
+        return {**super().get_key_annotations(), **annotations}
+
+    def is_to_many(self, path):
+        model = self.get_serializer_class().Meta.model
+        for name in path.split('__')[:-1]:
+            field = model._meta.get_field(name)
+            if field.many_to_many or field.one_to_many:
+                return True
+            model = field.related_model
+        return False
+
+    def get_unprefetched_object(self):
+        """ the object with the ETag timestamps annotated, loaded once per request. a 304 needs no prefetches """
+        if not hasattr(self, '_object'):
+            queryset = self.filter_queryset(self.get_queryset()).annotate(**self.get_key_annotations())
+            self._object_prefetches = queryset._prefetch_related_lookups
+            lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+            obj = get_object_or_404(queryset.prefetch_related(None), **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+            self.check_object_permissions(self.request, obj)
+            self._object = obj
+        return self._object
+
+    def get_object(self):
+        """ GenericAPIView.get_object on the object of get_validators, its prefetches follow when the handler needs it """
+        obj = self.get_unprefetched_object()
+        if self._object_prefetches:
+            prefetch_related_objects([obj], *self._object_prefetches)
+            self._object_prefetches = ()
+        return obj
+
+    def get_validators(self, request):
+        latest = self.get_latest()
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+
+        if lookup_url_kwarg in self.kwargs:
+            # the object the handler works on, so a retrieve is one query
+            try:
+                rows = [self.get_unprefetched_object()]
+            except Http404:
+                # let the view answer 404
+                return None, None
+            state = ['1']
+        else:
+            paginated, rows = self.get_page_keys()
+            paginator = self.paginator
+            state = [str(row_value(row, 'pk')) for row in rows]
+            state += [str(getattr(paginator, 'has_next', '')), str(getattr(paginator, 'has_previous', ''))]
+
+        timestamps = [row_value(row, name) for row in rows for name in latest]
+        last_modified = None
+        if lookup_url_kwarg in self.kwargs:
+            # only for objects: a list loses rows without any timestamp moving, its ETag has the pks
+            last_modified = max((ts for ts in timestamps if ts is not None), default=None)
+        parts = [request.build_absolute_uri(), getattr(request, 'accepted_media_type', '')] + state
+        parts += [ts.isoformat() if ts else '' for ts in timestamps]
+        etag = quote_etag(hashlib.md5('|'.join(parts).encode(), usedforsecurity=False).hexdigest())
+        return etag, last_modified
+
+    def conditional(self, handler, request, *args, **kwargs):
+        if request.method in SAFE_METHODS:
+            return self.respond_conditionally(handler, request, *args, **kwargs)
+        # the If-Match check and the write in one transaction: with transaction_mode IMMEDIATE it holds the
+        # write lock from BEGIN, so of two writers with the same ETag the second reads the first one's
+        # write and answers 412 instead of overwriting it
+        model = self.get_serializer_class().Meta.model
+        with transaction.atomic(using=router.db_for_write(model)):
+            return self.respond_conditionally(handler, request, *args, **kwargs)
+
+    def respond_conditionally(self, handler, request, *args, **kwargs):
+        etag, last_modified = self.get_validators(request)
+        if etag is not None:
+            response = get_conditional_response(
+                request, etag=etag, last_modified=last_modified and int(last_modified.timestamp())
+            )
+            if response is not None:
+                return response
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code != 200 or request.method == 'DELETE':
+            return response
+        if request.method in ('PUT', 'PATCH'):
+            # the timestamps after the write
+            del self._object
+            etag, last_modified = self.get_validators(request)
+        if etag is not None:
+            response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified.timestamp())
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(super().retrieve, request, *args, **kwargs)
+
+    def update(self, request, *args, **kwargs):
+        # partial_update goes through update as well
+        return self.conditional(super().update, request, *args, **kwargs)
+
+    def destroy(self, request, *args, **kwargs):
+        return self.conditional(super().destroy, request, *args, **kwargs)
+
+
+def serialize_ids(view, ids):
+    """ the representations of the ids visible through the view's queryset, by pk, with one pk__in query """
+    serializer_class = view.get_serializer_class()
+    context = view.get_serializer_context()
+    fragment_cache = get_fragment_cache()
+    if fragment_cache is not None and fragment_cache.is_cached(serializer_class):
+        # like list(): the keys come from the database, a fragment alone does not prove the row is still visible
+        keys = view.get_key_queryset().filter(pk__in=ids).values('pk')
+        annotations = view.get_key_annotations()
+        if annotations:
+            keys = keys.annotate(**annotations)
+        versions = {row['pk']: view.get_row_version(row) for row in keys}
+        return fragment_cache.get_or_serialize_by_pk(serializer_class, view.get_queryset(), versions, context)
+    return serialize_pks(serializer_class, view.get_queryset(), ids, context)
+
+
+class MultiGetMixin:
+    """
+    many objects by id in one request: GET ?ids=3,1,2 on the list route, or POST {"ids": [...]} to
+    <list route>/ids/ for lists too long for a URL. all ids are loaded with one pk__in query
+    (cache hits not even that), the results keep the requested order and unknown ids are listed
+    in missing. at most MARKET_API_MAX_IDS ids per request
+    """
+
+    def get_max_ids(self):
+        return getattr(settings, 'MARKET_API_MAX_IDS', 100)
+
+    def parse_ids(self, data):
+        field = serializers.ListField(
+            child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=self.get_max_ids()
+        )
+        try:
+            ids = field.run_validation(data)
+        except serializers.ValidationError as exc:
+            raise serializers.ValidationError({'ids': exc.detail})
+        # a repeated id is returned once, at its first position
+        return list(dict.fromkeys(ids))
+
+    def multi_get(self, ids):
+        ids = self.parse_ids(ids)
+        found = serialize_ids(self, ids)
+        return Response({
+            'results': [found[pk] for pk in ids if pk in found],
+            'missing': [pk for pk in ids if pk not in found],
+        })
+
+    def list(self, request, *args, **kwargs):
+        if 'ids' in request.query_params:
+            return self.multi_get(split_names(request.query_params['ids']))
+        return super().list(request, *args, **kwargs)
+
+    @action(detail=False, methods=['post'], url_path='ids')
+    def ids(self, request, *args, **kwargs):
+        """ the POST variant of ?ids=, the body is {"ids": [...]} or the plain list """
+        data = request.data.get('ids') if isinstance(request.data, dict) else request.data
+        return self.multi_get(data)
+
+
+class ChangeFeedMixin:
+    """
+    ?since=<seq> on the list route: the objects created, updated or deleted after the cursor, from the
+    change log of market_app.changes. visible objects come in results, the ids of all others in deleted.
+    next_since is the cursor for the next call, has_more says whether to call again right away.
+    ?since=0 replays the whole log, a cursor behind the pruned part answers 410 with the current cursor
+    """
+
+    def get_change_limit(self):
+        page_size = settings.REST_FRAMEWORK.get('PAGE_SIZE', 100)
+        try:
+            page_size = int(self.request.query_params.get('page_size', page_size))
+        except ValueError:
+            pass
+        return max(1, min(page_size, getattr(settings, 'MARKET_API_MAX_PAGE_SIZE', 1000)))
+
+    def change_feed(self, since):
+        try:
+            since = serializers.IntegerField(min_value=0).run_validation(since)
+        except serializers.ValidationError as exc:
+            raise serializers.ValidationError({'since': exc.detail})
+        if changes.is_pruned(since):
+            return Response(
+                {'detail': 'Changes after this cursor were pruned, sync the full list again.',
+                 'since': changes.latest_seq()},
+                status=status.HTTP_410_GONE,
+            )
+
+        model = self.get_serializer_class().Meta.model
+        ids, next_since, has_more = changes.changes_since(model, since, self.get_change_limit())
+        found = serialize_ids(self, ids) if ids else {}
+        return Response({
+            'since': since,
+            'next_since': next_since,
+            'has_more': has_more,
+            'results': [found[pk] for pk in ids if pk in found],
+            'deleted': [pk for pk in ids if pk not in found],
+        })
+
+    def list(self, request, *args, **kwargs):
+        if 'since' in request.query_params:
+            return self.change_feed(request.query_params['since'])
+        return super().list(request, *args, **kwargs)
@@ -0,0 +1,168 @@
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import BooleanField, Expression, F, Q, Value
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+from rest_framework.utils.urls import replace_query_param
+
+
+class RowComparison(Expression):
+    """ (a, b) > (x, y) or < as one SQL row value comparison, SQLite has them since 3.15 """
+    conditional = True
+
+    def __init__(self, columns, values, op):
+        super().__init__(output_field=BooleanField())
+        self.columns, self.values, self.op = columns, values, op
+
+    def get_source_expressions(self):
+        return [*self.columns, *self.values]
+
+    def set_source_expressions(self, exprs):
+        self.columns, self.values = exprs[:len(self.columns)], exprs[len(self.columns):]
+
+    def as_sql(self, compiler, connection):
+        sides, params = [], []
+        for exprs in (self.columns, self.values):
+            parts = []
+            for expr in exprs:
+                sql, expr_params = compiler.compile(expr)
+                parts.append(sql)
+                params.extend(expr_params)
+            sides.append(', '.join(parts))
+        return f'({sides[0]}) {">" if self.op == "gt" else "<"} ({sides[1]})', params
+
+
+def reverse_ordering(ordering):
+    return tuple(field[1:] if field.startswith('-') else f'-{field}' for field in ordering)
+
+
+class KeysetPagination(CursorPagination):
+    """
+    keyset pagination: a cursor holds the values of every ordering column of the row it continues from,
+    the next page is `WHERE (price, id) > (<price>, <id>) ORDER BY price, id LIMIT n`. the ordering always
+    ends with the unique id (see KeysetOrderingFilter), so positions never tie and no page needs an OFFSET:
+    page 10.000 costs the same as page 1, also for ?ordering=price over thousands of equal prices.
+    next/previous are opaque cursors, clients can ask for ?page_size= up to MARKET_API_MAX_PAGE_SIZE
+    """
+    ordering = 'id'
+    page_size_query_param = 'page_size'
+
+    @property
+    def max_page_size(self):
+        return getattr(settings, 'MARKET_API_MAX_PAGE_SIZE', 1000)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.get_page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.set_page(list(queryset))
+
+    def get_page_queryset(self, queryset, request, view=None):
+        """
+        the requested page as an unevaluated query, with one row more to tell whether another page follows.
+        whoever runs it hands the rows to set_page(), the async views run it on the async ORM
+        """
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+
+        ordering = self.ordering
+        if self.cursor is not None and self.cursor.reverse:
+            ordering = reverse_ordering(ordering)
+        queryset = queryset.order_by(*ordering)
+        if self.cursor is not None:
+            queryset = queryset.filter(self.after(queryset, ordering, self.cursor.position))
+        return queryset[:self.page_size + 1]
+
+    def after(self, queryset, ordering, position):
+        """
+        the rows behind position in ordering. all columns in one direction (id follows the direction of the
+        first column) give the row value comparison (price, id) > (p, i), so the (price) index seeks straight
+        to the position instead of scanning its ties. mixed directions are spelled out as
+        price >= p AND (price > p OR (price = p AND id < i))
+        """
+        names = [field.lstrip('-') for field in ordering]
+        # the cursor came through JSON, its values are turned back into the column types.
+        # a tampered position is an invalid cursor, like one decode_cursor cannot read
+        try:
+            values = [
+                queryset.query.resolve_ref(name).output_field.to_python(value) for name, value in zip(names, position)
+            ]
+        except (ValidationError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if None in values:
+            # no column of an ordering is nullable, None would compare to nothing and answer an empty page
+            raise NotFound(self.invalid_cursor_message)
+        ops = ['lt' if field.startswith('-') else 'gt' for field in ordering]
+        if len(set(ops)) == 1:
+            return RowComparison([F(name) for name in names], [Value(value) for value in values], ops[0])
+
+        condition = Q(**{f'{names[-1]}__{ops[-1]}': values[-1]})
+        for name, op, value in reversed(list(zip(names, ops, values))[:-1]):
+            condition = Q(**{f'{name}__{op}': value}) | (Q(**{name: value}) & condition)
+        return Q(**{f'{names[0]}__{ops[0]}e': values[0]}) & condition
+
+    def set_page(self, results):
+        """ the page out of the rows of get_page_queryset(), in the requested order """
+        self.page = list(results[:self.page_size])
+        has_more = len(results) > self.page_size
+        if self.cursor is not None and self.cursor.reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.cursor is not None
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def get_position(self, row):
+        """ the ordering values of a row, a model instance or a values() dict """
+        names = [field.lstrip('-') for field in self.ordering]
+        if isinstance(row, dict):
+            return [row[name] for name in names]
+        return [getattr(row, name) for name in names]
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        position = self.get_position(self.page[-1]) if self.page else self.cursor.position
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=position))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        position = self.get_position(self.page[0]) if self.page else self.cursor.position
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=position))
+
+    def encode_cursor(self, cursor):
+        payload = json.dumps({'p': cursor.position, 'r': int(cursor.reverse)}, cls=DjangoJSONEncoder, separators=(',', ':'))
+        encoded = base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4)))
+            position, reverse = payload['p'], bool(payload.get('r'))
+        except (binascii.Error, UnicodeDecodeError, ValueError, TypeError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        # a cursor of another ordering has other columns
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return Cursor(offset=0, reverse=reverse, position=position)
+
+
+class MarketStatsPagination(KeysetPagination):
+    """ MarketStats has the market as primary key """
+    ordering = 'market_id'
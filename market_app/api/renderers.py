@@ -0,0 +1,63 @@
+"""
+JSON renderer and parser on orjson, with DRF's stdlib versions as fallback.
+
+    REST_FRAMEWORK = {
+        'DEFAULT_RENDERER_CLASSES': ['market_app.api.renderers.FastJSONRenderer', ...],
+        'DEFAULT_PARSER_CLASSES': ['market_app.api.renderers.FastJSONParser', ...],
+    }
+
+or renderer_classes / parser_classes on a single view.
+"""
+import codecs
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    renders the whole payload in one orjson.dumps() call. dicts, lists and str subclasses
+    (ReturnDict, ReturnList, Hyperlink) are encoded natively; Decimal, dates, times, querysets
+    and everything else orjson does not know go through DRF's encoder, so the output bytes stay
+    those of JSONRenderer. indented output (Accept: application/json; indent=4) and the
+    non-compact / ASCII-only settings are left to JSONRenderer, and so is anything orjson refuses
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or not self.compact or self.ensure_ascii:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type or '', renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(
+                data,
+                default=self.encoder_class().default,
+                option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS,
+            )
+        except orjson.JSONEncodeError:
+            # e.g. integers beyond 64 bit
+            return super().render(data, accepted_media_type, renderer_context)
+        # JSONRenderer escapes these two, JSON allows them but javascript string literals do not
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class FastJSONParser(JSONParser):
+    """ parses UTF-8 request bodies with orjson.loads(), other charsets with JSONParser """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        if orjson is None or codecs.lookup(encoding).name != 'utf-8':
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
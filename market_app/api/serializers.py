@@ -1,6 +1,13 @@
 from rest_framework import serializers
-from market_app.models import Market, Seller, Product
+from rest_framework.relations import MANY_RELATION_KWARGS
+from django.core.exceptions import ValidationError as DjangoValidationError
+from market_app.models import Market, MarketPurge, MarketStats, Seller, Product
 from django.urls import reverse
+from decimal import Decimal
+from django.db.models import Prefetch, prefetch_related_objects
+from .cache import fragment_cached
+from .links import CachedHyperlinkedIdentityField, CachedHyperlinkedRelatedField
+from .sparse import SparseSerializerMixin, model_columns
 
 
 # def validate_no_x(value):
@@ -23,6 +30,72 @@ def validate_no_x(value):       # usually validation of a serializer is outsourc
 
 
 
+class PrimaryKeySetField(serializers.ManyRelatedField):
+    """ many=True primary keys resolved with one pk__in query instead of one get() per id, same error messages """
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+
+        child = self.child_relation
+        queryset = child.get_queryset()
+        pks = []
+        for item in data:
+            if child.pk_field is not None:
+                item = child.pk_field.to_internal_value(item)
+            try:
+                if isinstance(item, bool):
+                    raise TypeError
+                pks.append(queryset.model._meta.pk.to_python(item))
+            except (TypeError, ValueError, DjangoValidationError):
+                child.fail('incorrect_type', data_type=type(item).__name__)
+
+        found = queryset.in_bulk(set(pks))
+        for item, pk in zip(data, pks):
+            if pk not in found:
+                child.fail('does_not_exist', pk_value=item)
+        return [found[pk] for pk in pks]
+
+
+class SetPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """ PrimaryKeyRelatedField whose many=True variant is a PrimaryKeySetField """
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        list_kwargs.update({key: value for key, value in kwargs.items() if key in MANY_RELATION_KWARGS})
+        return PrimaryKeySetField(**list_kwargs)
+
+
+def keep_previous_values(product):
+    """
+    hands market, price and seller of a loaded product to the pre_save receiver in market_app.signals,
+    which would otherwise read them again before moving the stats and counters
+    """
+    if 'price' in product.__dict__:
+        product._stats_previous = (product.market_id, product.price, product.seller_id)
+
+
+class ProductWriteMixin:
+    """ update() of the product model serializers, see keep_previous_values """
+
+    def update(self, instance, validated_data):
+        keep_previous_values(instance)
+        return super().update(instance, validated_data)
+
+
+class IdListField(serializers.ListField):
+    """ a list of ids, also given as '1;2;3' (a CSV cell) """
+    child = serializers.IntegerField()
+
+    def to_internal_value(self, data):
+        if isinstance(data, str):
+            data = [part.strip() for part in data.split(';') if part.strip()]
+        return super().to_internal_value(data)
+
+
 # MarketSerializer without ModelSerializer - Learning
 
 # class MarketSerializer(serializers.Serializer):
@@ -52,16 +125,29 @@ def validate_no_x(value):       # usually validation of a serializer is outsourc
 
 # HyperlinkedRelatedField
 
-class MarketSerializer(serializers.ModelSerializer):
+@fragment_cached
+class MarketSerializer(SparseSerializerMixin, serializers.ModelSerializer):
 
-    sellers = serializers.HyperlinkedRelatedField(many=True, read_only=True, view_name='seller-detail')
+    # the URL pattern is reversed once per process, see market_app.api.links
+    sellers = CachedHyperlinkedRelatedField(many=True, read_only=True, view_name='seller-detail')
 
     class Meta:
         model = Market
-        fields = '__all__'
+        exclude = ['updated_at', 'relations_updated_at', 'deleted_at']
+
+    @staticmethod
+    def setup_eager_loading(queryset, fields=None, expand=()):
+        """ the seller hyperlinks only need the seller ids, with ?fields= only the rendered columns are loaded """
+        if fields is not None:
+            queryset = queryset.only(*model_columns(Market, fields))
+        if fields is None or 'sellers' in fields:
+            queryset = queryset.prefetch_related(Prefetch('sellers', queryset=Seller.objects.only('id')))
+        return queryset
 
 
 class MarketHyperlinkedSerializer(MarketSerializer, serializers.HyperlinkedModelSerializer):
+    serializer_url_field = CachedHyperlinkedIdentityField
+    serializer_related_field = CachedHyperlinkedRelatedField
     sellers = None
 
     """
@@ -87,7 +173,7 @@ class MarketHyperlinkedSerializer(MarketSerializer, serializers.HyperlinkedModel
 
     class Meta:
         model = Market
-        fields = ['id', 'name', 'url', 'location', 'description', 'net_worth']
+        fields = ['id', 'name', 'url', 'location', 'description', 'net_worth', 'seller_count', 'product_count']
 
 
 
@@ -146,29 +232,62 @@ class MarketHyperlinkedSerializer(MarketSerializer, serializers.HyperlinkedModel
 #         ]
 
 
-class SellerSerializer(serializers.ModelSerializer):
+@fragment_cached
+class SellerSerializer(SparseSerializerMixin, serializers.ModelSerializer):
     markets = MarketSerializer(many=True, read_only=True)
-    market_id = serializers.PrimaryKeyRelatedField(
-        queryset=Market.objects.all(),
+    # one query for all ids, only the pks are needed to link them
+    market_id = SetPrimaryKeyRelatedField(
+        queryset=Market.objects.only('id'),
         many=True,
         write_only=True,
         source='markets'
     )
 
-    market_count = serializers.SerializerMethodField()
-
     class Meta:
         model = Seller
-        fields = ['id', 'name', 'market_id', 'market_count', 'markets', 'contact_info']
-
-    def get_market_count(self, obj):
-        return obj.markets.count()
-
-
+        # the counts are columns kept up to date by market_app.counters
+        fields = ['id', 'name', 'market_id', 'market_count', 'product_count', 'markets', 'contact_info']
+        expandable_fields = {'markets': (MarketSerializer, {'many': True})}
+
+    def to_representation(self, instance):
+        # a seller just created or updated has no prefetched markets, load them with their seller links
+        # in two queries instead of one per market. the counters of the markets changed with the links,
+        # so the market_id instances from validation would render old counts
+        if 'markets' in self.fields and 'markets' not in getattr(instance, '_prefetched_objects_cache', {}):
+            markets = Prefetch('markets', queryset=MarketSerializer.setup_eager_loading(Market.objects.all()))
+            prefetch_related_objects([instance], markets)
+        return super().to_representation(instance)
+
+    @staticmethod
+    def setup_eager_loading(queryset, fields=None, expand=()):
+        """
+        loads everything the serializer renders in a fixed number of queries:
+        markets and their seller links are prefetched. with ?fields= only when they are rendered
+        """
+        if fields is not None:
+            queryset = queryset.only(*model_columns(Seller, fields))
+        if fields is None or 'markets' in fields:
+            markets = Prefetch('markets', queryset=MarketSerializer.setup_eager_loading(Market.objects.all()))
+            queryset = queryset.prefetch_related(markets)
+        return queryset
+
+
+@fragment_cached
 class SellerListSerializer(SellerSerializer, serializers.HyperlinkedModelSerializer):
+    serializer_url_field = CachedHyperlinkedIdentityField
+    serializer_related_field = CachedHyperlinkedRelatedField
+
     class Meta:
         model = Seller
-        fields = ['url', 'name', 'market_id', 'market_count', 'contact_info']
+        fields = ['url', 'name', 'market_id', 'market_count', 'product_count', 'contact_info']
+        expandable_fields = {'markets': (MarketSerializer, {'many': True})}
+
+    @staticmethod
+    def setup_eager_loading(queryset, fields=None, expand=()):
+        """ markets are only rendered with ?expand=markets, the counts are columns """
+        if fields is None:
+            return queryset
+        return SellerSerializer.setup_eager_loading(queryset, fields, expand)
 
 
 # The SellerSerializer replaces both SellerDetailSerializer and SellerCreateSerializer \
@@ -188,20 +307,21 @@ class SellerCreateSerializer(serializers.Serializer):
     markets = serializers.ListField(child=serializers.IntegerField(), write_only=True)
 
     def validate_markets(self, value):
-        markets = Market.objects.filter(id__in=value)
-        if len(markets) != len(value):
+        # only the ids are needed, create() links them without loading the markets again
+        found = set(Market.objects.filter(id__in=value).values_list('id', flat=True))
+        if found != set(value):
             raise serializers.ValidationError("One or more Market-Ids not found")
         return value
 
     def create(self, validated_data):
         market_ids = validated_data.pop('markets')
         seller = Seller.objects.create(**validated_data)
-        markets_new = Market.objects.filter(id__in=market_ids)
-        seller.markets.set(markets_new)
+        seller.markets.set(market_ids)
         return seller
 
 
-class ProductSerializer(serializers.ModelSerializer):
+@fragment_cached
+class ProductSerializer(ProductWriteMixin, SparseSerializerMixin, serializers.ModelSerializer):
     # only name of market & seller
     market = serializers.StringRelatedField()
     seller = serializers.StringRelatedField()
@@ -213,14 +333,15 @@ class ProductSerializer(serializers.ModelSerializer):
     # market = serializers.SerializerMethodField()
     # seller = serializers.SerializerMethodField()
 
+    # the name is all the response renders of market and seller
     market_id = serializers.PrimaryKeyRelatedField(
-        queryset=Market.objects.all(),
+        queryset=Market.objects.only('id', 'name'),
         write_only=True,
         source='market'
     )
 
     seller_id = serializers.PrimaryKeyRelatedField(
-        queryset=Seller.objects.all(),
+        queryset=Seller.objects.only('id', 'name'),
         write_only=True,
         source='seller'
     )
@@ -228,6 +349,26 @@ class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
         fields = ['id', 'name', 'description', 'price', 'market', 'seller', 'market_id', 'seller_id']
+        expandable_fields = {'market': (MarketSerializer, {}), 'seller': (SellerDetailSerializer, {})}
+
+    @staticmethod
+    def setup_eager_loading(queryset, fields=None, expand=()):
+        """
+        joins market and seller in the same query, but only the columns rendered by
+        StringRelatedField (their __str__ is the name) instead of the full related rows.
+        ?fields= leaves out the unrendered columns and joins, ?expand= loads the whole related row
+        """
+        columns = model_columns(Product, ['name', 'description', 'price'] if fields is None else fields)
+        related = [name for name in ['market', 'seller'] if fields is None or name in fields]
+        for name in related:
+            columns.append(name if name in expand else f'{name}__name')
+        if related:
+            queryset = queryset.select_related(*related)
+        if 'market' in expand:
+            queryset = queryset.prefetch_related(Prefetch('market__sellers', queryset=Seller.objects.only('id')))
+        if 'seller' in expand:
+            queryset = queryset.prefetch_related(Prefetch('seller__markets', queryset=Market.objects.only('id', 'name')))
+        return queryset.only(*columns)
 
     # def get_seller(self, obj):
     #     """ returns the seller as a dictionary with name and URL """
@@ -250,7 +391,9 @@ class ProductSerializer(serializers.ModelSerializer):
     #     return None
 
 
-class ProductHyperlinkedSerializer(serializers.HyperlinkedModelSerializer):
+class ProductHyperlinkedSerializer(ProductWriteMixin, SparseSerializerMixin, serializers.HyperlinkedModelSerializer):
+    serializer_url_field = CachedHyperlinkedIdentityField
+    serializer_related_field = CachedHyperlinkedRelatedField
 
     # only name of market & seller
     market = serializers.StringRelatedField()
@@ -261,13 +404,13 @@ class ProductHyperlinkedSerializer(serializers.HyperlinkedModelSerializer):
     # seller = SellerSerializer(read_only=True)
 
     market_id = serializers.PrimaryKeyRelatedField(
-        queryset=Market.objects.all(),
+        queryset=Market.objects.only('id', 'name'),
         write_only=True,
         source='market'
     )
 
     seller_id = serializers.PrimaryKeyRelatedField(
-        queryset=Seller.objects.all(),
+        queryset=Seller.objects.only('id', 'name'),
         write_only=True,
         source='seller'
     )
@@ -275,6 +418,71 @@ class ProductHyperlinkedSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = Product
         fields = ['id', 'url', 'name', 'description', 'price', 'market', 'seller', 'market_id', 'seller_id']
+        expandable_fields = ProductSerializer.Meta.expandable_fields
+
+    @staticmethod
+    def setup_eager_loading(queryset, fields=None, expand=()):
+        # url only needs the pk, so the columns are the same as for ProductSerializer
+        return ProductSerializer.setup_eager_loading(queryset, fields, expand)
+
+
+class MarketStatsSerializer(SparseSerializerMixin, serializers.ModelSerializer):
+    """ read-only, the numbers are maintained by market_app.stats """
+    avg_price = serializers.SerializerMethodField()
+
+    class Meta:
+        model = MarketStats
+        fields = ['market', 'product_count', 'seller_count', 'avg_price', 'min_price', 'max_price', 'total_value']
+        read_only_fields = fields
+
+    def get_avg_price(self, obj):
+        if not obj.product_count:
+            return None
+        return format((Decimal(obj.total_value) / obj.product_count).quantize(Decimal('0.01')), 'f')
+
+
+class MarketPurgeSerializer(serializers.ModelSerializer):
+    """ progress of a market deletion, see market_app.purge """
+    progress = serializers.SerializerMethodField()
+
+    class Meta:
+        model = MarketPurge
+        fields = [
+            'market_id', 'total_products', 'deleted_products', 'total_links', 'deleted_links',
+            'progress', 'requested_at', 'finished_at',
+        ]
+        read_only_fields = fields
+
+    def get_progress(self, obj):
+        """ share of the rows removed so far, 1.0 once the market row is gone """
+        if obj.finished_at is not None:
+            return 1.0
+        total = obj.total_products + obj.total_links
+        if not total:
+            return 0.0
+        return round(min((obj.deleted_products + obj.deleted_links) / total, 1.0), 4)
+
+
+class SellerBulkRowSerializer(serializers.Serializer):
+    """
+    one seller of a bulk onboarding. the market ids of all rows are checked at once
+    in bulk.validate_seller_rows
+    """
+    name = serializers.CharField(max_length=255)
+    contact_info = serializers.CharField()
+    market_ids = IdListField(write_only=True)
+
+
+class ProductBulkRowSerializer(serializers.Serializer):
+    """
+    one row of a bulk price list upload. market_id and seller_id are plain integers here,
+    their existence is checked for the whole batch at once in bulk.validate_rows
+    """
+    name = serializers.CharField(max_length=255)
+    description = serializers.CharField()
+    price = serializers.DecimalField(max_digits=50, decimal_places=2)
+    market_id = serializers.IntegerField()
+    seller_id = serializers.IntegerField()
 
 
 class ProductDetailSerializer(serializers.Serializer):
@@ -291,38 +499,26 @@ class ProductCreateSerializer(serializers.Serializer):
     name = serializers.CharField(max_length=255)
     description = serializers.CharField()
     price = serializers.DecimalField(max_digits=50, decimal_places=2)
-    market_id = serializers.IntegerField(write_only=True)
-    seller_id = serializers.IntegerField(write_only=True)
-
-    def validate_market_id(self, value):
-        market_id = Market.objects.filter(id=value)
-        if market_id:
-            return value
-        else:
-            raise serializers.ValidationError("Market not found")
-
-    def validate_seller_id(self, value):
-        seller_id = Seller.objects.filter(id=value)
-        if seller_id:
-            return value
-        else:
-            raise serializers.ValidationError("Seller not found")
+    # one get() per id during validation, create() and update() use the loaded market and seller
+    market_id = serializers.PrimaryKeyRelatedField(
+        queryset=Market.objects.only('id', 'name'),
+        write_only=True,
+        source='market',
+        error_messages={'does_not_exist': 'Market not found'}
+    )
+    seller_id = serializers.PrimaryKeyRelatedField(
+        queryset=Seller.objects.only('id', 'name'),
+        write_only=True,
+        source='seller',
+        error_messages={'does_not_exist': 'Seller not found'}
+    )
 
     def create(self, validated_data):
-        market_id = validated_data.pop("market_id")
-        seller_id = validated_data.pop("seller_id")
-
-        market = Market.objects.get(id=market_id)
-        seller = Seller.objects.get(id=seller_id)
-
-        product = Product.objects.create(market=market, seller=seller, **validated_data)
-        return product
+        return Product.objects.create(**validated_data)
 
     def update(self, instance, validated_data):
-        instance.name = validated_data.get('name', instance.name)
-        instance.description = validated_data.get('description', instance.description)
-        instance.price = validated_data.get('price', instance.price)
-        instance.market_id = validated_data.get('market_id', instance.market_id)
-        instance.seller_id = validated_data.get('market_id', instance.seller_id)
+        keep_previous_values(instance)
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
         instance.save()
         return instance
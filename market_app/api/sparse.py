@@ -0,0 +1,136 @@
+"""
+sparse fieldsets for the DRF views:
+
+    /api/products/?fields=id,name,price
+    /api/products/?fields=id,name&expand=market
+
+?fields= keeps only the listed fields of the representation, ?expand= renders the relations in
+Meta.expandable_fields as nested objects (and implies them in ?fields=). The selection is also
+pushed down into the queryset: setup_eager_loading(queryset, fields, expand) of the serializer
+loads only the rendered columns, joins and prefetches, so a list of names never reads the
+description TEXT column and a seller list without markets never prefetches them.
+"""
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+
+def split_names(value):
+    return [name.strip() for name in (value or '').split(',') if name.strip()]
+
+
+def model_columns(model, names):
+    """ the concrete columns of model among the rendered field names, always with the pk """
+    columns = [model._meta.pk.name]
+    for name in names:
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            continue
+        if field.concrete and not field.is_relation and name not in columns:
+            columns.append(name)
+    return columns
+
+
+class FieldSelection:
+    """ the fields and expanded relations a request asked for """
+
+    def __init__(self, fields=None, expand=()):
+        # None renders every field
+        self.fields = None if fields is None else frozenset(fields) | frozenset(expand)
+        self.expand = tuple(expand)
+
+    @classmethod
+    def from_query(cls, query_params, serializer_class):
+        """ None without ?fields= and ?expand=, a 400 for names the serializer does not render """
+        fields = split_names(query_params.get('fields'))
+        expand = split_names(query_params.get('expand'))
+        if not fields and not expand:
+            return None
+
+        readable = [name for name, field in serializer_class().fields.items() if not field.write_only]
+        expandable = getattr(getattr(serializer_class, 'Meta', None), 'expandable_fields', {})
+        errors = {}
+        unknown = [name for name in fields if name not in readable and name not in expandable]
+        if unknown:
+            errors['fields'] = [f'Unknown field(s): {", ".join(unknown)}. Available: {", ".join(readable)}']
+        unknown = [name for name in expand if name not in expandable]
+        if unknown:
+            errors['expand'] = [f'Cannot expand: {", ".join(unknown)}. Available: {", ".join(expandable) or "none"}']
+        if errors:
+            raise serializers.ValidationError(errors)
+        return cls(fields or None, expand)
+
+    def keep(self, name):
+        return self.fields is None or name in self.fields
+
+    def project(self, item):
+        """ a new dict with the selected keys of a full representation, item itself is left alone """
+        return {name: value for name, value in item.items() if self.keep(name)}
+
+
+class SparseSerializerMixin:
+    """
+    drops the fields outside context['selection'] and nests Meta.expandable_fields
+    ({name: (serializer class, kwargs)}). only the serializer the view renders applies it,
+    nested serializers always render in full
+    """
+
+    def is_outermost(self):
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        return parent is None
+
+    def is_write(self):
+        request = self.context.get('request')
+        return request is not None and request.method not in SAFE_METHODS
+
+    def get_fields(self):
+        fields = super().get_fields()
+        selection = self.context.get('selection')
+        if selection is None or not self.is_outermost():
+            return fields
+        for name in selection.expand:
+            serializer_class, kwargs = self.Meta.expandable_fields[name]
+            fields[name] = serializer_class(read_only=True, **kwargs)
+        if self.is_write():
+            # a POST / PUT / PATCH validates and saves every field, to_representation trims the response
+            return fields
+        # write-only fields are not rendered
+        return {name: field for name, field in fields.items() if field.write_only or selection.keep(name)}
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        selection = self.context.get('selection')
+        if selection is not None and self.is_outermost() and self.is_write():
+            return selection.project(data)
+        return data
+
+
+class SparseFieldsMixin:
+    """ ?fields= / ?expand= for a DRF view, the selection goes to the serializer and into get_queryset() """
+
+    def get_field_selection(self):
+        if not hasattr(self, '_field_selection'):
+            self._field_selection = FieldSelection.from_query(self.request.query_params, self.get_serializer_class())
+        return self._field_selection
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['selection'] = self.get_field_selection()
+        return context
+
+    def eager_queryset(self, queryset):
+        """ queryset with what the serializer renders loaded up front, narrowed to the selection for reads """
+        serializer_class = self.get_serializer_class()
+        if not hasattr(serializer_class, 'setup_eager_loading'):
+            return queryset
+        selection = self.get_field_selection()
+        if selection is None or self.request.method not in SAFE_METHODS:
+            # writes save the instance, so it is loaded in full
+            return serializer_class.setup_eager_loading(queryset)
+        return serializer_class.setup_eager_loading(queryset, selection.fields, selection.expand)
+
+    def get_queryset(self):
+        return self.eager_queryset(super().get_queryset())
@@ -0,0 +1,256 @@
+"""
+per-request instrumentation: query count, SQL time, repeated query shapes (N+1), serializer and
+render time. Enabled with
+
+    MARKET_API_TIMING = {
+        'SAMPLE_RATE': 0.1,     # share of requests that are measured
+        'HEADER': True,         # Server-Timing response header
+        'LOGGER': 'market_app.timing',
+        'EXPOSE': False,        # /api/timing/ serves the per-route histograms as Prometheus text
+    }
+
+ServerTimingMiddleware measures the request and wraps every database connection with an
+execute_wrapper (no debug cursor, no stored SQL). TimingMixin adds the serializer and render
+split for the DRF views. Requests outside the sample only cost a random() call.
+"""
+import json
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import HttpResponse
+
+current = ContextVar('market_app_timing', default=None)
+
+# (%s, %s, %s) of an __in lookup, so the same query shape matches whatever the list length
+IN_LIST = re.compile(r'\((?:%s, )+%s\)')
+
+MS_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+QUERY_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+
+def get_config():
+    return getattr(settings, 'MARKET_API_TIMING', None)
+
+
+class RequestMetrics:
+    """ what one request spent, filled by the SQL wrapper and measure() """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql = 0.0
+        self.shapes = Counter()
+        self.spans = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper() hook
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql += time.perf_counter() - start
+            self.queries += 1
+            self.shapes[IN_LIST.sub('(%s, ...)', sql)] += 1
+
+    @property
+    def repeated(self):
+        """ queries that ran with the same SQL as an earlier one of the request, the N+1 signature """
+        return {sql: count for sql, count in self.shapes.items() if count > 1}
+
+    def summary(self):
+        total = time.perf_counter() - self.started
+        return {
+            'total_ms': round(total * 1000, 2),
+            'sql_ms': round(self.sql * 1000, 2),
+            'queries': self.queries,
+            'repeated_queries': sum(count - 1 for count in self.repeated.values()),
+            'serialize_ms': round(self.spans['serialize'] * 1000, 2),
+            'render_ms': round(self.spans['render'] * 1000, 2),
+        }
+
+
+@contextmanager
+def measure(name):
+    """ adds the time of the block to the current request's span, a no-op outside measured requests """
+    metrics = current.get()
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.spans[name] += time.perf_counter() - start
+
+
+def timed(name, func):
+    def wrapper(*args, **kwargs):
+        with measure(name):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+class RouteHistograms:
+    """ cumulative bucket counts per route and metric, for this process """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+
+    def observe(self, route, summary):
+        with self._lock:
+            for metric, value in summary.items():
+                if metric == 'repeated_queries':
+                    continue
+                buckets = QUERY_BUCKETS if metric == 'queries' else MS_BUCKETS
+                entry = self._data.setdefault((route, metric), {'buckets': [0] * len(buckets), 'sum': 0, 'count': 0})
+                for i, bound in enumerate(buckets):
+                    if value <= bound:
+                        entry['buckets'][i] += 1
+                entry['sum'] += value
+                entry['count'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {key: {**entry, 'buckets': list(entry['buckets'])} for key, entry in self._data.items()}
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def prometheus(self):
+        lines = []
+        snapshot = self.snapshot()
+        for metric in sorted({metric for _, metric in snapshot}):
+            name = f'market_api_request_{metric}'
+            buckets = QUERY_BUCKETS if metric == 'queries' else MS_BUCKETS
+            lines.append(f'# TYPE {name} histogram')
+            for (route, entry_metric), entry in sorted(snapshot.items()):
+                if entry_metric != metric:
+                    continue
+                label = route.replace('\\', '\\\\').replace('"', '\\"')
+                for bound, count in zip(buckets, entry['buckets']):
+                    lines.append(f'{name}_bucket{{route="{label}",le="{bound}"}} {count}')
+                lines.append(f'{name}_bucket{{route="{label}",le="+Inf"}} {entry["count"]}')
+                lines.append(f'{name}_sum{{route="{label}"}} {entry["sum"]}')
+                lines.append(f'{name}_count{{route="{label}"}} {entry["count"]}')
+        return '\n'.join(lines) + '\n'
+
+
+histograms = RouteHistograms()
+
+
+def server_timing(summary):
+    return ', '.join([
+        f'sql;dur={summary["sql_ms"]};desc="{summary["queries"]} queries, {summary["repeated_queries"]} repeated"',
+        f'serialize;dur={summary["serialize_ms"]}',
+        f'render;dur={summary["render_ms"]}',
+        f'total;dur={summary["total_ms"]}',
+    ])
+
+
+class ServerTimingMiddleware:
+    """ measures a sample of the requests, see the module docstring. async-capable like ReplicaPinningMiddleware """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        config = get_config()
+        if not config:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        self.sample_rate = config.get('SAMPLE_RATE', 1.0)
+        self.header = config.get('HEADER', True)
+        self.logger = logging.getLogger(config.get('LOGGER', 'market_app.timing'))
+
+    def is_sampled(self):
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.is_sampled():
+            return self.get_response(request)
+
+        metrics = RequestMetrics()
+        token = current.set(metrics)
+        try:
+            with ExitStack() as stack:
+                wrap_connections(stack, metrics)
+                response = self.get_response(request)
+        finally:
+            current.reset(token)
+        return self.report(request, response, metrics)
+
+    async def __acall__(self, request):
+        if not self.is_sampled():
+            return await self.get_response(request)
+
+        metrics = RequestMetrics()
+        token = current.set(metrics)
+        stack = ExitStack()
+        try:
+            # the async ORM queries run on the thread of the request's sync_to_async calls,
+            # the connections of that thread get the wrapper
+            await sync_to_async(wrap_connections)(stack, metrics)
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+            current.reset(token)
+        return self.report(request, response, metrics)
+
+    def report(self, request, response, metrics):
+        summary = metrics.summary()
+        match = request.resolver_match
+        route = f'{request.method} {match.route.rstrip("$") if match else "unmatched"}'
+        histograms.observe(route, summary)
+        if self.header:
+            response['Server-Timing'] = server_timing(summary)
+        if self.logger.isEnabledFor(logging.INFO):
+            record = {'route': route, 'path': request.path, 'status': response.status_code, **summary}
+            if metrics.repeated:
+                sql, count = max(metrics.repeated.items(), key=lambda item: item[1])
+                record['most_repeated'] = {'count': count, 'sql': sql[:300]}
+            self.logger.info(json.dumps(record))
+        return response
+
+
+def wrap_connections(stack, metrics):
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(metrics))
+
+
+class TimingMixin:
+    """ splits the view time of a DRF view into serializer and renderer time for ServerTimingMiddleware """
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        if current.get() is not None:
+            # the outermost to_representation, nested fields are part of it
+            serializer.to_representation = timed('serialize', serializer.to_representation)
+        return serializer
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        renderer = getattr(response, 'accepted_renderer', None)
+        if renderer is not None and current.get() is not None:
+            # content negotiation created this renderer instance for this request only
+            renderer.render = timed('render', renderer.render)
+        return response
+
+
+def timing_metrics(request):
+    """ the per-route histograms of this process in Prometheus text format """
+    return HttpResponse(histograms.prometheus(), content_type='text/plain; version=0.0.4')
@@ -2,20 +2,35 @@ from django.urls import path, include
 from .views import markets_view, market_single_view, sellers_view, \
     products_view, product_single_view, seller_single_view, MarketsView, \
     MarketSingleView, SellerOfMarketList, ProductViewSet, SellersView, SellerSingleView, \
-    SellerViewSet
+    SellerViewSet, MarketStatsList, MarketStatsView, MarketPurgeView, MarketIdsView
 from rest_framework import routers
+from django.conf import settings
+from .async_views import ROUTES as ASYNC_ROUTES
+from .timing import timing_metrics
 
 router = routers.SimpleRouter()
 router.register(r'products', ProductViewSet)
 router.register(r'sellers', SellerViewSet)
 
-urlpatterns = [
+# routes listed in MARKET_API_ASYNC_ROUTES serve GET from the async views, they have to come first
+async_urlpatterns = [
+    url for route in getattr(settings, 'MARKET_API_ASYNC_ROUTES', []) for url in ASYNC_ROUTES[route].urls()
+]
+
+urlpatterns = async_urlpatterns + [
     path('', include(router.urls)),
     path('market/', MarketsView.as_view()),
+    path('market/ids/', MarketIdsView.as_view(), name='market-ids'),
     path('market/<int:pk>/', MarketSingleView.as_view(), name='market-detail'),
     path('market/<int:pk>/sellers/', SellerOfMarketList.as_view(), name='market-detail'),
+    path('market/stats/', MarketStatsList.as_view(), name='market-stats-list'),
+    path('market/<int:pk>/stats/', MarketStatsView.as_view(), name='market-stats'),
+    path('market/<int:pk>/purge/', MarketPurgeView.as_view(), name='market-purge'),
     # path('seller/', SellersView.as_view()),
     # path('seller/<int:pk>/', SellerSingleView.as_view(), name='seller-detail'),
     # path('product/', products_view),
     # path('product/<int:pk>/', product_single_view, name='product-detail')
 ]
+
+if (getattr(settings, 'MARKET_API_TIMING', None) or {}).get('EXPOSE'):
+    urlpatterns.append(path('timing/', timing_metrics))
@@ -1,22 +1,48 @@
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, action
 from rest_framework.response import Response
 from rest_framework import status
 from .serializers import MarketSerializer, SellerDetailSerializer, \
     SellerCreateSerializer, ProductDetailSerializer, ProductCreateSerializer, SellerSerializer, \
-    MarketHyperlinkedSerializer, ProductSerializer, ProductHyperlinkedSerializer, SellerListSerializer
-from market_app.models import Market, Seller, Product
+    MarketHyperlinkedSerializer, ProductSerializer, ProductHyperlinkedSerializer, SellerListSerializer, \
+    MarketStatsSerializer, MarketPurgeSerializer
+from market_app import stats
+from market_app.models import Market, MarketPurge, MarketStats, Seller, Product
+from market_app.purge import soft_delete
 from django.shortcuts import redirect
+from django.urls import reverse
 from rest_framework.views import APIView
 from rest_framework import mixins
 from rest_framework import generics
 
 from django.shortcuts import get_object_or_404
+from django.http import Http404, StreamingHttpResponse
 from rest_framework import viewsets
-
-
-class MarketsView(generics.ListAPIView):
+from .parsers import CSVParser
+from .renderers import FastJSONParser
+from .bulk import ingest_products, onboard_sellers
+from .export import EXPORT_FORMATS
+from .filters import ProductFilter, FullTextSearchFilter, KeysetOrderingFilter
+from .mixins import CachedListMixin, ChangeFeedMixin, ConditionalMixin, MultiGetMixin
+from .pagination import MarketStatsPagination
+from .sparse import SparseFieldsMixin
+from .timing import TimingMixin
+
+
+class MarketsView(TimingMixin, SparseFieldsMixin, MultiGetMixin, ChangeFeedMixin, ConditionalMixin, CachedListMixin,
+                  generics.ListAPIView):
+    # setup_eager_loading is applied per request by SparseFieldsMixin
     queryset = Market.objects.all()
     serializer_class = MarketSerializer
+    # the seller links and counters move relations_updated_at
+    modified_fields = ['updated_at', 'relations_updated_at']
+
+
+class MarketIdsView(MarketsView):
+    """ POST {"ids": [...]}, the ?ids= lookup of MarketsView for id lists too long for a URL """
+    http_method_names = ['post', 'options']
+
+    def post(self, request, *args, **kwargs):
+        return self.ids(request, *args, **kwargs)
 
 
 """ generic class-based views: GenericAPIView with Mixins"""
@@ -65,23 +91,49 @@ def markets_view(request):
 #         return market.sellers.all()
 
 
-class SellerOfMarketList(generics.ListCreateAPIView):
+class SellerOfMarketList(TimingMixin, SparseFieldsMixin, ConditionalMixin, CachedListMixin, generics.ListCreateAPIView):
     serializer_class = SellerListSerializer
+    modified_fields = ['updated_at', 'relations_updated_at']
+
+    def get_market(self):
+        # one lookup per request, shared by get_queryset and perform_create
+        if not hasattr(self, '_market'):
+            self._market = get_object_or_404(Market, pk=self.kwargs.get('pk'))
+        return self._market
 
     def get_queryset(self):
-        pk = self.kwargs.get('pk')
-        market = Market.objects.get(pk=pk)
-        return market.sellers.all()
+        return self.eager_queryset(Seller.objects.filter(markets=self.get_market()))
+
+    def get_key_queryset(self):
+        return Seller.objects.filter(markets=self.kwargs.get('pk'))
 
     def perform_create(self, serializer):
-        pk = self.kwargs.get('pk')
-        market = Market.objects.get(pk=pk)
-        serializer.save(markets=[market])
+        # this market and any other given in market_id
+        markets = [self.get_market(), *serializer.validated_data.get('markets', [])]
+        serializer.save(markets=list({market.pk: market for market in markets}.values()))
 
 
-class MarketSingleView(generics.RetrieveUpdateDestroyAPIView):
+class MarketSingleView(TimingMixin, SparseFieldsMixin, ConditionalMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Market.objects.all()
     serializer_class = MarketSerializer
+    modified_fields = ['updated_at', 'relations_updated_at']
+
+    def destroy(self, request, *args, **kwargs):
+        """ hides the market at once, its rows are purged in the background (manage.py purge_markets) """
+        return self.conditional(self.schedule_purge, request, *args, **kwargs)
+
+    def schedule_purge(self, request, *args, **kwargs):
+        purge = soft_delete(self.get_object())
+        location = reverse('market-purge', kwargs={'pk': purge.market_id})
+        return Response(MarketPurgeSerializer(purge).data, status=status.HTTP_202_ACCEPTED, headers={'Location': location})
+
+
+class MarketPurgeView(generics.RetrieveAPIView):
+    """ progress of a market deletion, kept after the market is gone """
+    queryset = MarketPurge.objects.all()
+    serializer_class = MarketPurgeSerializer
+    lookup_field = 'market_id'
+    lookup_url_kwarg = 'pk'
 
 
 # class MarketSingleView(mixins.RetrieveModelMixin,
@@ -102,6 +154,29 @@ class MarketSingleView(generics.RetrieveUpdateDestroyAPIView):
 #         return self.destroy(request, *args, **kwargs)
 
 
+class MarketStatsList(TimingMixin, SparseFieldsMixin, generics.ListAPIView):
+    """ the stats of all markets, read from the summary table """
+    queryset = MarketStats.objects.filter(market__deleted_at=None)
+    serializer_class = MarketStatsSerializer
+    pagination_class = MarketStatsPagination
+
+
+class MarketStatsView(TimingMixin, SparseFieldsMixin, generics.RetrieveAPIView):
+    queryset = MarketStats.objects.filter(market__deleted_at=None)
+    serializer_class = MarketStatsSerializer
+    lookup_field = 'market_id'
+    lookup_url_kwarg = 'pk'
+
+    def get_object(self):
+        try:
+            return super().get_object()
+        except Http404:
+            # a market from bulk_create has no stats row yet
+            if not stats.rebuild([self.kwargs['pk']]):
+                raise
+            return super().get_object()
+
+
 @api_view(['GET', 'DELETE', 'PUT'])
 def market_single_view(request, pk):
     
@@ -122,19 +197,37 @@ def market_single_view(request, pk):
     if request.method == 'DELETE':
         market = Market.objects.get(pk=pk)
         serializer = MarketSerializer(market)
-        market.delete()
-        return Response(serializer.data)
+        soft_delete(market)
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
 
 
-class SellerViewSet(viewsets.ModelViewSet):
+class SellerViewSet(TimingMixin, SparseFieldsMixin, MultiGetMixin, ChangeFeedMixin, ConditionalMixin, CachedListMixin,
+                    viewsets.ModelViewSet):
     queryset = Seller.objects.all()
     serializer_class = SellerSerializer
+    # links and counters move relations_updated_at, of the seller and of its nested markets
+    modified_fields = ['updated_at', 'relations_updated_at', 'markets__updated_at', 'markets__relations_updated_at']
+    filter_backends = [FullTextSearchFilter, KeysetOrderingFilter]
+    search_index = 'search_index'
+
+    def get_key_queryset(self):
+        return Seller.objects.all()
+
+    @action(detail=False, methods=['post'], parser_classes=[FastJSONParser, CSVParser])
+    def bulk(self, request):
+        """
+        onboards many sellers at once from a JSON array or CSV (header: name,contact_info,market_ids),
+        market_ids is a list or '1;2;3'. answers the created ids and the errors per row
+        """
+        if not isinstance(request.data, list):
+            return Response({"message": "Expected a list of sellers"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(onboard_sellers(request.data))
 
 
 class SellersView(mixins.ListModelMixin,
                   mixins.CreateModelMixin,
                   generics.GenericAPIView):
-    queryset = Seller.objects.all()
+    queryset = SellerSerializer.setup_eager_loading(Seller.objects.all())
     serializer_class = SellerSerializer
 
 
@@ -142,7 +235,7 @@ class SellersView(mixins.ListModelMixin,
 def sellers_view(request):
 
     if request.method == 'GET':
-        sellers = Seller.objects.all()
+        sellers = SellerSerializer.setup_eager_loading(Seller.objects.all())
         serializer = SellerSerializer(sellers, many=True, context={'request': request})
         return Response(serializer.data)
     
@@ -156,14 +249,14 @@ def sellers_view(request):
 
 
 class SellerSingleView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Seller.objects.all()
+    queryset = SellerSerializer.setup_eager_loading(Seller.objects.all())
     serializer_class = SellerSerializer
 
 
 @api_view()
 def seller_single_view(request, pk):
     if request.method == 'GET':
-        seller = Seller.objects.get(pk=pk)
+        seller = SellerSerializer.setup_eager_loading(Seller.objects.all()).get(pk=pk)
         serializer = SellerSerializer(seller, context={'request': request})
         return Response(serializer.data)
 
@@ -175,11 +268,52 @@ def seller_single_view(request, pk):
 
 
 """ viewsets.GenericViewSet & Mixins for custom CRUD operations """
-class ProductViewSet(mixins.ListModelMixin,
+class ProductViewSet(TimingMixin,
+                     SparseFieldsMixin,
+                     MultiGetMixin,
+                     ChangeFeedMixin,
+                     ConditionalMixin,
+                     CachedListMixin,
+                     mixins.ListModelMixin,
                      mixins.RetrieveModelMixin,
                      viewsets.GenericViewSet):
-    queryset = Product.objects.all()
+    # products of soft-deleted markets are hidden until they are purged
+    queryset = Product.objects.live()
     serializer_class = ProductSerializer
+    filter_backends = [ProductFilter, FullTextSearchFilter, KeysetOrderingFilter]
+    search_index = 'search_index'
+    ordering_fields = ['price', 'name']
+    range_orderings = {'price_min': 'price', 'price_max': 'price'}
+    # market and seller names are part of the representation. their counters and links are not, those
+    # move relations_updated_at, so a new product of the market leaves the versions of the others alone
+    modified_fields = ['updated_at', 'market__updated_at', 'seller__updated_at']
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        streams the whole (filtered) catalog as NDJSON (default) or CSV with ?output=csv,
+        without building the response in memory
+        """
+        output = request.query_params.get('output', 'ndjson')
+        if output not in EXPORT_FORMATS:
+            return Response({"message": f"Unknown output '{output}'"}, status=status.HTTP_400_BAD_REQUEST)
+        lines, content_type = EXPORT_FORMATS[output]
+        queryset = self.filter_queryset(Product.objects.live())
+        response = StreamingHttpResponse(lines(queryset), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="products.{output}"'
+        return response
+
+    @action(detail=False, methods=['post'], parser_classes=[FastJSONParser, CSVParser])
+    def bulk(self, request):
+        """
+        creates products from a JSON array or a CSV price list (header: name,description,price,market_id,seller_id).
+        ?upsert=true updates price and description of products with the same seller, name and market instead
+        """
+        if not isinstance(request.data, list):
+            return Response({"message": "Expected a list of products"}, status=status.HTTP_400_BAD_REQUEST)
+        upsert = request.query_params.get('upsert', '').lower() in ('1', 'true', 'yes')
+        result = ingest_products(request.data, upsert=upsert)
+        return Response(result)
 
 
 # class ProductViewSet(viewsets.ViewSet):
@@ -213,7 +347,7 @@ class ProductViewSet(mixins.ListModelMixin,
 def products_view(request):
 
     if request.method == 'GET':
-        products = Product.objects.all()
+        products = ProductHyperlinkedSerializer.setup_eager_loading(Product.objects.live())
         serializer = ProductHyperlinkedSerializer(products, many=True, context={'request': request})
         return Response(serializer.data)
     
@@ -231,7 +365,7 @@ def product_single_view(request, pk):
     
     if request.method == 'GET':
         try:
-            product = Product.objects.get(pk=pk)
+            product = ProductSerializer.setup_eager_loading(Product.objects.all()).get(pk=pk)
             serializer = ProductSerializer(product, context={'request': request})
             return Response(serializer.data)
         except Exception:
@@ -239,7 +373,8 @@ def product_single_view(request, pk):
             # return redirect('/api/product/')
     
     if request.method == 'PUT':
-        product = Product.objects.get(pk=pk)
+        # market and seller names are rendered in the response, join them instead of two lookups afterwards
+        product = Product.objects.select_related('market', 'seller').get(pk=pk)
         serializer = ProductHyperlinkedSerializer(product, data=request.data, partial=True, context={'request': request})
         if serializer.is_valid():
             serializer.save()
@@ -248,7 +383,8 @@ def product_single_view(request, pk):
             return Response(serializer.errors)
     
     if request.method == 'DELETE':
-        product = Product.objects.get(pk=pk)
-        serializer = ProductHyperlinkedSerializer(product, context={'request': request})
+        product = Product.objects.select_related('market', 'seller').get(pk=pk)
+        # rendered before the delete, afterwards the pk is None and the url can't be built
+        data = ProductHyperlinkedSerializer(product, context={'request': request}).data
         product.delete()
-        return Response(serializer.data)
+        return Response(data)
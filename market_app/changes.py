@@ -0,0 +1,47 @@
+"""
+the change feed behind ?since= on the product, seller and market lists.
+
+every insert, update and delete of the three tables adds a ChangeLog row through SQLite triggers, so
+bulk_create, update() (touch(), the counters) and the raw DELETEs of market_app.purge are logged like
+save() and delete(). a feed page reads the log rows after the cursor and reports each object once:
+rows still visible through the view's queryset are upserts, all others (deleted, soft-deleted market,
+product of a soft-deleted market) are tombstones. SQLite commits one writer at a time, so a cursor
+never skips a row that commits later with a smaller seq.
+
+the triggers are created by migration 0008_change_log. like the FTS triggers they are dropped when
+Django remakes a table, migrations that do so end with their own copy of its create_change_triggers.
+`python manage.py prune_changes` trims old log rows, clients behind the pruned part get 410 and
+re-sync from the lists.
+"""
+from django.db.models import Max
+
+from market_app.models import ChangeLog
+
+
+def changes_since(model, since, limit):
+    """
+    (object ids in the order of their last change, cursor for the next call, whether more changes follow)
+    from at most limit log rows after since
+    """
+    rows = list(
+        ChangeLog.objects.filter(model=model._meta.model_name, seq__gt=since)
+        .order_by('seq').values_list('seq', 'object_id')[:limit + 1]
+    )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    # an object changed several times on this page is reported once, at its last change
+    last = {}
+    for seq, object_id in rows:
+        last.pop(object_id, None)
+        last[object_id] = seq
+    return list(last), rows[-1][0] if rows else since, has_more
+
+
+def is_pruned(since):
+    """ whether log rows after since were already pruned """
+    oldest = ChangeLog.objects.order_by('seq').values_list('seq', flat=True).first()
+    return oldest is not None and since < oldest - 1
+
+
+def latest_seq():
+    return ChangeLog.objects.aggregate(latest=Max('seq'))['latest'] or 0
@@ -0,0 +1,136 @@
+"""
+denormalized relation counters: Seller.market_count / product_count and Market.seller_count / product_count.
+
+product writes move the counters with UPDATE ... SET x = x + delta in the transaction of the write
+(Product.save, the delete collector and the bulk chunks are atomic). seller link changes re-count the
+touched rows on the link table, since remove() and clear() do not tell which links really existed.
+the seller counters leave out soft-deleted markets, market_app.purge re-counts them when a market goes.
+`python manage.py market_counters` checks them against fresh counts and repairs them.
+"""
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from market_app.models import Market, Product, Seller
+
+MarketSellers = Seller.markets.through
+
+COUNTERS = {
+    Seller: ['market_count', 'product_count'],
+    Market: ['seller_count', 'product_count'],
+}
+
+
+def count_of(queryset, column):
+    """ correlated COUNT of queryset rows whose column points at the outer row """
+    rows = queryset.filter(**{column: OuterRef('pk')}).order_by().values(column)
+    return Coalesce(Subquery(rows.annotate(count=Count('pk')).values('count')), 0)
+
+
+def apply_products(added=(), removed=()):
+    """ added / removed are (market_id, seller_id) pairs of products that were written or left their market / seller """
+    now = timezone.now()
+    deltas = {Market: Counter(), Seller: Counter()}
+    for pairs, sign in [(added, 1), (removed, -1)]:
+        for market_id, seller_id in pairs:
+            deltas[Market][market_id] += sign
+            deltas[Seller][seller_id] += sign
+    for model, counter in deltas.items():
+        # one UPDATE per distinct delta, a bulk of one market moves all its rows at once
+        by_delta = {}
+        for pk, delta in counter.items():
+            if delta:
+                by_delta.setdefault(delta, []).append(pk)
+        for delta, pks in by_delta.items():
+            # the counts are rendered, so the rows count as modified (ETag / Last-Modified). not updated_at:
+            # the other products of the market render its name only and keep their versions
+            model._base_manager.filter(pk__in=pks).update(
+                product_count=F('product_count') + delta, relations_updated_at=now
+            )
+
+
+def in_chunks(queryset, ids, size=500):
+    """ queryset filtered to ids, split so no statement hits the parameter limit; the whole queryset without ids """
+    if ids is None:
+        yield queryset
+        return
+    ids = list(ids)
+    for start in range(0, len(ids), size):
+        yield queryset.filter(pk__in=ids[start:start + size])
+
+
+def update_counts(queryset, ids, counts):
+    """
+    writes counts to the rows of queryset in ids (all without ids) whose stored counters differ. like
+    apply_products they bump relations_updated_at, or a client holding the ETag of the wrong count keeps its 304
+    """
+    now = timezone.now()
+    differs = Q()
+    for field, count in counts.items():
+        differs |= ~Q(**{field: count})
+    for rows in in_chunks(queryset, ids):
+        rows.filter(differs).update(**counts, relations_updated_at=now)
+    return now
+
+
+def recount_sellers(seller_ids=None, fields=('market_count', 'product_count')):
+    """ re-counts the sellers in seller_ids, or all of them. returns the relations_updated_at of the re-counted rows """
+    counts = {
+        'market_count': count_of(MarketSellers.objects.filter(market__deleted_at=None), 'seller_id'),
+        'product_count': count_of(Product.objects.live(), 'seller_id'),
+    }
+    return update_counts(Seller.objects.all(), seller_ids, {field: counts[field] for field in fields})
+
+
+def recount_markets(market_ids=None, fields=('seller_count', 'product_count')):
+    """ re-counts the markets in market_ids, or all of them including the soft-deleted ones """
+    counts = {
+        'seller_count': count_of(MarketSellers.objects.all(), 'market_id'),
+        'product_count': count_of(Product.objects.all(), 'market_id'),
+    }
+    return update_counts(Market.all_objects.all(), market_ids, {field: counts[field] for field in fields})
+
+
+def compute():
+    """ {model: {pk: {counter: value}}} counted from scratch for every seller and market """
+    result = {
+        model: {pk: dict.fromkeys(fields, 0) for pk in model._base_manager.values_list('pk', flat=True)}
+        for model, fields in COUNTERS.items()
+    }
+    sources = [
+        (Seller, 'market_count', MarketSellers.objects.filter(market__deleted_at=None), 'seller_id'),
+        (Seller, 'product_count', Product.objects.live(), 'seller_id'),
+        (Market, 'seller_count', MarketSellers.objects.all(), 'market_id'),
+        (Market, 'product_count', Product.objects.all(), 'market_id'),
+    ]
+    for model, field, queryset, column in sources:
+        for pk, count in queryset.order_by().values(column).annotate(count=Count('pk')).values_list(column, 'count'):
+            if pk in result[model]:
+                result[model][pk][field] = count
+    return result
+
+
+def drift():
+    """ (model name, pk, counter, stored, actual) of every stored counter that differs from a fresh count """
+    found = []
+    for model, fresh in compute().items():
+        fields = COUNTERS[model]
+        for pk, *stored in model._base_manager.values_list('pk', *fields):
+            for field, value in zip(fields, stored):
+                if value != fresh[pk][field]:
+                    found.append((model.__name__, pk, field, value, fresh[pk][field]))
+    return found
+
+
+def rebuild():
+    """ re-counts every seller and market, returns the ids of the (market ids, seller ids) that were off """
+    with transaction.atomic():
+        sellers_at = recount_sellers()
+        markets_at = recount_markets()
+    return (
+        set(Market.all_objects.filter(relations_updated_at=markets_at).values_list('pk', flat=True)),
+        set(Seller.objects.filter(relations_updated_at=sellers_at).values_list('pk', flat=True)),
+    )
@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import AsyncClient, Client, override_settings
+from django.urls import include, path
+
+from market_app.api.async_views import ROUTES
+
+# the urlconf of the benchmark: every route once async and once through its sync DRF view
+urlpatterns = [
+    path('async/api/', include([url for route in ROUTES.values() for url in route.urls()])),
+    path('sync/api/', include([path(f'{route.prefix}/', route.sync_list) for route in ROUTES.values()])),
+]
+
+
+class AdaptedMiddleware(logging.Handler):
+    """ collects what django.request logs when it wraps a middleware for the other mode """
+
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.messages = []
+
+    def emit(self, record):
+        message = record.getMessage()
+        if 'adapted' in message:
+            self.messages.append(message)
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares the read throughput of the async views (one event loop) with the sync DRF views '
+        '(a pool of worker threads, like a threaded WSGI server) on the configured database. '
+        'Both go through the request handlers with the configured MIDDLEWARE.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--route', choices=sorted(ROUTES), default='products')
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=50, help='requests in flight on the async path')
+        parser.add_argument('--threads', type=int, default=8, help='worker threads of the sync path')
+        parser.add_argument('--page-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        route = ROUTES[options['route']]
+        query = f'?page_size={options["page_size"]}'
+        total = options['requests']
+
+        # the test clients send Host: testserver
+        with override_settings(ALLOWED_HOSTS=['testserver'], ROOT_URLCONF=__name__):
+            self.check_middleware()
+            sync_seconds = self.run_sync(f'/sync/api/{route.prefix}/{query}', total, options['threads'])
+            async_seconds = asyncio.run(self.run_async(f'/async/api/{route.prefix}/{query}', total, options['concurrency']))
+
+        self.stdout.write(f'{total} GET /api/{route.prefix}/{query}')
+        self.stdout.write(f'sync  ({options["threads"]} threads): {total / sync_seconds:8.1f} req/s')
+        self.stdout.write(f'async ({options["concurrency"]} in flight): {total / async_seconds:8.1f} req/s')
+        self.stdout.write(f'async / sync: {sync_seconds / async_seconds:.2f}x')
+
+    def check_middleware(self):
+        """
+        a sync-only middleware makes ASGIHandler run the whole chain, the async views included, on a
+        worker thread, and the async numbers would measure sync_to_async. Django logs that with DEBUG on
+        """
+        logger = logging.getLogger('django.request')
+        adapted = AdaptedMiddleware()
+        level = logger.level
+        logger.addHandler(adapted)
+        logger.setLevel(logging.DEBUG)
+        try:
+            with override_settings(DEBUG=True):
+                ASGIHandler()
+        finally:
+            logger.removeHandler(adapted)
+            logger.setLevel(level)
+        if adapted.messages:
+            raise CommandError('; '.join(adapted.messages))
+
+    def run_sync(self, url, total, threads):
+        clients = threading.local()
+
+        def get(_):
+            if not hasattr(clients, 'client'):
+                clients.client = Client()
+            response = clients.client.get(url, HTTP_ACCEPT='application/json')
+            assert response.status_code == 200, response.status_code
+
+        def close(_):
+            connections.close_all()
+
+        with ThreadPoolExecutor(threads) as pool:
+            start = time.perf_counter()
+            list(pool.map(get, range(total)))
+            seconds = time.perf_counter() - start
+            list(pool.map(close, range(threads)))
+        return seconds
+
+    async def run_async(self, url, total, concurrency):
+        client = AsyncClient()
+        slots = asyncio.Semaphore(concurrency)
+
+        async def get():
+            async with slots:
+                response = await client.get(url, headers={'Accept': 'application/json'})
+                assert response.status_code == 200, response.status_code
+
+        start = time.perf_counter()
+        await asyncio.gather(*(get() for _ in range(total)))
+        return time.perf_counter() - start
@@ -0,0 +1,204 @@
+import json
+import math
+import platform
+import re
+import statistics
+import time
+import tracemalloc
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, URLResolver
+
+from market_app.api import urls as api_urls
+from market_app.models import Market, Seller, Product
+
+# the model whose pk fills <pk> in a route, by the first path segment
+PK_MODELS = {'products': Product, 'sellers': Seller, 'market': Market}
+
+# metric -> which threshold option guards it
+METRICS = {
+    'p50_ms': 'latency_threshold',
+    'p95_ms': 'latency_threshold',
+    'p99_ms': 'latency_threshold',
+    'queries': 'query_threshold',
+    'peak_kib': 'memory_threshold',
+}
+
+
+def api_routes(patterns=None, prefix=''):
+    """ every route of market_app.api.urls as (path template, view), router regexes included """
+    for pattern in api_urls.urlpatterns if patterns is None else patterns:
+        route = prefix + str(pattern.pattern)
+        if isinstance(pattern, URLResolver):
+            yield from api_routes(pattern.url_patterns, route)
+        elif isinstance(pattern, URLPattern):
+            yield route, pattern.callback
+
+
+def concrete_path(route, pk):
+    """ '^products/(?P<pk>[^/.]+)/$' and 'market/<int:pk>/' become '/api/products/<pk>/' and '/api/market/<pk>/' """
+    route = re.sub(r'\(\?P<\w+>[^)]*\)', str(pk), route)
+    route = re.sub(r'<(?:\w+:)?\w+>', str(pk), route)
+    return '/api/' + route.lstrip('^').rstrip('$')
+
+
+def allows_get(view):
+    actions = getattr(view, 'actions', None)
+    if actions is not None:
+        # viewset routes only answer their mapped actions
+        return 'get' in actions
+    cls = getattr(view, 'cls', view)
+    return hasattr(cls, 'get') and 'get' in getattr(cls, 'http_method_names', ['get'])
+
+
+def percentile(values, fraction):
+    """ nearest-rank percentile """
+    values = sorted(values)
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        'GETs every route of market_app/api/urls.py against the current database and records latency '
+        'percentiles, SQL query count and peak Python memory per endpoint. --save writes them as a JSON '
+        'baseline, --compare fails when an endpoint got worse than the baseline by more than the thresholds.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=30)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--routes', default='', help='only routes matching this regular expression')
+        parser.add_argument('--query', default='', help='query string added to list routes, e.g. page_size=100')
+        parser.add_argument('--save', metavar='PATH', help='write the results as a baseline')
+        parser.add_argument('--compare', metavar='PATH', help='baseline to check the results against')
+        parser.add_argument('--latency-threshold', type=float, default=0.25, help='allowed relative increase')
+        parser.add_argument('--memory-threshold', type=float, default=0.25, help='allowed relative increase')
+        parser.add_argument('--query-threshold', type=int, default=0, help='allowed extra queries')
+        parser.add_argument('--min-delta-ms', type=float, default=2.0, help='latency changes below are noise')
+
+    def handle(self, *args, **options):
+        # Client sends Host: testserver
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            results = self.run(options)
+
+        report = {
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'catalog': {model.__name__: model.objects.count() for model in (Market, Seller, Product)},
+                'iterations': options['iterations'],
+            },
+            'endpoints': results,
+        }
+        if options['save']:
+            with open(options['save'], 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+            self.stdout.write(f'baseline written to {options["save"]}')
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+            regressions = self.regressions(baseline['endpoints'], results, options)
+            if regressions:
+                raise CommandError('regressions against the baseline:\n' + '\n'.join(regressions))
+            self.stdout.write(f'no regressions against {options["compare"]}')
+
+    def run(self, options):
+        client = Client(HTTP_ACCEPT='application/json')
+        only = re.compile(options['routes'])
+        results = {}
+        self.stdout.write(f'{"endpoint":<40} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"queries":>7} {"peak KiB":>9}')
+        for route, view in api_routes():
+            first_segment = route.lstrip('^').split('/')[0]
+            model = PK_MODELS.get(first_segment)
+            pk = model.objects.order_by('pk').values_list('pk', flat=True).first() if model else None
+            path = concrete_path(route, pk)
+            if not only.search(path):
+                continue
+            if not allows_get(view):
+                self.stdout.write(f'{path:<40} skipped, no GET')
+                continue
+            if 'pk' in route and pk is None:
+                self.stdout.write(f'{path:<40} skipped, no {model.__name__} in the database')
+                continue
+            if options['query'] and not path.rstrip('/').split('/')[-1].isdigit():
+                path += '?' + options['query']
+
+            response = client.get(path)
+            if response.status_code == 404 and 'pk' in route:
+                # e.g. the purge progress of a market that was never deleted
+                self.stdout.write(f'{path:<40} skipped, answered 404')
+                continue
+            if response.status_code != 200:
+                raise CommandError(f'GET {path} answered {response.status_code}')
+
+            results[path] = self.measure(client, path, options['warmup'], options['iterations'])
+            row = results[path]
+            self.stdout.write(
+                f'{path:<40} {row["p50_ms"]:8.2f} {row["p95_ms"]:8.2f} {row["p99_ms"]:8.2f} '
+                f'{row["queries"]:7d} {row["peak_kib"]:9.0f}'
+            )
+        return results
+
+    def request(self, client, path):
+        response = client.get(path)
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+        else:
+            response.content
+        return response
+
+    def measure(self, client, path, warmup, iterations):
+        for _ in range(warmup):
+            self.request(client, path)
+
+        latencies = []
+        queries = 0
+        for _ in range(iterations):
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                self.request(client, path)
+                latencies.append((time.perf_counter() - start) * 1000)
+            queries = max(queries, len(captured))
+
+        # tracemalloc slows every allocation down, so memory gets a request of its own
+        tracemalloc.start()
+        try:
+            self.request(client, path)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        return {
+            'p50_ms': round(statistics.median(latencies), 3),
+            'p95_ms': round(percentile(latencies, 0.95), 3),
+            'p99_ms': round(percentile(latencies, 0.99), 3),
+            'queries': queries,
+            'peak_kib': round(peak / 1024, 1),
+        }
+
+    def regressions(self, baseline, results, options):
+        found = []
+        for path, before in baseline.items():
+            after = results.get(path)
+            if after is None:
+                continue
+            for metric, threshold_option in METRICS.items():
+                old, new = before.get(metric), after[metric]
+                if old is None:
+                    continue
+                threshold = options[threshold_option]
+                if metric == 'queries':
+                    worse = new > old + threshold
+                elif metric.endswith('_ms'):
+                    worse = new > old * (1 + threshold) and new - old > options['min_delta_ms']
+                else:
+                    worse = new > old * (1 + threshold)
+                if worse:
+                    found.append(f'{path} {metric}: {old} -> {new}')
+        return found
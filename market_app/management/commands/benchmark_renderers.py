@@ -0,0 +1,78 @@
+import decimal
+import io
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework.parsers import JSONParser
+from rest_framework.relations import Hyperlink
+from rest_framework.renderers import JSONRenderer
+
+from market_app.api import renderers
+from market_app.api.renderers import FastJSONParser, FastJSONRenderer
+
+
+def product_page(rows):
+    """ a product list page as the list view hands it to the renderer, with hyperlinks and prices """
+    results = [
+        {
+            'id': i,
+            'url': Hyperlink(f'http://testserver/api/products/{i}/', None),
+            'name': f'Product {i}',
+            'description': 'Frische Äpfel aus der Region, Klasse I',
+            'price': format(decimal.Decimal(i % 1000) / 100 + 1, 'f'),
+            'market': f'Market {i % 50}',
+            'seller': f'Seller {i % 300}',
+        }
+        for i in range(rows)
+    ]
+    return {'next': 'http://testserver/api/products/?cursor=cD0xMDA%3D', 'previous': None, 'results': results}
+
+
+class Command(BaseCommand):
+    help = 'Times JSONRenderer / JSONParser against FastJSONRenderer / FastJSONParser on a large product list.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        if renderers.orjson is None:
+            self.stdout.write('orjson is not installed, the fast classes fall back to the stdlib ones')
+
+        data = product_page(options['rows'])
+        body = JSONRenderer().render(data)
+        self.stdout.write(f'{options["rows"]} products, {len(body) / 1024:.0f} KiB, best of {options["repeat"]}')
+
+        render = self.compare(
+            'render', options['repeat'],
+            lambda: JSONRenderer().render(data),
+            lambda: FastJSONRenderer().render(data),
+        )
+        parse = self.compare(
+            'parse ', options['repeat'],
+            lambda: JSONParser().parse(self.stream(body)),
+            lambda: FastJSONParser().parse(self.stream(body)),
+        )
+        if not (render and parse):
+            self.stderr.write('the fast classes produced different output')
+
+    def stream(self, body):
+        return io.BytesIO(body)
+
+    def compare(self, label, repeat, baseline, fast):
+        baseline_seconds, expected = self.best_of(repeat, baseline)
+        fast_seconds, result = self.best_of(repeat, fast)
+        self.stdout.write(
+            f'{label}  stdlib {baseline_seconds * 1000:8.2f} ms   fast {fast_seconds * 1000:8.2f} ms   '
+            f'{baseline_seconds / fast_seconds:5.1f}x'
+        )
+        return expected == result
+
+    def best_of(self, repeat, func):
+        best, result = None, None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func()
+            seconds = time.perf_counter() - start
+            best = seconds if best is None else min(best, seconds)
+        return best, result
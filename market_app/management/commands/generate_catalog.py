@@ -0,0 +1,125 @@
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from market_app import counters, stats
+from market_app.api.cache import get_fragment_cache
+from market_app.models import ChangeLog, Market, MarketPurge, MarketStats, Seller, Product
+
+CITIES = ['Berlin', 'Hamburg', 'München', 'Köln', 'Leipzig', 'Dresden', 'Bremen', 'Wien', 'Zürich', 'Graz']
+GOODS = ['Äpfel', 'Birnen', 'Brot', 'Käse', 'Honig', 'Eier', 'Tomaten', 'Kartoffeln', 'Oliven', 'Kaffee', 'Wurst']
+KINDS = ['Bio', 'Regional', 'Frisch', 'Hausgemacht', 'Saisonal', 'Klassisch']
+
+
+def batches(iterable_size, batch_size):
+    for start in range(0, iterable_size, batch_size):
+        yield start, min(start + batch_size, iterable_size)
+
+
+class Command(BaseCommand):
+    help = (
+        'Fills the database with a reproducible synthetic catalog (markets, sellers with market links, products) '
+        'using bulk inserts. The same --seed always gives the same names, prices and links.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--markets', type=int, default=1000)
+        parser.add_argument('--sellers', type=int, default=50000)
+        parser.add_argument('--products', type=int, default=5000000)
+        parser.add_argument('--markets-per-seller', type=int, default=3, help='upper bound, at least one each')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--batch-size', type=int, default=5000, help='rows per INSERT transaction')
+        parser.add_argument('--clear', action='store_true', help='delete the existing catalog first')
+
+    def handle(self, *args, **options):
+        if options['sellers'] and not options['markets'] or options['products'] and not options['sellers']:
+            raise CommandError('sellers need markets and products need sellers')
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size']
+        started = time.perf_counter()
+
+        if options['clear']:
+            self.clear()
+
+        market_ids = self.create_markets(rng, options['markets'], batch_size)
+        seller_markets = self.create_sellers(
+            rng, options['sellers'], market_ids, options['markets_per_seller'], batch_size
+        )
+        self.create_products(rng, options['products'], seller_markets, batch_size)
+
+        # bulk inserts send no signals: the market stats and counters are aggregated once at the end
+        # and cached fragments of the old catalog would survive
+        stats.rebuild()
+        counters.rebuild()
+        fragment_cache = get_fragment_cache()
+        if fragment_cache is not None:
+            fragment_cache.clear()
+        self.stdout.write(f'done in {time.perf_counter() - started:.1f}s')
+
+    def clear(self):
+        # plain DELETEs, QuerySet.delete() would load every product to send post_delete.
+        # the change log goes last, feed cursors of the old catalog answer 410 afterwards
+        with transaction.atomic(), connection.cursor() as cursor:
+            for model in [Product, Seller.markets.through, MarketStats, MarketPurge, Seller, Market, ChangeLog]:
+                cursor.execute(f'DELETE FROM {connection.ops.quote_name(model._meta.db_table)}')
+
+    def create_markets(self, rng, count, batch_size):
+        ids = []
+        for start, end in batches(count, batch_size):
+            markets = [
+                Market(
+                    name=f'{rng.choice(KINDS)} Markt {i}',
+                    location=rng.choice(CITIES),
+                    description=f'Wochenmarkt Nummer {i}',
+                    net_worth=Decimal(rng.randrange(10000, 100000000)) / 100,
+                )
+                for i in range(start, end)
+            ]
+            with transaction.atomic():
+                ids += [market.pk for market in Market.objects.bulk_create(markets)]
+        self.stdout.write(f'{len(ids)} markets')
+        return ids
+
+    def create_sellers(self, rng, count, market_ids, markets_per_seller, batch_size):
+        """ returns the market ids of every seller, the products are spread over them """
+        MarketSellers = Seller.markets.through
+        seller_markets = {}
+        links = 0
+        for start, end in batches(count, batch_size):
+            sellers = [
+                Seller(name=f'{rng.choice(GOODS)}händler {i}', contact_info=f'seller{i}@example.com')
+                for i in range(start, end)
+            ]
+            with transaction.atomic():
+                sellers = Seller.objects.bulk_create(sellers)
+                rows = []
+                for seller in sellers:
+                    linked = rng.sample(market_ids, min(len(market_ids), rng.randint(1, markets_per_seller)))
+                    seller_markets[seller.pk] = linked
+                    rows += [MarketSellers(seller_id=seller.pk, market_id=market_id) for market_id in linked]
+                MarketSellers.objects.bulk_create(rows)
+                links += len(rows)
+        self.stdout.write(f'{len(seller_markets)} sellers, {links} market links')
+        return seller_markets
+
+    def create_products(self, rng, count, seller_markets, batch_size):
+        seller_ids = list(seller_markets)
+        for start, end in batches(count, batch_size):
+            products = []
+            for i in range(start, end):
+                seller_id = rng.choice(seller_ids)
+                products.append(Product(
+                    name=f'{rng.choice(KINDS)} {rng.choice(GOODS)} {i}',
+                    description=f'{rng.choice(GOODS)} vom {rng.choice(CITIES)}er Markt',
+                    price=Decimal(rng.randrange(10, 100000)) / 100,
+                    market_id=rng.choice(seller_markets[seller_id]),
+                    seller_id=seller_id,
+                ))
+            with transaction.atomic():
+                Product.objects.bulk_create(products)
+            if end % (batch_size * 100) == 0:
+                self.stdout.write(f'{end} products ...')
+        self.stdout.write(f'{count} products')
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from market_app import counters
+from market_app.signals import counts_changed
+
+
+class Command(BaseCommand):
+    help = (
+        'Checks the counter columns of sellers and markets (market_count, seller_count, product_count) '
+        'against fresh counts (default) and with --rebuild re-counts every row.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='re-count every row instead of checking')
+        parser.add_argument('--fix', action='store_true', help='after a failed check, re-count the drifted rows')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            market_ids, seller_ids = counters.rebuild()
+            # the cached fragments of the re-counted rows render the old counts
+            counts_changed(market_ids, seller_ids)
+            self.stdout.write(f're-counted every row, {len(seller_ids)} sellers and {len(market_ids)} markets were off')
+            return
+
+        found = counters.drift()
+        for model, pk, field, stored, actual in found:
+            self.stdout.write(f'{model.lower()} {pk}: {field} is {stored}, expected {actual}')
+        if not found:
+            self.stdout.write('no drift')
+            return
+        if options['fix']:
+            seller_ids = {pk for model, pk, *_ in found if model == 'Seller'}
+            market_ids = {pk for model, pk, *_ in found if model == 'Market'}
+            counters.recount_sellers(seller_ids)
+            counters.recount_markets(market_ids)
+            counts_changed(market_ids, seller_ids)
+            self.stdout.write(f're-counted {len(seller_ids)} sellers and {len(market_ids)} markets')
+            return
+        raise CommandError(f'{len(found)} drifted counters, run with --fix or --rebuild')
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from market_app import stats
+
+
+class Command(BaseCommand):
+    help = (
+        'Checks the incrementally maintained market stats against fresh aggregates (default) '
+        'and with --rebuild recomputes the whole table from scratch.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='recompute every row instead of checking')
+        parser.add_argument('--fix', action='store_true', help='after a failed check, rebuild the drifted markets')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            self.stdout.write(f'rebuilt the stats of {stats.rebuild()} markets')
+            return
+
+        found = stats.drift()
+        for market_id, field, stored, actual in found:
+            self.stdout.write(f'market {market_id}: {field} is {stored}, expected {actual}')
+        if not found:
+            self.stdout.write('no drift')
+            return
+        if options['fix']:
+            market_ids = {market_id for market_id, *_ in found}
+            self.stdout.write(f'rebuilt the stats of {stats.rebuild(market_ids)} markets')
+            return
+        raise CommandError(f'{len(found)} drifted values, run with --fix or --rebuild')
@@ -0,0 +1,35 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from market_app import changes
+from market_app.models import ChangeLog
+
+
+class Command(BaseCommand):
+    help = (
+        'Deletes change log rows older than --days in batches. Clients whose ?since= cursor is older '
+        'than the remaining log get 410 and sync the full lists again.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, default=30.0)
+        parser.add_argument('--batch-size', type=int, default=10000, help='rows per DELETE transaction')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        # seq and changed_at grow together, everything below the first kept seq goes. the newest row always
+        # stays, an empty log could not tell a pruned cursor from one that is up to date
+        first_kept = ChangeLog.objects.filter(changed_at__gte=cutoff).order_by('seq').values_list('seq', flat=True).first()
+        old = ChangeLog.objects.filter(seq__lt=first_kept or changes.latest_seq())
+        deleted = 0
+        while True:
+            with transaction.atomic():
+                batch = list(old.order_by('seq').values_list('seq', flat=True)[:options['batch_size']])
+                if not batch:
+                    break
+                ChangeLog.objects.filter(seq__gte=batch[0], seq__lte=batch[-1]).delete()
+            deleted += len(batch)
+        self.stdout.write(f'pruned {deleted} change log rows older than {options["days"]:g} days')
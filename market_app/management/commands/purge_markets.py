@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from market_app.purge import pending, purge_batch
+
+
+class Command(BaseCommand):
+    help = (
+        'Removes the products, seller links and finally the rows of soft-deleted markets in batches, '
+        'each batch in its own transaction with the progress of its MarketPurge. An interrupted run '
+        'continues where it stopped. With --watch it keeps polling for new deletions.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='rows per DELETE transaction')
+        parser.add_argument('--sleep', type=float, default=0.0, help='pause between batches, room for other writers')
+        parser.add_argument('--watch', type=float, default=None, metavar='SECONDS', help='poll for new deletions')
+
+    def handle(self, *args, **options):
+        while True:
+            for purge in pending():
+                self.purge(purge, options)
+            if options['watch'] is None:
+                break
+            time.sleep(options['watch'])
+
+    def purge(self, purge, options):
+        started = time.perf_counter()
+        while purge_batch(purge, options['batch_size']):
+            self.stdout.write(
+                f'market {purge.market_id}: {purge.deleted_products}/{purge.total_products} products, '
+                f'{purge.deleted_links}/{purge.total_links} seller links'
+            )
+            if options['sleep']:
+                time.sleep(options['sleep'])
+        self.stdout.write(f'market {purge.market_id}: purged in {time.perf_counter() - started:.1f}s')
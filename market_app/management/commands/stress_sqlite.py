@@ -0,0 +1,170 @@
+import os
+import random
+import tempfile
+import threading
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+from django.db.models import F
+
+from market_app.models import Market, Seller, Product
+
+# the stock sqlite3 entry this project started with: rollback journal, deferred transactions
+STOCK = {'ENGINE': 'django.db.backends.sqlite3'}
+
+
+def profiles():
+    """ name -> DATABASES entry without NAME, the configured one against the stock one """
+    configured = {key: value for key, value in settings.DATABASES[DEFAULT_DB_ALIAS].items() if key != 'NAME'}
+    return {'stock': STOCK, 'configured': configured}
+
+
+def register(alias, entry):
+    # ConnectionHandler fills in the defaults (AUTOCOMMIT, TIME_ZONE, ...) only when it reads DATABASES
+    connections.settings[alias] = connections.configure_settings({DEFAULT_DB_ALIAS: dict(entry)})[DEFAULT_DB_ALIAS]
+
+
+def unregister(alias):
+    connections[alias].close()
+    del connections.settings[alias]
+    del connections[alias]
+
+
+def is_locked(exc):
+    return 'locked' in str(exc) or 'busy' in str(exc)
+
+
+class Worker(threading.Thread):
+    """ repeats one operation on its own connection until the deadline """
+
+    def __init__(self, alias, operation, deadline, seed):
+        super().__init__(daemon=True)
+        self.alias = alias
+        self.operation = operation
+        self.deadline = deadline
+        self.rng = random.Random(seed)
+        self.done = 0
+        self.locked = 0
+        self.failure = None
+
+    def run(self):
+        try:
+            while time.perf_counter() < self.deadline:
+                try:
+                    self.operation(self.alias, self.rng)
+                    self.done += 1
+                except OperationalError as exc:
+                    if not is_locked(exc):
+                        raise
+                    self.locked += 1
+        except Exception as exc:
+            self.failure = exc
+        finally:
+            connections[self.alias].close()
+
+
+def read_page(alias, rng):
+    """ a product list page of one market with market and seller names, like GET /api/products/?market=... """
+    market_id = rng.randint(1, Market.objects.using(alias).count())
+    products = Product.objects.using(alias).select_related('market', 'seller').filter(market_id=market_id)
+    list(products.order_by('pk')[:100])
+
+
+def write_prices(alias, rng):
+    """ read-modify-write in one transaction, the pattern that upgrades a read lock to a write lock """
+    with transaction.atomic(using=alias):
+        last = Product.objects.using(alias).order_by('-pk').values_list('pk', flat=True).first()
+        pk = rng.randint(1, last)
+        Product.objects.using(alias).filter(pk=pk).update(price=F('price') + Decimal('0.01'))
+        Product.objects.using(alias).bulk_create([
+            Product(name=f'Stress {pk}', description='', price=Decimal('1.00'), market_id=1, seller_id=1)
+        ])
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs concurrent readers and writers against a scratch SQLite file, once with the stock sqlite3 '
+        'settings and once with the configured DATABASES profile, and reports throughput and '
+        '"database is locked" errors. The configured database itself is not touched.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--writers', type=int, default=4)
+        parser.add_argument('--seconds', type=float, default=5.0, help='per profile')
+        parser.add_argument('--products', type=int, default=20000)
+        parser.add_argument('--check', action='store_true', help='fail if the configured profile had lock errors')
+
+    def handle(self, *args, **options):
+        if settings.DATABASES[DEFAULT_DB_ALIAS]['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError('the default database is not SQLite')
+
+        results = {}
+        self.stdout.write(f'{"profile":<12} {"reads/s":>9} {"writes/s":>9} {"locked":>7}')
+        with tempfile.TemporaryDirectory() as tmp:
+            for name, entry in profiles().items():
+                alias = f'stress_{name}'
+                register(alias, {**entry, 'NAME': os.path.join(tmp, f'{name}.sqlite3')})
+                try:
+                    self.fill(alias, options['products'])
+                    results[name] = self.run(alias, options)
+                finally:
+                    unregister(alias)
+                row = results[name]
+                self.stdout.write(f'{name:<12} {row["reads"]:9.1f} {row["writes"]:9.1f} {row["locked"]:7d}')
+
+        stock, configured = results['stock'], results['configured']
+        speedup = (configured['reads'] + configured['writes']) / max(stock['reads'] + stock['writes'], 1e-9)
+        self.stdout.write(f'configured / stock throughput: {speedup:.2f}x')
+        if options['check'] and configured['locked']:
+            raise CommandError(f'{configured["locked"]} operations failed with "database is locked"')
+
+    def fill(self, alias, products):
+        with connections[alias].schema_editor() as editor:
+            # create_model(Seller) adds the market link table as well
+            for model in [Market, Seller, Product]:
+                editor.create_model(model)
+        rng = random.Random(1)
+        with transaction.atomic(using=alias):
+            markets = Market.objects.using(alias).bulk_create(
+                [Market(name=f'Market {i}', location='', description='', net_worth=0) for i in range(20)]
+            )
+            sellers = Seller.objects.using(alias).bulk_create(
+                [Seller(name=f'Seller {i}', contact_info='') for i in range(200)]
+            )
+            Product.objects.using(alias).bulk_create(
+                [
+                    Product(
+                        name=f'Product {i}', description='x' * 200, price=Decimal(rng.randrange(100, 10000)) / 100,
+                        market=rng.choice(markets), seller=rng.choice(sellers),
+                    )
+                    for i in range(products)
+                ],
+                batch_size=2000,
+            )
+        # the workers open their own connections
+        connections[alias].close()
+
+    def run(self, alias, options):
+        deadline = time.perf_counter() + options['seconds']
+        workers = [Worker(alias, read_page, deadline, i) for i in range(options['readers'])]
+        workers += [Worker(alias, write_prices, deadline, 1000 + i) for i in range(options['writers'])]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        seconds = time.perf_counter() - start
+
+        failures = [worker.failure for worker in workers if worker.failure is not None]
+        if failures:
+            raise CommandError(f'a worker failed: {failures[0]!r}')
+        readers, writers = workers[:options['readers']], workers[options['readers']:]
+        return {
+            'reads': sum(worker.done for worker in readers) / seconds,
+            'writes': sum(worker.done for worker in writers) / seconds,
+            'locked': sum(worker.locked for worker in workers),
+        }
@@ -0,0 +1,55 @@
+import sqlite3
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from market_app.routers import PRIMARY, get_replicas
+
+
+def sqlite_path(name):
+    """ the file behind a NAME like 'file:/srv/replica1.sqlite3?mode=ro' or a plain path """
+    name = str(name)
+    if name.startswith('file:'):
+        return urlsplit(name).path
+    return name
+
+
+class Command(BaseCommand):
+    help = (
+        'Copies the primary SQLite database into the file of every replica in MARKET_DB_REPLICAS with '
+        "SQLite's online backup, for read replicas on one machine. Readers of a replica keep their "
+        'snapshot until the copy is committed. Server databases replicate on their own.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('replicas', nargs='*', help='aliases, all of MARKET_DB_REPLICAS by default')
+
+    def handle(self, *args, **options):
+        replicas = options['replicas'] or get_replicas()
+        if not replicas:
+            raise CommandError('no replicas, set MARKET_DB_REPLICAS')
+        for alias in replicas:
+            if alias not in connections.settings:
+                raise CommandError(f'{alias} is not in DATABASES')
+            if connections[alias].vendor != 'sqlite' or connections[PRIMARY].vendor != 'sqlite':
+                raise CommandError(f'{alias}: only SQLite replicas are copied by this command')
+
+        primary = connections[PRIMARY]
+        primary.ensure_connection()
+        for alias in replicas:
+            start = time.perf_counter()
+            # its own read-write connection, the replica alias itself is usually opened with mode=ro
+            target = sqlite3.connect(sqlite_path(connections[alias].settings_dict['NAME']))
+            try:
+                primary.connection.backup(target)
+                # the replica is opened read-only, so it has to be in WAL mode already
+                target.execute('PRAGMA journal_mode=WAL')
+                pages = target.execute('PRAGMA page_count').fetchone()[0]
+                page_size = target.execute('PRAGMA page_size').fetchone()[0]
+            finally:
+                target.close()
+            self.stdout.write(
+                f'{alias}: {pages * page_size / 1024:.0f} KiB copied in {time.perf_counter() - start:.2f}s'
+            )
@@ -0,0 +1,92 @@
+# Generated by Django 5.1.5 on 2026-10-18 08:02
+
+import django.db.models.deletion
+import market_app.models
+from django.db import migrations, models
+
+# the FTS5 tables are external content tables kept in sync by triggers, so bulk_create() and update()
+# are covered. SQLite drops the triggers whenever Django remakes the source table (e.g. AlterField or
+# adding a NOT NULL column), a migration that does so ends with its own copy of create_fts_triggers
+# from here (see 0007), migrations never import DDL from the app
+INDEXES = {
+    'market_app_product_fts': ('market_app_product', ['name', 'description']),
+    'market_app_seller_fts': ('market_app_seller', ['name']),
+}
+
+
+def create_fts_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for fts, (table, columns) in INDEXES.items():
+        cols = ', '.join(columns)
+        new = ', '.join(f'new.{column}' for column in columns)
+        old = ', '.join(f'old.{column}' for column in columns)
+        schema_editor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new}); END"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old}); END"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {cols} ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old}); "
+            f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new}); END"
+        )
+        schema_editor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def create_fts_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for fts, (table, columns) in INDEXES.items():
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE {fts} USING fts5({', '.join(columns)}, content='{table}', content_rowid='id', "
+            f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+    create_fts_triggers(apps, schema_editor)
+
+
+def drop_fts_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for fts in INDEXES:
+        for suffix in ('ai', 'ad', 'au'):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {fts}_{suffix}')
+        schema_editor.execute(f'DROP TABLE IF EXISTS {fts}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market_app', '0002_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchIndex',
+            fields=[
+                ('product', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_index', serialize=False, to='market_app.product')),
+                ('document', market_app.models.FullTextField(db_column='market_app_product_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'market_app_product_fts',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='SellerSearchIndex',
+            fields=[
+                ('seller', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_index', serialize=False, to='market_app.seller')),
+                ('document', market_app.models.FullTextField(db_column='market_app_seller_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'market_app_seller_fts',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_fts_tables, drop_fts_tables),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.1.5 on 2026-10-18 08:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Sum
+
+
+def fill_market_stats(apps, schema_editor):
+    Market = apps.get_model('market_app', 'Market')
+    MarketStats = apps.get_model('market_app', 'MarketStats')
+    products = {
+        row.pop('market_id'): row
+        for row in apps.get_model('market_app', 'Product').objects.values('market_id').annotate(
+            product_count=Count('pk'), total_value=Sum('price'), min_price=Min('price'), max_price=Max('price')
+        ).order_by()
+    }
+    sellers = dict(
+        Market.sellers.through.objects.values('market_id').annotate(count=Count('pk')).values_list('market_id', 'count')
+    )
+    MarketStats.objects.bulk_create([
+        MarketStats(market_id=pk, seller_count=sellers.get(pk, 0), **products.get(pk, {}))
+        for pk in Market.objects.values_list('pk', flat=True)
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market_app', '0004_product_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MarketStats',
+            fields=[
+                ('market', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='market_app.market')),
+                ('product_count', models.PositiveIntegerField(default=0)),
+                ('seller_count', models.PositiveIntegerField(default=0)),
+                ('total_value', models.DecimalField(decimal_places=2, default=0, max_digits=60)),
+                ('min_price', models.DecimalField(decimal_places=2, max_digits=50, null=True)),
+                ('max_price', models.DecimalField(decimal_places=2, max_digits=50, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(fill_market_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.5 on 2026-10-18 08:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market_app', '0005_market_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MarketPurge',
+            fields=[
+                ('market_id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('total_products', models.PositiveIntegerField(default=0)),
+                ('deleted_products', models.PositiveIntegerField(default=0)),
+                ('total_links', models.PositiveIntegerField(default=0)),
+                ('deleted_links', models.PositiveIntegerField(default=0)),
+                ('requested_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='market',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
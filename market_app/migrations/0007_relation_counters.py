@@ -0,0 +1,88 @@
+# Generated by Django 5.1.5 on 2026-10-18 08:33
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+# the FTS triggers of 0003_search_index, frozen here: adding the columns remakes the seller table
+INDEXES = {
+    'market_app_product_fts': ('market_app_product', ['name', 'description']),
+    'market_app_seller_fts': ('market_app_seller', ['name']),
+}
+
+
+def create_fts_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for fts, (table, columns) in INDEXES.items():
+        cols = ', '.join(columns)
+        new = ', '.join(f'new.{column}' for column in columns)
+        old = ', '.join(f'old.{column}' for column in columns)
+        schema_editor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new}); END"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old}); END"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {cols} ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old}); "
+            f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new}); END"
+        )
+        # rows written while the triggers were missing
+        schema_editor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def count_of(queryset, column):
+    rows = queryset.filter(**{column: OuterRef('pk')}).order_by().values(column)
+    return Coalesce(Subquery(rows.annotate(count=Count('pk')).values('count')), 0)
+
+
+def fill_counters(apps, schema_editor):
+    Market = apps.get_model('market_app', 'Market')
+    Seller = apps.get_model('market_app', 'Seller')
+    Product = apps.get_model('market_app', 'Product')
+    links = Seller.markets.through.objects
+    Market.objects.update(
+        seller_count=count_of(links.all(), 'market_id'), product_count=count_of(Product.objects.all(), 'market_id')
+    )
+    # the seller counters leave out soft-deleted markets
+    Seller.objects.update(
+        market_count=count_of(links.filter(market__deleted_at=None), 'seller_id'),
+        product_count=count_of(Product.objects.filter(market__deleted_at=None), 'seller_id'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market_app', '0006_market_soft_delete'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='market',
+            name='product_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='market',
+            name='seller_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='seller',
+            name='market_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='seller',
+            name='product_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+        # adding the columns remade the seller table
+        migrations.RunPython(create_fts_triggers, migrations.RunPython.noop),
+    ]
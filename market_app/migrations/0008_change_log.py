@@ -0,0 +1,71 @@
+# Generated by Django 5.1.5 on 2026-10-18 08:38
+
+from django.db import migrations, models
+from django.utils import timezone
+
+# the tables whose inserts, updates and deletes are logged for the change feed (market_app.changes).
+# a later migration that remakes one of them copies create_change_triggers from here
+TABLES = {
+    'market': 'market_app_market',
+    'seller': 'market_app_seller',
+    'product': 'market_app_product',
+}
+
+
+def create_change_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for model, table in TABLES.items():
+        for event, row in [('insert', 'new'), ('update', 'new'), ('delete', 'old')]:
+            schema_editor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {table}_change_{event} AFTER {event.upper()} ON {table} BEGIN "
+                f"INSERT INTO market_app_changelog(model, object_id, changed_at) "
+                f"VALUES ('{model}', {row}.id, strftime('%Y-%m-%d %H:%M:%f', 'now')); END"
+            )
+
+
+def drop_change_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for table in TABLES.values():
+        for event in ('insert', 'update', 'delete'):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {table}_change_{event}')
+
+
+def seed_change_log(apps, schema_editor):
+    """ logs the rows that existed before the triggers, so ?since=0 is a full sync """
+    log = apps.get_model('market_app', 'ChangeLog')
+    now = timezone.now()
+    for model in TABLES:
+        pks = apps.get_model('market_app', model).objects.order_by('pk').values_list('pk', flat=True)
+        batch = []
+        for pk in pks.iterator(chunk_size=5000):
+            batch.append(log(model=model, object_id=pk, changed_at=now))
+            if len(batch) == 5000:
+                log.objects.bulk_create(batch)
+                batch = []
+        log.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market_app', '0007_relation_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLog',
+            fields=[
+                ('seq', models.BigAutoField(primary_key=True, serialize=False)),
+                ('model', models.CharField(max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('changed_at', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['model'], name='changelog_model_idx')],
+            },
+        ),
+        migrations.RunPython(seed_change_log, migrations.RunPython.noop),
+        migrations.RunPython(create_change_triggers, drop_change_triggers),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.5 on 2026-10-18 09:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market_app', '0008_change_log'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='market',
+            name='relations_updated_at',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='seller',
+            name='relations_updated_at',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+    ]
@@ -1,13 +1,46 @@
-from django.db import models
+from django.db import models, router, transaction
 
 # Create your models here.
 
 
+class FullTextField(models.TextField):
+    """ the hidden column of an SQLite FTS5 table that is named like the table, supports __match """
+
+
+@FullTextField.register_lookup
+class Match(models.Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', lhs_params + rhs_params
+
+
+class LiveMarketManager(models.Manager):
+    """ leaves out soft-deleted markets, their rows are removed in the background by market_app.purge """
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at=None)
+
+
 class Market(models.Model):
     name = models.CharField(max_length=255)
     location = models.CharField(max_length=255)
     description = models.TextField()
     net_worth = models.DecimalField(max_digits=100, decimal_places=2)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    # moved instead of updated_at when only the seller links or the counters change (market_app.signals.touch,
+    # market_app.counters): products render the market name only, their ETags follow updated_at
+    relations_updated_at = models.DateTimeField(null=True, editable=False)
+    # set by DELETE, the market is hidden at once and purged later
+    deleted_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    # maintained by market_app.counters, read-only in the API
+    seller_count = models.PositiveIntegerField(default=0, editable=False)
+    product_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = LiveMarketManager()
+    all_objects = models.Manager()
 
     def __str__(self):
         return self.name
@@ -17,17 +50,142 @@ class Seller(models.Model):
     name = models.CharField(max_length=255)
     contact_info = models.TextField()
     markets = models.ManyToManyField(Market, related_name='sellers')
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    # like Market.relations_updated_at, for the nested markets and the counters
+    relations_updated_at = models.DateTimeField(null=True, editable=False)
+    # maintained by market_app.counters, without soft-deleted markets
+    market_count = models.PositiveIntegerField(default=0, editable=False)
+    product_count = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.name
 
 
+class ProductQuerySet(models.QuerySet):
+
+    def live(self):
+        """
+        products of markets that are not soft-deleted. NOT IN over the few markets waiting for their purge
+        instead of a join, so the product indexes still drive filtering and ordering
+        """
+        deleted = Market.all_objects.filter(deleted_at__isnull=False).values('pk')
+        return self.exclude(market_id__in=deleted)
+
+
 class Product(models.Model):
     name = models.CharField(max_length=255)
     description = models.TextField()
     price = models.DecimalField(max_digits=50, decimal_places=2)
     market = models.ForeignKey(Market, on_delete=models.CASCADE, related_name='products')
     seller = models.ForeignKey(Seller, on_delete=models.CASCADE, related_name='products')
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        # one index per filter / ordering combination of the product list (api.filters.ProductFilter),
+        # SQLite appends the rowid, so each also serves the (field, id) keyset order.
+        # the plain FK indexes serve market / seller filters in id order
+        indexes = [
+            models.Index(fields=['market', 'price'], name='product_market_price_idx'),
+            models.Index(fields=['market', 'name'], name='product_market_name_idx'),
+            models.Index(fields=['seller', 'price'], name='product_seller_price_idx'),
+            models.Index(fields=['seller', 'name'], name='product_seller_name_idx'),
+            models.Index(fields=['price'], name='product_price_idx'),
+            models.Index(fields=['name'], name='product_name_idx'),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.price})"
+
+    def save(self, *args, **kwargs):
+        # the receivers in market_app.signals move the counters and stats in the same transaction
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            super().save(*args, **kwargs)
+
+
+class MarketStats(models.Model):
+    """
+    per-market summary for the stats endpoints, kept up to date by market_app.stats on every product
+    write and seller link change instead of aggregating on each request.
+    `python manage.py market_stats` checks it for drift and rebuilds it
+    """
+    market = models.OneToOneField(Market, primary_key=True, on_delete=models.CASCADE, related_name='stats')
+    product_count = models.PositiveIntegerField(default=0)
+    seller_count = models.PositiveIntegerField(default=0)
+    # sum of the listed prices, the average is total_value / product_count
+    total_value = models.DecimalField(max_digits=60, decimal_places=2, default=0)
+    min_price = models.DecimalField(max_digits=50, decimal_places=2, null=True)
+    max_price = models.DecimalField(max_digits=50, decimal_places=2, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Stats of {self.market_id}"
+
+
+class MarketPurge(models.Model):
+    """
+    progress of the background removal of a soft-deleted market (market_app.purge). it is written in
+    the same transaction as every batch, so `python manage.py purge_markets` resumes after a crash.
+    market_id is no foreign key, the row outlives the market to report that it is done
+    """
+    market_id = models.BigIntegerField(primary_key=True)
+    total_products = models.PositiveIntegerField(default=0)
+    deleted_products = models.PositiveIntegerField(default=0)
+    total_links = models.PositiveIntegerField(default=0)
+    deleted_links = models.PositiveIntegerField(default=0)
+    requested_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Purge of {self.market_id}"
+
+
+class ChangeLog(models.Model):
+    """
+    one row per insert, update and delete of a market, seller or product, written by SQLite triggers
+    (market_app.changes) so bulk writes, update() and raw deletes are logged as well.
+    seq orders the ?since= change feed, AUTOINCREMENT never hands out a number twice
+    """
+    seq = models.BigAutoField(primary_key=True)
+    # model_name of the changed row
+    model = models.CharField(max_length=20)
+    object_id = models.BigIntegerField()
+    changed_at = models.DateTimeField()
+
+    class Meta:
+        # SQLite appends the rowid (seq), so the index also serves model = ? AND seq > ? ORDER BY seq
+        indexes = [models.Index(fields=['model'], name='changelog_model_idx')]
+
+    def __str__(self):
+        return f"{self.model} {self.object_id} at {self.seq}"
+
+
+# FTS5 indexes, created and kept in sync by triggers in migration 0003 (SQLite only). a migration
+# that remakes the product or seller table recreates the triggers, see 0003_search_index
+
+class ProductSearchIndex(models.Model):
+    product = models.OneToOneField(
+        Product, primary_key=True, db_column='rowid', on_delete=models.DO_NOTHING, related_name='search_index'
+    )
+    document = FullTextField(db_column='market_app_product_fts')
+    # bm25(), lower is better
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'market_app_product_fts'
+
+
+class SellerSearchIndex(models.Model):
+    seller = models.OneToOneField(
+        Seller, primary_key=True, db_column='rowid', on_delete=models.DO_NOTHING, related_name='search_index'
+    )
+    document = FullTextField(db_column='market_app_seller_fts')
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'market_app_seller_fts'
@@ -0,0 +1,96 @@
+"""
+deletion of large markets without blocking the request.
+
+DELETE /api/market/<pk>/ only sets Market.deleted_at: the live managers hide the market, its products
+and its seller links at once and the request answers 202 with a MarketPurge row. The rows themselves
+are removed by `python manage.py purge_markets` in batches of plain DELETEs, each in its own short
+transaction together with the progress counters, so writers are never locked out for long and a
+killed worker continues where it stopped. The Market row goes last, with what is left of its cascade.
+"""
+from django.db import connection, transaction
+from django.utils import timezone
+
+from market_app import counters
+from market_app.api.cache import get_fragment_cache
+from market_app.models import Market, MarketPurge, Product, Seller
+from market_app.signals import invalidate_markets, sellers_of_markets, touch
+
+MarketSellers = Seller.markets.through
+
+
+def soft_delete(market):
+    """ hides market and schedules its purge, returns the MarketPurge row """
+    linked_ids = sellers_of_markets([market.pk])
+    # the sellers count neither the market nor its products any more
+    products = Product.objects.filter(market_id=market.pk)
+    seller_ids = linked_ids | set(products.values_list('seller_id', flat=True).distinct())
+    with transaction.atomic():
+        now = timezone.now()
+        Market.all_objects.filter(pk=market.pk).update(deleted_at=now, updated_at=now)
+        purge, _ = MarketPurge.objects.get_or_create(
+            market_id=market.pk,
+            defaults={
+                'total_products': market.product_count,
+                'total_links': market.seller_count,
+            },
+        )
+        counters.recount_sellers(seller_ids)
+        touch(Seller, seller_ids)
+        log_hidden_products(market.pk)
+    market.deleted_at = now
+    fragment_cache = get_fragment_cache()
+    if fragment_cache is not None:
+        invalidate_markets(fragment_cache, [market.pk], seller_ids)
+    return purge
+
+
+def log_hidden_products(market_id):
+    """
+    the products of the market leave the lists now, but their rows stay until the purge: the change feed
+    gets their tombstones in the same transaction, the same rows the change log triggers would write
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO market_app_changelog(model, object_id, changed_at) "
+            "SELECT 'product', id, strftime('%%Y-%%m-%%d %%H:%%M:%%f', 'now') "
+            "FROM market_app_product WHERE market_id = %s",
+            [market_id],
+        )
+
+
+def delete_rows(model, pks):
+    # plain DELETE, QuerySet.delete() would load every product to send post_delete
+    table = connection.ops.quote_name(model._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {table} WHERE id IN ({", ".join(["%s"] * len(pks))})', pks)
+
+
+def purge_batch(purge, batch_size=1000):
+    """ removes the next batch of rows of one soft-deleted market, returns False once it is gone """
+    market_id = purge.market_id
+    for model, filters, counter in [
+        (Product, {'market_id': market_id}, 'deleted_products'),
+        (MarketSellers, {'market_id': market_id}, 'deleted_links'),
+    ]:
+        pks = list(model.objects.filter(**filters).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            continue
+        with transaction.atomic():
+            delete_rows(model, pks)
+            setattr(purge, counter, getattr(purge, counter) + len(pks))
+            purge.save(update_fields=[counter, 'updated_at'])
+        fragment_cache = get_fragment_cache()
+        if fragment_cache is not None and model is Product:
+            fragment_cache.invalidate(Product, pks)
+        return True
+
+    with transaction.atomic():
+        # MarketStats and anything added after the batches go with the market
+        Market.all_objects.filter(pk=market_id).delete()
+        purge.finished_at = timezone.now()
+        purge.save(update_fields=['finished_at', 'updated_at'])
+    return False
+
+
+def pending():
+    return MarketPurge.objects.filter(finished_at=None).order_by('requested_at')
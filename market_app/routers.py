@@ -0,0 +1,197 @@
+"""
+read replicas for the API.
+
+    DATABASE_ROUTERS = ['market_app.routers.ReplicaRouter']
+    MIDDLEWARE = [..., 'market_app.routers.ReplicaPinningMiddleware', ...]
+    MARKET_DB_REPLICAS = ['replica1', 'replica2']    # aliases in DATABASES
+    MARKET_DB_STICKY_SECONDS = 5
+    MARKET_DB_HEALTH_INTERVAL = 10
+
+writes always go to the primary (default). A GET / HEAD / OPTIONS request reads from one healthy
+replica, chosen round robin at its first read and kept for the rest of it, so a page and its
+prefetches see the same state; related rows of an instance come from the database it was read from.
+unsafe requests, code outside a request (commands, shell) and everything inside an atomic block read
+the primary, so validation and signal handlers never act on replica lag. After a request that wrote, the client gets a cookie that keeps its reads on the
+primary for MARKET_DB_STICKY_SECONDS, long enough for the replicas to catch up with its own write.
+
+a replica that fails `SELECT 1` is left out of the rotation and checked again after
+MARKET_DB_HEALTH_INTERVAL seconds. Locally a replica can be a read-only SQLite copy
+('NAME': 'file:/path/replica1.sqlite3?mode=ro') refreshed with `manage.py sync_replicas`.
+"""
+import itertools
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from rest_framework.permissions import SAFE_METHODS
+
+PRIMARY = DEFAULT_DB_ALIAS
+COOKIE = 'market_primary_until'
+
+current = ContextVar('market_db_routing', default=None)
+
+
+def get_replicas():
+    return getattr(settings, 'MARKET_DB_REPLICAS', [])
+
+
+class RoutingState:
+    """ the routing decisions of one request """
+
+    def __init__(self, pinned):
+        # reads must see the primary: unsafe method or a recent write of this client
+        self.pinned = pinned
+        self.wrote = False
+        # the replica of all reads of the request, chosen at the first one: a page and its prefetches
+        # must not come from replicas with different lag
+        self.replica = None
+
+
+class ReplicaPool:
+    """ health of the replicas, shared by the threads of the process """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checked = {}
+        self._turn = itertools.count()
+
+    def is_healthy(self, alias):
+        now = time.monotonic()
+        interval = getattr(settings, 'MARKET_DB_HEALTH_INTERVAL', 10)
+        with self._lock:
+            healthy, checked_at = self._checked.get(alias, (None, None))
+            if healthy is not None and now - checked_at < interval:
+                return healthy
+        healthy = self.check(alias)
+        with self._lock:
+            self._checked[alias] = (healthy, now)
+        return healthy
+
+    def check(self, alias):
+        connection = connections[alias]
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            return True
+        except DatabaseError:
+            # a broken connection is opened again on the next check
+            connection.close()
+            return False
+
+    def choose(self, replicas):
+        healthy = [alias for alias in replicas if self.is_healthy(alias)]
+        if not healthy:
+            return None
+        return healthy[next(self._turn) % len(healthy)]
+
+    def reset(self):
+        with self._lock:
+            self._checked.clear()
+
+
+pool = ReplicaPool()
+
+
+def other_database(hints):
+    """ the database of a hinted instance that is neither the primary nor a replica, e.g. a scratch alias """
+    instance = hints.get('instance')
+    db = getattr(getattr(instance, '_state', None), 'db', None)
+    if db is not None and db != PRIMARY and db not in get_replicas():
+        return db
+    return None
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        other = other_database(hints)
+        if other is not None:
+            return other
+        state = current.get()
+        if state is None or state.pinned or state.wrote or connections[PRIMARY].in_atomic_block:
+            return PRIMARY
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db is not None:
+            # related rows (prefetch_related, lazy relations) come from where the instance was read
+            return instance._state.db
+        if state.replica is None:
+            replicas = get_replicas()
+            state.replica = (pool.choose(replicas) if replicas else None) or PRIMARY
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        other = other_database(hints)
+        if other is not None:
+            return other
+        state = current.get()
+        if state is not None:
+            state.wrote = True
+        # also for instances read from a replica
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        databases = {PRIMARY, *get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas are copies of the primary, not migrated on their own
+        if db in get_replicas():
+            return False
+        return None
+
+
+def recently_wrote(request):
+    try:
+        return float(request.COOKIES.get(COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+class ReplicaPinningMiddleware:
+    """
+    sets up the RoutingState of a request and the read-your-writes cookie after a write. async-capable,
+    so under ASGI it does not turn the middleware chain (and with it the async views) into sync_to_async
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = self.get_state(request)
+        token = current.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            current.reset(token)
+        return self.process_response(state, response)
+
+    async def __acall__(self, request):
+        state = self.get_state(request)
+        # the async ORM runs its queries through sync_to_async, which copies the context with the state
+        token = current.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current.reset(token)
+        return self.process_response(state, response)
+
+    def get_state(self, request):
+        return RoutingState(pinned=request.method not in SAFE_METHODS or recently_wrote(request))
+
+    def process_response(self, state, response):
+        if state.wrote and get_replicas():
+            window = getattr(settings, 'MARKET_DB_STICKY_SECONDS', 5)
+            response.set_cookie(COOKIE, f'{time.time() + window:.3f}', max_age=window, httponly=True, samesite='Lax')
+        return response
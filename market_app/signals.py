@@ -0,0 +1,187 @@
+from decimal import Decimal
+
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save, m2m_changed
+from django.dispatch import receiver
+from django.utils import timezone
+
+from market_app import counters, stats
+from market_app.models import Market, MarketStats, Seller, Product
+from market_app.api.cache import get_fragment_cache
+
+MarketSellers = Seller.markets.through
+
+
+def sellers_of_markets(market_ids):
+    return set(MarketSellers.objects.filter(market_id__in=market_ids).values_list('seller_id', flat=True))
+
+
+def markets_of_sellers(seller_ids):
+    return set(MarketSellers.objects.filter(seller_id__in=seller_ids).values_list('market_id', flat=True))
+
+
+def touch(model, pks):
+    """
+    bumps relations_updated_at of markets / sellers whose seller links or nested markets changed without
+    saving them (ETag / Last-Modified). updated_at stays, the products rendering their names keep their versions
+    """
+    pks = list(pks)
+    if pks:
+        model.objects.filter(pk__in=pks).update(relations_updated_at=timezone.now())
+
+
+def invalidate_products(fragment_cache, **filters):
+    """ products render market and seller names, so their fragments follow renames """
+    pks = Product.objects.filter(**filters).values_list('pk', flat=True).iterator(chunk_size=2000)
+    batch = []
+    for pk in pks:
+        batch.append(pk)
+        if len(batch) == 2000:
+            fragment_cache.invalidate(Product, batch)
+            batch = []
+    fragment_cache.invalidate(Product, batch)
+
+
+def invalidate_markets(fragment_cache, market_ids, seller_ids=()):
+    """ a market is nested in every seller fragment of that market """
+    fragment_cache.invalidate(Market, market_ids)
+    fragment_cache.invalidate(Seller, sellers_of_markets(market_ids) | set(seller_ids))
+
+
+def counts_changed(market_ids, seller_ids):
+    """ counters.apply_products bumped relations_updated_at, the cached markets and sellers render the old counts """
+    fragment_cache = get_fragment_cache()
+    if fragment_cache is not None:
+        invalidate_markets(fragment_cache, market_ids, seller_ids)
+
+
+@receiver(post_save, sender=Market)
+def market_saved(sender, instance, created, **kwargs):
+    if created:
+        MarketStats.objects.get_or_create(market=instance)
+    fragment_cache = get_fragment_cache()
+    if fragment_cache is None:
+        return
+    invalidate_markets(fragment_cache, [instance.pk])
+    if not created:
+        invalidate_products(fragment_cache, market_id=instance.pk)
+
+
+@receiver(pre_delete, sender=Market)
+def market_deleting(sender, instance, **kwargs):
+    # the link rows are gone after the delete and m2m_changed is not sent for them
+    instance._linked_seller_ids = sellers_of_markets([instance.pk])
+
+
+@receiver(post_delete, sender=Market)
+def market_deleted(sender, instance, **kwargs):
+    # the sellers render one market less
+    touch(Seller, getattr(instance, '_linked_seller_ids', ()))
+    counters.recount_sellers(getattr(instance, '_linked_seller_ids', ()), fields=['market_count'])
+    fragment_cache = get_fragment_cache()
+    if fragment_cache is None:
+        return
+    invalidate_markets(fragment_cache, [instance.pk], getattr(instance, '_linked_seller_ids', ()))
+
+
+@receiver(post_save, sender=Seller)
+def seller_saved(sender, instance, created, **kwargs):
+    fragment_cache = get_fragment_cache()
+    if fragment_cache is None:
+        return
+    fragment_cache.invalidate(Seller, [instance.pk])
+    if not created:
+        invalidate_products(fragment_cache, seller_id=instance.pk)
+
+
+@receiver(pre_delete, sender=Seller)
+def seller_deleting(sender, instance, **kwargs):
+    instance._linked_market_ids = markets_of_sellers([instance.pk])
+
+
+@receiver(post_delete, sender=Seller)
+def seller_deleted(sender, instance, **kwargs):
+    touch(Market, getattr(instance, '_linked_market_ids', ()))
+    stats.refresh_seller_counts(getattr(instance, '_linked_market_ids', ()))
+    counters.recount_markets(getattr(instance, '_linked_market_ids', ()), fields=['seller_count'])
+    fragment_cache = get_fragment_cache()
+    if fragment_cache is None:
+        return
+    fragment_cache.invalidate(Seller, [instance.pk])
+    # the markets lose a seller link, and with them every seller fragment nesting those markets
+    invalidate_markets(fragment_cache, getattr(instance, '_linked_market_ids', ()))
+
+
+@receiver(pre_save, sender=Product)
+def product_saving(sender, instance, **kwargs):
+    # market, price and seller before the update, MarketStats and the counters move the product
+    # from the old to the new values. the product serializers set them from the loaded instance already
+    if not instance._state.adding and instance.pk is not None and '_stats_previous' not in instance.__dict__:
+        instance._stats_previous = (
+            Product.objects.filter(pk=instance.pk).values_list('market_id', 'price', 'seller_id').first()
+        )
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, created, **kwargs):
+    current = (instance.market_id, instance.price)
+    previous = instance.__dict__.pop('_stats_previous', None)
+    owner = (instance.market_id, instance.seller_id)
+    if created or previous is None:
+        stats.apply_products(added=[current])
+        counters.apply_products(added=[owner])
+        counts_changed([instance.market_id], [instance.seller_id])
+    else:
+        if (previous[0], previous[1]) != (current[0], Decimal(str(current[1]))):
+            stats.apply_products(added=[current], removed=[previous[:2]])
+        if (previous[0], previous[2]) != owner:
+            # moved to another market or seller
+            counters.apply_products(added=[owner], removed=[(previous[0], previous[2])])
+            counts_changed({previous[0], instance.market_id}, {previous[2], instance.seller_id})
+    product_changed(instance)
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    if 'price' in instance.__dict__:
+        stats.apply_products(removed=[(instance.market_id, instance.price)])
+    else:
+        # loaded without the price (only() / defer()), recount the market instead
+        stats.rebuild([instance.market_id])
+    counters.apply_products(removed=[(instance.market_id, instance.seller_id)])
+    counts_changed([instance.market_id], [instance.seller_id])
+    product_changed(instance)
+
+
+def product_changed(instance):
+    fragment_cache = get_fragment_cache()
+    if fragment_cache is not None:
+        fragment_cache.invalidate(Product, [instance.pk])
+
+
+@receiver(m2m_changed, sender=MarketSellers)
+def market_sellers_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """ Seller.markets and Market.sellers share the through table, reverse tells which side instance is """
+    if action == 'pre_clear':
+        instance._cleared_link_ids = (
+            sellers_of_markets([instance.pk]) if reverse else markets_of_sellers([instance.pk])
+        )
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    changed = pk_set if action != 'post_clear' else getattr(instance, '_cleared_link_ids', set())
+    if reverse:
+        market_ids, seller_ids = [instance.pk], set(changed)
+    else:
+        market_ids, seller_ids = set(changed), [instance.pk]
+    touch(Market, market_ids)
+    touch(Seller, seller_ids)
+    stats.refresh_seller_counts(market_ids)
+    counters.recount_markets(market_ids, fields=['seller_count'])
+    counters.recount_sellers(seller_ids, fields=['market_count'])
+    # the instance is usually rendered right after, e.g. in the create / update response
+    instance.refresh_from_db(fields=['seller_count' if reverse else 'market_count'])
+
+    fragment_cache = get_fragment_cache()
+    if fragment_cache is not None:
+        invalidate_markets(fragment_cache, market_ids, seller_ids)
@@ -0,0 +1,127 @@
+"""
+incremental maintenance of MarketStats.
+
+counts and the price sum are adjusted with one UPDATE ... SET x = x + delta per market. a new price
+can only widen min / max, so inserts compare against the stored bounds; when a product leaves a market
+or changes its price the bounds are read back with an index seek on (market, price).
+seller counts are re-counted on the link table for the touched markets only.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Max, Min, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest, Least
+from django.utils import timezone
+
+from market_app.models import Market, MarketStats, Product, Seller
+
+MarketSellers = Seller.markets.through
+PRICE = DecimalField(max_digits=50, decimal_places=2)
+
+
+def price_bound(order):
+    return Subquery(Product.objects.filter(market_id=OuterRef('market_id')).order_by(order).values('price')[:1])
+
+
+def apply_products(added=(), removed=()):
+    """ added / removed are (market_id, price) pairs of products that entered or left a market """
+    deltas = defaultdict(lambda: {'count': 0, 'value': Decimal(0), 'prices': [], 'removed': False})
+    for market_id, price in added:
+        delta = deltas[market_id]
+        delta['count'] += 1
+        delta['value'] += Decimal(str(price))
+        delta['prices'].append(Decimal(str(price)))
+    for market_id, price in removed:
+        delta = deltas[market_id]
+        delta['count'] -= 1
+        delta['value'] -= Decimal(str(price))
+        delta['removed'] = True
+
+    now = timezone.now()
+    for market_id, delta in deltas.items():
+        changes = {
+            'product_count': F('product_count') + delta['count'],
+            'total_value': F('total_value') + delta['value'],
+            'updated_at': now,
+        }
+        if delta['removed']:
+            changes['min_price'] = price_bound('price')
+            changes['max_price'] = price_bound('-price')
+        elif delta['prices']:
+            low, high = Value(min(delta['prices']), PRICE), Value(max(delta['prices']), PRICE)
+            # Least / Greatest are NULL while the market has no products yet
+            changes['min_price'] = Coalesce(Least('min_price', low), low)
+            changes['max_price'] = Coalesce(Greatest('max_price', high), high)
+        if not MarketStats.objects.filter(market_id=market_id).update(**changes):
+            # e.g. a market from bulk_create without a stats row
+            rebuild([market_id])
+
+
+def refresh_seller_counts(market_ids):
+    market_ids = list(market_ids)
+    if not market_ids:
+        return
+    links = MarketSellers.objects.filter(market_id=OuterRef('market_id')).values('market_id')
+    MarketStats.objects.filter(market_id__in=market_ids).update(
+        seller_count=Coalesce(Subquery(links.annotate(count=Count('pk')).values('count')), 0),
+        updated_at=timezone.now(),
+    )
+
+
+def compute(market_ids=None):
+    """ the stats of every market (or of market_ids) aggregated from scratch, by market id """
+    # soft-deleted markets keep their row until they are purged
+    markets = Market.all_objects.all() if market_ids is None else Market.all_objects.filter(pk__in=market_ids)
+    result = {
+        pk: {'product_count': 0, 'seller_count': 0, 'total_value': Decimal('0.00'), 'min_price': None, 'max_price': None}
+        for pk in markets.values_list('pk', flat=True)
+    }
+    products = Product.objects.all() if market_ids is None else Product.objects.filter(market_id__in=list(result))
+    for row in products.values('market_id').annotate(
+        product_count=Count('pk'), total_value=Sum('price'), min_price=Min('price'), max_price=Max('price')
+    ).order_by():
+        if row['market_id'] in result:
+            result[row.pop('market_id')].update(row)
+    links = MarketSellers.objects.all() if market_ids is None else MarketSellers.objects.filter(market_id__in=list(result))
+    for row in links.values('market_id').annotate(seller_count=Count('pk')).order_by():
+        if row['market_id'] in result:
+            result[row['market_id']]['seller_count'] = row['seller_count']
+    return result
+
+
+def rebuild(market_ids=None):
+    """ replaces the stats rows of all markets (or of market_ids) with freshly aggregated ones """
+    fresh = compute(market_ids)
+    with transaction.atomic():
+        stale = MarketStats.objects.all() if market_ids is None else MarketStats.objects.filter(market_id__in=market_ids)
+        stale.delete()
+        MarketStats.objects.bulk_create(
+            [MarketStats(market_id=market_id, **values) for market_id, values in fresh.items()], batch_size=1000
+        )
+    return len(fresh)
+
+
+def same_value(stored, actual):
+    if isinstance(stored, Decimal) and isinstance(actual, Decimal):
+        # SQLite sums decimals as floating point
+        return round(stored, 2) == round(actual, 2)
+    return stored == actual
+
+
+def drift():
+    """ (market id, field, stored, actual) of every stored value that differs from a fresh aggregate """
+    fresh = compute()
+    stored = {stats.market_id: stats for stats in MarketStats.objects.all()}
+    found = []
+    for market_id, values in fresh.items():
+        stats = stored.pop(market_id, None)
+        if stats is None:
+            found.append((market_id, 'row', None, 'missing'))
+            continue
+        for field, actual in values.items():
+            value = getattr(stats, field)
+            if not same_value(value, actual):
+                found.append((market_id, field, value, actual))
+    found += [(market_id, 'row', 'orphan', None) for market_id in stored]
+    return found
@@ -1,3 +1,1583 @@
-from django.test import TestCase
+import base64
+import datetime
+import decimal
+import itertools
+import json
+import logging
+import os
+import tempfile
+import time
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, connections
+from django.db.models import F
+from django.db.models.signals import post_save
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path, reverse
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework import serializers, status
+from rest_framework.relations import Hyperlink
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.reverse import reverse as drf_reverse
+from rest_framework.test import APIClient, APIRequestFactory, APITestCase, APITransactionTestCase
+
+from market_app import counters, stats
+from market_app.api import links, serializers as api_serializers
+from market_app.api.async_views import ROUTES as ASYNC_ROUTES
+from market_app.api.cache import LocMemLRUBackend
+from market_app.api.fast import FastSerializer
+from market_app.api.renderers import FastJSONRenderer
+from market_app.api.serializers import (
+    MarketHyperlinkedSerializer, MarketSerializer, ProductCreateSerializer, ProductHyperlinkedSerializer,
+    SellerListSerializer, SellerSerializer,
+)
+from market_app.api.sparse import FieldSelection
+from market_app.api.timing import RequestMetrics, histograms
+from market_app.api.views import MarketSingleView, ProductViewSet, product_single_view, products_view
+from market_app.changes import latest_seq
+from market_app.management.commands.stress_sqlite import register, unregister
+from market_app.models import Market, MarketPurge, MarketStats, Seller, Product
+from market_app.purge import purge_batch
+from market_app.routers import ReplicaRouter, RoutingState, current, pool
+
+# urlconf with every async route under /async/api/ next to the sync ones, see AsyncReadTests
+urlpatterns = [
+    path('async/api/', include([url for route in ASYNC_ROUTES.values() for url in route.urls()])),
+    path('', include('supermarket.urls')),
+]
+
+# the fragment cache is off by default, the tests of it run on the process-local backend
+FRAGMENT_CACHE = {'BACKEND': 'market_app.api.cache.LocMemLRUBackend', 'OPTIONS': {'max_entries': 1000}}
+
+
+def create_market(name='Market', **kwargs):
+    data = {'location': 'Berlin', 'description': 'Weekly market', 'net_worth': '1000.00'}
+    data.update(kwargs)
+    return Market.objects.create(name=name, **data)
+
+
+def create_seller(name='Seller', markets=(), **kwargs):
+    seller = Seller.objects.create(name=name, contact_info=kwargs.get('contact_info', 'seller@example.com'))
+    seller.markets.set(markets)
+    return seller
+
+
+def create_product(market, seller, name='Apple', price='1.50', **kwargs):
+    return Product.objects.create(
+        name=name, description=kwargs.get('description', 'Fresh'), price=price, market=market, seller=seller
+    )
+
+
+class SellerQueryCountTests(APITestCase):
+
+    def setUp(self):
+        self.markets = [create_market(f'Market {i}') for i in range(3)]
+
+    def add_sellers(self, count):
+        for i in range(count):
+            create_seller(f'Seller {Seller.objects.count()}', markets=self.markets[:i % 3 + 1])
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(ctx), response
+
+    def test_seller_list_query_count_does_not_grow_with_rows(self):
+        url = reverse('seller-list')
+        self.add_sellers(2)
+        few, _ = self.count_queries(url)
+        self.add_sellers(20)
+        many, _ = self.count_queries(url)
+        self.assertEqual(few, many)
+
+    def test_seller_detail_query_count_does_not_grow_with_markets(self):
+        seller = create_seller('Single', markets=self.markets[:1])
+        url = reverse('seller-detail', args=[seller.pk])
+        few, _ = self.count_queries(url)
+        seller.markets.set(self.markets)
+        self.add_sellers(10)
+        many, response = self.count_queries(url)
+        self.assertEqual(few, many)
+        self.assertEqual(response.data['market_count'], 3)
+
+    def test_sellers_of_market_count_all_markets(self):
+        self.add_sellers(3)
+        response = self.client.get(f'/api/market/{self.markets[0].pk}/sellers/')
+        self.assertEqual(sorted(s['market_count'] for s in response.data['results']), [1, 2, 3])
+
+    def test_market_count_is_fresh_after_update(self):
+        seller = create_seller('Update', markets=self.markets[:1])
+        response = self.client.patch(
+            reverse('seller-detail', args=[seller.pk]),
+            {'market_id': [m.pk for m in self.markets]},
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['market_count'], 3)
+        self.assertEqual(len(response.data['markets']), 3)
+
+
+class KeysetPaginationTests(APITestCase):
+
+    def setUp(self):
+        market = create_market()
+        seller = create_seller(markets=[market])
+        for i in range(5):
+            create_product(market, seller, name=f'Product {i}')
+
+    def collect_pages(self, url):
+        names = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            names += [row['name'] for row in response.data['results']]
+            url = response.data['next']
+        return names
+
+    def test_cursor_walks_every_product_once_in_id_order(self):
+        names = self.collect_pages(reverse('product-list') + '?page_size=2')
+        self.assertEqual(names, [f'Product {i}' for i in range(5)])
+
+    def test_previous_cursor_returns_to_first_page(self):
+        first = self.client.get(reverse('product-list') + '?page_size=2').data
+        second = self.client.get(first['next']).data
+        self.assertEqual(self.client.get(second['previous']).data['results'], first['results'])
+
+    @override_settings(MARKET_API_MAX_PAGE_SIZE=3)
+    def test_page_size_is_capped(self):
+        response = self.client.get(reverse('product-list') + '?page_size=1000')
+        self.assertEqual(len(response.data['results']), 3)
+
+    def test_ties_are_paged_without_offset(self):
+        market, seller = Market.objects.get(), Seller.objects.get()
+        Product.objects.bulk_create([
+            Product(name=f'Same {i}', description='x', price='1.50', market=market, seller=seller) for i in range(30)
+        ])
+        for ordering in ['price', '-price']:
+            url = reverse('product-list') + f'?ordering={ordering}&page_size=4'
+            with CaptureQueriesContext(connection) as ctx:
+                ids, pages = [], []
+                while url:
+                    data = self.client.get(url).data
+                    ids += [row['id'] for row in data['results']]
+                    pages.append(data)
+                    url = data['next']
+            expected = sorted(Product.objects.values_list('price', 'pk'), reverse=ordering.startswith('-'))
+            self.assertEqual(ids, [pk for _, pk in expected])
+            self.assertFalse([q['sql'] for q in ctx.captured_queries if 'OFFSET' in q['sql']])
+            # and back from the last page
+            self.assertEqual(self.client.get(pages[-1]['previous']).data['results'], pages[-2]['results'])
+
+    def test_invalid_cursor_is_not_found(self):
+        for cursor in ['abc', 'eyJwIjpbMV19']:
+            response = self.client.get(reverse('product-list') + f'?ordering=price&cursor={cursor}')
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_tampered_cursor_position_is_not_found(self):
+        for position in [['abc', 1], [{'a': 1}, 1], [[1], 1], ['1.50', 'x'], [None, 1], ['1.50', None]]:
+            with self.subTest(position=position):
+                payload = json.dumps({'p': position, 'r': 0}).encode()
+                cursor = base64.urlsafe_b64encode(payload).decode().rstrip('=')
+                response = self.client.get(reverse('product-list'), {'ordering': 'price', 'cursor': cursor})
+                self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_market_lists_are_paginated(self):
+        response = self.client.get('/api/market/')
+        self.assertIn('next', response.data)
+        self.assertEqual(len(response.data['results']), 1)
+
+
+@override_settings(MARKET_FRAGMENT_CACHE=None)
+class ProductQueryTests(APITestCase):
+
+    def setUp(self):
+        self.market = create_market('Wochenmarkt')
+        self.seller = create_seller('Hof Meyer', markets=[self.market])
+        for i in range(10):
+            create_product(self.market, self.seller, name=f'Product {i}')
+
+    def test_product_list_is_a_single_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('product-list'))
+        first = response.data['results'][0]
+        self.assertEqual(first['market'], 'Wochenmarkt')
+        self.assertEqual(first['seller'], 'Hof Meyer')
+
+    def test_product_detail_is_a_single_query(self):
+        product = Product.objects.first()
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('product-detail', args=[product.pk]))
+        self.assertEqual(response.data['name'], product.name)
+
+    def test_related_rows_are_not_loaded_in_full(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(reverse('product-list'))
+        sql = ctx.captured_queries[0]['sql']
+        self.assertNotIn('"market_app_market"."description"', sql)
+        self.assertNotIn('"market_app_seller"."contact_info"', sql)
+
+
+class ProductBulkTests(APITestCase):
+
+    def setUp(self):
+        self.market = create_market()
+        self.seller = create_seller(markets=[self.market])
+        self.url = reverse('product-bulk')
+
+    def row(self, name, price='2.00', **kwargs):
+        data = {'name': name, 'description': 'Fresh', 'price': price,
+                'market_id': self.market.pk, 'seller_id': self.seller.pk}
+        data.update(kwargs)
+        return data
+
+    def test_bulk_json_reports_bad_rows_and_keeps_good_ones(self):
+        rows = [self.row('Apple'), self.row('Pear', market_id=9999), self.row('Plum', price='abc'), self.row('Kiwi')]
+        # one existence check per model, then inside a savepoint one INSERT, one MarketStats UPDATE
+        # and one counter UPDATE per model
+        with self.assertNumQueries(8):
+            response = self.client.post(self.url, rows, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual([error['index'] for error in response.data['errors']], [1, 2])
+        self.assertIn('market_id', response.data['errors'][0]['errors'])
+        self.assertEqual(sorted(Product.objects.values_list('name', flat=True)), ['Apple', 'Kiwi'])
+
+    @override_settings(MARKET_API_BULK_CHUNK_SIZE=2)
+    def test_bulk_csv_is_written_in_chunks(self):
+        body = 'name,description,price,market_id,seller_id\n' + ''.join(
+            f'P{i},Fresh,1.{i}0,{self.market.pk},{self.seller.pk}\n' for i in range(5)
+        )
+        response = self.client.post(self.url, body, content_type='text/csv')
+        self.assertEqual(response.data, {'created': 5, 'updated': 0, 'errors': []})
+        self.assertEqual(Product.objects.count(), 5)
+
+    def test_bulk_upsert_updates_prices_in_place(self):
+        apple = create_product(self.market, self.seller, name='Apple', price='1.00')
+        response = self.client.post(
+            self.url + '?upsert=true', [self.row('Apple', price='3.50'), self.row('Kiwi')], format='json'
+        )
+        self.assertEqual((response.data['created'], response.data['updated']), (1, 1))
+        apple.refresh_from_db()
+        self.assertEqual(str(apple.price), '3.50')
+        self.assertEqual(Product.objects.count(), 2)
+
+    def test_bulk_upsert_matches_whole_keys_and_reports_duplicates(self):
+        other = create_seller('Other', markets=[self.market])
+        twins = [create_product(self.market, self.seller, name='Apple', price='1.00') for _ in range(2)]
+        pear = create_product(self.market, other, name='Pear', price='1.00')
+        rows = [
+            self.row('Apple', price='3.50'),
+            # same seller and name as another product, but not the same key
+            self.row('Pear', price='4.00'),
+            self.row('Apple', price='9.99'),
+        ]
+        response = self.client.post(self.url + '?upsert=true', rows, format='json')
+        self.assertEqual((response.data['created'], response.data['updated']), (1, 2))
+        self.assertEqual([error['index'] for error in response.data['errors']], [2])
+        self.assertEqual({str(p.price) for p in Product.objects.filter(pk__in=[t.pk for t in twins])}, {'3.50'})
+        pear.refresh_from_db()
+        self.assertEqual(str(pear.price), '1.00')
+
+    def test_bulk_rejects_non_list_body(self):
+        response = self.client.post(self.url, self.row('Apple'), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class SellerOnboardingTests(APITestCase):
+
+    def setUp(self):
+        self.markets = [create_market(f'Market {i}') for i in range(3)]
+        self.url = reverse('seller-bulk')
+
+    def rows(self, count):
+        ids = [market.pk for market in self.markets]
+        return [{'name': f'Seller {i}', 'contact_info': 'x', 'market_ids': ids[:i % 3 + 1]} for i in range(count)]
+
+    def onboard(self, rows):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(self.url, rows, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(ctx), response
+
+    def test_bulk_query_count_does_not_grow_with_rows(self):
+        few, _ = self.onboard(self.rows(3))
+        many, response = self.onboard(self.rows(60))
+        self.assertEqual(few, many)
+        self.assertEqual(response.data['created'], 60)
+        self.assertEqual(MarketStats.objects.get(market=self.markets[0]).seller_count, 63)
+        self.assertEqual(MarketStats.objects.get(market=self.markets[2]).seller_count, 21)
+
+    def test_bulk_csv_reports_unknown_markets(self):
+        body = f'name,contact_info,market_ids\nA,x,{self.markets[0].pk};{self.markets[1].pk}\nB,x,9999\nC,,1\n'
+        response = self.client.post(self.url, body, content_type='text/csv')
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual([error['index'] for error in response.data['errors']], [1, 2])
+        self.assertEqual(response.data['errors'][0]['errors'], {'market_ids': ['Market 9999 not found']})
+        self.assertEqual(Seller.objects.get(pk=response.data['ids'][0]).markets.count(), 2)
+
+    def test_market_ids_are_checked_with_one_query(self):
+        ids = [market.pk for market in self.markets]
+        serializer = SellerSerializer(data={'name': 'S', 'contact_info': 'x', 'market_id': ids})
+        with self.assertNumQueries(1):
+            self.assertTrue(serializer.is_valid())
+        self.assertEqual(serializer.validated_data['markets'], self.markets)
+        serializer = SellerSerializer(data={'name': 'S', 'contact_info': 'x', 'market_id': [ids[0], 9999]})
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('9999', str(serializer.errors['market_id'][0]))
+
+    def test_sellers_of_market_keeps_the_given_markets(self):
+        response = self.client.post(
+            f'/api/market/{self.markets[0].pk}/sellers/',
+            {'name': 'S', 'contact_info': 'x', 'market_id': [self.markets[1].pk]},
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['market_count'], 2)
+        response = self.client.post('/api/market/9999/sellers/', {'name': 'S', 'contact_info': 'x', 'market_id': []}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ProductExportTests(APITestCase):
+
+    def setUp(self):
+        self.market = create_market('Wochenmarkt')
+        self.other_market = create_market('Nachtmarkt')
+        self.seller = create_seller('Hof Meyer', markets=[self.market, self.other_market])
+        create_product(self.market, self.seller, name='Apple', price='1.50')
+        create_product(self.other_market, self.seller, name='Pear', price='2.00')
+        self.url = reverse('product-export')
+
+    def read(self, response):
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return b''.join(response.streaming_content).decode()
+
+    def test_ndjson_export_matches_list_representation(self):
+        lines = self.read(self.client.get(self.url)).splitlines()
+        listed = self.client.get(reverse('product-list')).data['results']
+        self.assertEqual([json.loads(line) for line in lines], [dict(row) for row in listed])
+
+    def test_csv_export(self):
+        body = self.read(self.client.get(self.url + '?output=csv'))
+        self.assertEqual(body.splitlines(), [
+            'id,name,description,price,market,seller',
+            f'{Product.objects.get(name="Apple").pk},Apple,Fresh,1.50,Wochenmarkt,Hof Meyer',
+            f'{Product.objects.get(name="Pear").pk},Pear,Fresh,2.00,Nachtmarkt,Hof Meyer',
+        ])
+
+    def test_export_uses_list_filters(self):
+        lines = self.read(self.client.get(self.url + f'?market={self.other_market.pk}')).splitlines()
+        self.assertEqual([json.loads(line)['name'] for line in lines], ['Pear'])
+        listed = self.client.get(reverse('product-list') + f'?market={self.other_market.pk}').data['results']
+        self.assertEqual([row['name'] for row in listed], ['Pear'])
+
+    def test_unknown_output_is_rejected(self):
+        self.assertEqual(self.client.get(self.url + '?output=xml').status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(MARKET_FRAGMENT_CACHE=FRAGMENT_CACHE)
+class FragmentCacheTests(APITestCase):
+
+    def setUp(self):
+        self.market = create_market('Wochenmarkt')
+        self.seller = create_seller('Hof Meyer', markets=[self.market])
+        self.product = create_product(self.market, self.seller, name='Apple')
+
+    def test_warm_product_list_only_selects_keys(self):
+        url = reverse('product-list')
+        cold = self.client.get(url).data
+        with CaptureQueriesContext(connection) as ctx:
+            warm = self.client.get(url).data
+        self.assertEqual(len(ctx), 1)
+        self.assertNotIn('"market_app_market"."name"', ctx.captured_queries[0]['sql'])
+        self.assertEqual(warm, cold)
+
+    def test_market_rename_reaches_products_and_sellers(self):
+        self.client.get(reverse('product-list'))
+        self.client.get(reverse('seller-list'))
+        self.market.name = 'Nachtmarkt'
+        self.market.save()
+        self.assertEqual(self.client.get(reverse('product-list')).data['results'][0]['market'], 'Nachtmarkt')
+        seller = self.client.get(reverse('seller-list')).data['results'][0]
+        self.assertEqual(seller['markets'][0]['name'], 'Nachtmarkt')
+
+    def test_fragments_of_an_older_row_version_are_not_served(self):
+        # a write of another process: no signal reaches this process' cache, only updated_at moves
+        self.assertEqual(self.client.get(reverse('product-list')).data['results'][0]['name'], 'Apple')
+        Product.objects.filter(pk=self.product.pk).update(name='Pear', updated_at=timezone.now())
+        self.assertEqual(self.client.get(reverse('product-list')).data['results'][0]['name'], 'Pear')
+
+    def test_fragments_expire(self):
+        backend = LocMemLRUBackend(timeout=0)
+        backend.set_many({'key': 'value'})
+        self.assertEqual(backend.get_many(['key']), {})
+        self.assertEqual(LocMemLRUBackend().get_many([]), {})
+
+    def test_m2m_changes_invalidate_both_sides(self):
+        other = create_market('Nachtmarkt')
+        self.client.get(reverse('seller-list'))
+        self.client.get('/api/market/')
+        other.sellers.add(self.seller)
+        seller = self.client.get(reverse('seller-list')).data['results'][0]
+        self.assertEqual(seller['market_count'], 2)
+        markets = {m['name']: m for m in self.client.get('/api/market/').data['results']}
+        self.assertEqual(len(markets['Nachtmarkt']['sellers']), 1)
+        self.seller.markets.clear()
+        seller = self.client.get(reverse('seller-list')).data['results'][0]
+        self.assertEqual((seller['market_count'], seller['markets']), (0, []))
+
+    def test_seller_delete_drops_it_from_market_fragments(self):
+        self.client.get('/api/market/')
+        self.seller.delete()
+        market = self.client.get('/api/market/').data['results'][0]
+        self.assertEqual(market['sellers'], [])
+
+    def test_bulk_upsert_invalidates_products(self):
+        self.client.get(reverse('product-list'))
+        row = {'name': 'Apple', 'description': 'Fresh', 'price': '9.99',
+               'market_id': self.market.pk, 'seller_id': self.seller.pk}
+        self.client.post(reverse('product-bulk') + '?upsert=true', [row], format='json')
+        self.assertEqual(self.client.get(reverse('product-list')).data['results'][0]['price'], '9.99')
+
+
+class ConditionalRequestTests(APITestCase):
+
+    def setUp(self):
+        self.market = create_market('Wochenmarkt')
+        self.seller = create_seller('Hof Meyer', markets=[self.market])
+        self.product = create_product(self.market, self.seller)
+        self.market_url = f'/api/market/{self.market.pk}/'
+
+    def test_detail_answers_304_after_one_query(self):
+        response = self.client.get(self.market_url)
+        etag = response['ETag']
+        self.assertFalse(etag.startswith('W/'))
+        self.assertIn('Last-Modified', response)
+        with self.assertNumQueries(1):
+            response = self.client.get(self.market_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_etag_follows_seller_links_and_related_names(self):
+        market_etag = self.client.get(self.market_url)['ETag']
+        product_url = reverse('product-detail', args=[self.product.pk])
+        product_etag = self.client.get(product_url)['ETag']
+        create_seller('Hof Schulz', markets=[self.market])
+        self.assertNotEqual(self.client.get(self.market_url, HTTP_IF_NONE_MATCH=market_etag).status_code, 304)
+        self.seller.name = 'Hof Meyer & Sohn'
+        self.seller.save()
+        self.assertEqual(self.client.get(product_url, HTTP_IF_NONE_MATCH=product_etag).status_code, 200)
+
+    def test_counters_and_links_leave_other_products_alone(self):
+        product_url = reverse('product-detail', args=[self.product.pk])
+        product_etag = self.client.get(product_url)['ETag']
+        market_etag = self.client.get(self.market_url)['ETag']
+        # moves the product_count of the market and the seller
+        create_product(self.market, self.seller, name='Pear')
+        self.assertEqual(self.client.get(product_url, HTTP_IF_NONE_MATCH=product_etag).status_code, 304)
+        # a seller without products joins the market
+        create_seller('Hof Schulz', markets=[self.market])
+        self.assertEqual(self.client.get(product_url, HTTP_IF_NONE_MATCH=product_etag).status_code, 304)
+        response = self.client.get(self.market_url, HTTP_IF_NONE_MATCH=market_etag)
+        self.assertEqual((response.status_code, response.data['product_count']), (200, 2))
+
+    def test_lists_have_no_last_modified(self):
+        # deleting a seller moves no timestamp of the rows left on the page
+        other = create_seller('Hof Schulz')
+        response = self.client.get(reverse('seller-list'))
+        self.assertNotIn('Last-Modified', response)
+        since = http_date(time.time() + 60)
+        other.delete()
+        response = self.client.get(reverse('seller-list'), HTTP_IF_MODIFIED_SINCE=since)
+        self.assertEqual([row['id'] for row in response.data['results']], [self.seller.pk])
+
+    def test_list_etag_changes_with_the_page(self):
+        url = reverse('product-list')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        create_product(self.market, self.seller, name='Pear')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_if_match_guards_market_writes(self):
+        etag = self.client.get(self.market_url)['ETag']
+        response = self.client.patch(self.market_url, {'name': 'Nachtmarkt'}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        response = self.client.patch(self.market_url, {'name': 'Tagmarkt'}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        response = self.client.delete(self.market_url, HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertTrue(Market.objects.filter(pk=self.market.pk).exists())
+
+
+class SearchTests(APITestCase):
+
+    def setUp(self):
+        self.market = create_market()
+        self.seller = create_seller('Hof Meyer', markets=[self.market])
+        create_product(self.market, self.seller, name='Apple pie', description='Sweet apple pie with cinnamon')
+        create_product(self.market, self.seller, name='Pear', description='Juicy, goes well with apple')
+        create_product(self.market, self.seller, name='Kale', description='Green')
+
+    def search(self, query, url=None):
+        response = self.client.get(url or reverse('product-list'), {'q': query})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [row['name'] for row in response.data['results']]
+
+    def test_products_are_ranked(self):
+        self.assertEqual(self.search('apple'), ['Apple pie', 'Pear'])
+
+    def test_last_word_matches_as_prefix(self):
+        self.assertEqual(self.search('cinna'), ['Apple pie'])
+        self.assertEqual(self.search('apple gre'), [])
+
+    def test_index_follows_writes(self):
+        product = Product.objects.get(name='Kale')
+        product.description = 'Green kale, pairs with apple'
+        product.save()
+        self.assertIn('Kale', self.search('apple'))
+        product.delete()
+        self.assertNotIn('Kale', self.search('apple'))
+
+    def test_query_syntax_is_not_passed_through(self):
+        self.assertEqual(self.search('"apple) (* :'), ['Apple pie', 'Pear'])
+        self.assertEqual(self.search('***'), [])
+
+    def test_ranked_results_are_cursor_paginated(self):
+        first = self.client.get(reverse('product-list'), {'q': 'apple', 'page_size': 1}).data
+        second = self.client.get(first['next']).data
+        names = [row['name'] for row in first['results'] + second['results']]
+        self.assertEqual(names, ['Apple pie', 'Pear'])
+        self.assertIsNone(second['next'])
+
+    def test_seller_name_search(self):
+        create_seller('Gärtnerei Schulz')
+        self.assertEqual(self.search('gartnerei', reverse('seller-list')), ['Gärtnerei Schulz'])
+
+
+class ProductFilterTests(APITestCase):
+
+    def setUp(self):
+        self.market = create_market()
+        self.other_market = create_market('Nachtmarkt')
+        self.seller = create_seller(markets=[self.market, self.other_market])
+        self.other_seller = create_seller('Hof Schulz', markets=[self.market])
+        for name, price, market, seller in [
+            ('Kiwi', '0.80', self.market, self.seller),
+            ('Apple', '1.50', self.market, self.other_seller),
+            ('Pear', '2.00', self.other_market, self.seller),
+            ('Mango', '3.20', self.market, self.seller),
+        ]:
+            create_product(market, seller, name=name, price=price)
+
+    def names(self, **params):
+        response = self.client.get(reverse('product-list'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [row['name'] for row in response.data['results']]
+
+    def test_filters_combine(self):
+        self.assertEqual(self.names(market=self.market.pk, seller=self.seller.pk), ['Kiwi', 'Mango'])
+        self.assertEqual(self.names(price_min='1.00', price_max='2.00'), ['Apple', 'Pear'])
+
+    def test_ordering_by_price_and_name(self):
+        self.assertEqual(self.names(ordering='price'), ['Kiwi', 'Apple', 'Pear', 'Mango'])
+        self.assertEqual(self.names(ordering='-price', market=self.market.pk), ['Mango', 'Apple', 'Kiwi'])
+        self.assertEqual(self.names(ordering='name'), ['Apple', 'Kiwi', 'Mango', 'Pear'])
+
+    def test_ordered_pages_follow_the_cursor(self):
+        page = self.client.get(reverse('product-list'), {'ordering': '-price', 'page_size': 3}).data
+        rest = self.client.get(page['next']).data
+        self.assertEqual([row['name'] for row in page['results'] + rest['results']], ['Mango', 'Pear', 'Apple', 'Kiwi'])
+
+    def test_invalid_parameters_are_rejected(self):
+        for params in ({'ordering': 'description'}, {'price_min': 'cheap'}, {'market': 'x'}):
+            response = self.client.get(reverse('product-list'), params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+
+    def test_every_filter_and_ordering_combination_uses_an_index(self):
+        filters = {'market': self.market.pk, 'seller': self.seller.pk, 'price_min': '1.00', 'price_max': '3.00'}
+        orderings = [None, 'price', '-price', 'name', '-name']
+        for size in range(len(filters) + 1):
+            for names in itertools.combinations(filters, size):
+                for ordering in orderings:
+                    params = {name: filters[name] for name in names}
+                    if ordering:
+                        params['ordering'] = ordering
+                    with CaptureQueriesContext(connection) as ctx:
+                        self.client.get(reverse('product-list'), params)
+                    plan = self.query_plan(ctx.captured_queries[0]['sql'])
+                    if names:
+                        # filtered rows are found through an index: a SEARCH, never a SCAN of the table
+                        # or of a whole index
+                        product_lines = [line for line in plan.splitlines() if 'market_app_product ' in f'{line} ']
+                        self.assertTrue(product_lines, (params, plan))
+                        for line in product_lines:
+                            self.assertTrue(line.startswith('SEARCH'), (params, plan))
+                    if not names or ({'market', 'seller'} & set(names) and not {'price_min', 'price_max'} & set(names)):
+                        # the keyset order comes from the index (or the rowid), nothing is sorted
+                        self.assertNotIn('TEMP B-TREE', plan, (params, plan))
+
+    def query_plan(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            return '\n'.join(row[-1] for row in cursor.fetchall())
+
+
+@override_settings(ROOT_URLCONF='market_app.tests')
+class AsyncReadTests(APITestCase):
+
+    def setUp(self):
+        self.market = create_market()
+        self.seller = create_seller(markets=[self.market])
+        for i in range(3):
+            create_product(self.market, self.seller, name=f'Product {i}')
+
+    async def test_async_lists_match_the_sync_views(self):
+        for url, sync_url in [
+            ('/async/api/products/', reverse('product-list')),
+            ('/async/api/sellers/', reverse('seller-list')),
+            ('/async/api/market/', '/api/market/'),
+        ]:
+            response = await self.async_client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            sync = await self.sync_results(sync_url)
+            self.assertEqual(response.json()['results'], sync)
+
+    async def sync_results(self, url):
+        response = await sync_to_async(self.client.get)(url, HTTP_ACCEPT='application/json')
+        return json.loads(response.content)['results']
+
+    async def test_async_lists_run_the_filters_of_the_sync_views(self):
+        other = await Market.objects.acreate(name='Other', location='Hamburg', description='Daily', net_worth='10.00')
+        await Product.objects.acreate(
+            name='Pear', description='Ripe', price='3.00', market=other, seller=self.seller
+        )
+        for params in [
+            {'market': other.pk},
+            {'price_min': '2.00'},
+            {'ordering': '-price'},
+            {'ordering': 'name', 'page_size': 2},
+            {'q': 'pear'},
+            {'fields': 'id,name'},
+            {'fields': 'name', 'expand': 'market'},
+        ]:
+            with self.subTest(params=params):
+                # served by the async route itself, not handed to the sync view's handler
+                with mock.patch.object(ProductViewSet, 'list', side_effect=AssertionError):
+                    response = await self.async_client.get('/async/api/products/', params)
+                sync = await sync_to_async(self.client.get)(reverse('product-list'), params, HTTP_ACCEPT='application/json')
+                self.assertEqual(response.json()['results'], json.loads(sync.content)['results'])
+        response = await self.async_client.get('/async/api/products/', {'ordering': 'secret'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    async def test_sync_and_async_cursors_are_interchangeable(self):
+        params = {'ordering': 'price', 'page_size': 2}
+        sync = await sync_to_async(self.client.get)(reverse('product-list'), params, HTTP_ACCEPT='application/json')
+        cursor = json.loads(sync.content)['next'].split('?')[1]
+        second = (await self.async_client.get(f'/async/api/products/?{cursor}')).json()
+        sync_second = await sync_to_async(self.client.get)(
+            f"{reverse('product-list')}?{cursor}", HTTP_ACCEPT='application/json'
+        )
+        self.assertEqual(second['results'], json.loads(sync_second.content)['results'])
+        cursor = second['previous'].split('?')[1]
+        back = await sync_to_async(self.client.get)(f"{reverse('product-list')}?{cursor}", HTTP_ACCEPT='application/json')
+        self.assertEqual(json.loads(back.content)['results'], json.loads(sync.content)['results'])
+
+    async def test_async_routes_answer_conditional_requests(self):
+        product = await Product.objects.afirst()
+        for url in ['/async/api/products/', f'/async/api/products/{product.pk}/']:
+            with self.subTest(url=url):
+                response = await self.async_client.get(url)
+                etag = response['ETag']
+                # objects only, see ConditionalMixin
+                self.assertEqual('Last-Modified' in response, url != '/async/api/products/')
+                response = await self.async_client.get(url, headers={'If-None-Match': etag})
+                self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        await Product.objects.filter(pk=product.pk).aupdate(price='9.99', updated_at=timezone.now())
+        response = await self.async_client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['price'], '9.99')
+
+    @override_settings(MARKET_API_TIMING={'HEADER': True}, DEBUG=True)
+    def test_middleware_chain_stays_async(self):
+        # a sync-only middleware makes ASGIHandler run the whole chain, views included, in sync_to_async.
+        # Django logs the adaptation with DEBUG on
+        with mock.patch.object(logging.getLogger('django.request'), 'debug') as debug:
+            ASGIHandler()
+        adapted = [call.args for call in debug.call_args_list if 'adapted' in call.args[0]]
+        self.assertEqual(adapted, [])
+
+    @override_settings(MARKET_API_TIMING={'HEADER': True})
+    async def test_async_routes_are_measured(self):
+        response = await self.async_client.get('/async/api/products/')
+        self.assertRegex(response['Server-Timing'], r'desc="[1-9]\d* queries')
+
+    async def test_async_cursor_pages(self):
+        first = (await self.async_client.get('/async/api/products/', {'page_size': 2})).json()
+        self.assertIsNone(first['previous'])
+        second = (await self.async_client.get(first['next'])).json()
+        self.assertEqual([row['name'] for row in second['results']], ['Product 2'])
+        self.assertIsNone(second['next'])
+        back = (await self.async_client.get(second['previous'])).json()
+        self.assertEqual(back['results'], first['results'])
+
+    async def test_async_detail_and_404(self):
+        response = await self.async_client.get(f'/async/api/sellers/{self.seller.pk}/')
+        self.assertEqual(response.json()['market_count'], 1)
+        response = await self.async_client.get('/async/api/products/9999/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_writes_go_to_the_sync_views(self):
+        response = await self.async_client.patch(
+            f'/async/api/market/{self.market.pk}/', {'name': 'Nachtmarkt'}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((await Market.objects.aget(pk=self.market.pk)).name, 'Nachtmarkt')
+
+
+class SyncOnlyMiddleware:
+    """ a middleware without async support, see AsyncBenchmarkTests """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+
+class AsyncBenchmarkTests(TransactionTestCase):
+
+    def setUp(self):
+        market = create_market()
+        create_product(market, create_seller(markets=[market]))
+
+    def test_requests_go_through_the_middleware(self):
+        out = StringIO()
+        call_command('benchmark_async', requests=4, concurrency=2, threads=2, page_size=1, stdout=out)
+        self.assertIn('async / sync', out.getvalue())
+
+    def test_sync_only_middleware_is_refused(self):
+        with override_settings(MIDDLEWARE=[*settings.MIDDLEWARE, 'market_app.tests.SyncOnlyMiddleware']):
+            with self.assertRaisesMessage(CommandError, 'adapted for middleware market_app.tests.SyncOnlyMiddleware'):
+                call_command('benchmark_async', requests=1, stdout=StringIO())
+
+
+class FastSerializerTests(APITestCase):
+
+    # the rows every serializer in market_app.api.serializers is checked on
+    sources = {
+        'MarketSerializer': Market,
+        'MarketHyperlinkedSerializer': Market,
+        'SellerSerializer': Seller,
+        'SellerListSerializer': Seller,
+        'SellerDetailSerializer': Seller,
+        'SellerCreateSerializer': Seller,
+        'ProductSerializer': Product,
+        'ProductHyperlinkedSerializer': Product,
+        'ProductBulkRowSerializer': Product,
+        'SellerBulkRowSerializer': Seller,
+        'ProductDetailSerializer': Product,
+        'ProductCreateSerializer': Product,
+        'MarketStatsSerializer': MarketStats,
+        'MarketPurgeSerializer': MarketPurge,
+    }
+
+    def setUp(self):
+        markets = [
+            create_market(),
+            create_market('Ökomarkt "Süd"', net_worth='123456789012345.67'),
+            create_market('Empty', net_worth='0.10'),
+        ]
+        sellers = [
+            create_seller(markets=markets[:2]),
+            create_seller('Lonely', contact_info=''),
+        ]
+        create_product(markets[0], sellers[0], price='0.05')
+        create_product(markets[1], sellers[0], name='Brot', price='9999999.99', description='Roggen\nmit Kümmel')
+        create_product(markets[1], sellers[1], name='Käse', price=3)
+        MarketPurge.objects.create(market_id=99, total_products=3, deleted_products=1, total_links=2)
+
+    def serializer_classes(self):
+        for name, value in vars(api_serializers).items():
+            if (isinstance(value, type) and issubclass(value, serializers.Serializer)
+                    and value.__module__ == api_serializers.__name__):
+                yield name, value
+
+    def render(self, data):
+        return JSONRenderer().render(data)
+
+    def test_every_serializer_renders_the_same_bytes(self):
+        classes = dict(self.serializer_classes())
+        self.assertEqual(set(classes), set(self.sources), 'new serializers need a source model here')
+        for path in ['/api/products/', '/api/products/?format=json']:
+            request = Request(APIRequestFactory().get(path))
+            for name, serializer_class in classes.items():
+                queryset = self.sources[name].objects.order_by('pk')
+                if hasattr(serializer_class, 'setup_eager_loading'):
+                    queryset = serializer_class.setup_eager_loading(queryset)
+                for objs in [list(queryset), list(self.sources[name].objects.order_by('pk'))]:
+                    with self.subTest(serializer=name, path=path):
+                        context = {'request': request, 'format': None}
+                        expected = serializer_class(objs, many=True, context=context).data
+                        fast = FastSerializer(serializer_class(context=context)).many(objs)
+                        self.assertEqual(self.render(fast), self.render(expected))
+
+    @override_settings(MARKET_FRAGMENT_CACHE=None)
+    def test_list_endpoints_are_unchanged(self):
+        for url in [reverse('product-list'), reverse('seller-list'), '/api/market/']:
+            with override_settings(MARKET_API_FAST_SERIALIZERS=False):
+                expected = self.client.get(url, HTTP_ACCEPT='application/json').content
+            self.assertEqual(self.client.get(url, HTTP_ACCEPT='application/json').content, expected)
+
+
+class FastJSONTests(APITestCase):
+
+    def payload(self):
+        return {
+            'url': Hyperlink('http://testserver/api/products/1/', None),
+            'price': decimal.Decimal('1.50'),
+            'text': 'Käse   "quoted" \\ \n',
+            'when': datetime.datetime(2025, 1, 2, 3, 4, 5, 678901, tzinfo=datetime.timezone.utc),
+            'day': datetime.date(2025, 1, 2),
+            'nested': [{1: None, 'flag': True, 'count': 3}],
+            'big': 2 ** 70,
+        }
+
+    def test_renders_the_bytes_of_json_renderer(self):
+        expected = JSONRenderer().render(self.payload())
+        self.assertEqual(FastJSONRenderer().render(self.payload()), expected)
+        with mock.patch('market_app.api.renderers.orjson', None):
+            self.assertEqual(FastJSONRenderer().render(self.payload()), expected)
+        indented = FastJSONRenderer().render({'a': 1}, 'application/json; indent=2')
+        self.assertEqual(indented, JSONRenderer().render({'a': 1}, 'application/json; indent=2'))
+
+    def test_bulk_upload_is_parsed_and_bad_json_rejected(self):
+        market, seller = create_market(), create_seller()
+        rows = [{'name': 'Brot', 'description': 'Roggen', 'price': '2.10', 'market_id': market.pk, 'seller_id': seller.pk}]
+        response = self.client.post(reverse('product-bulk'), json.dumps(rows), content_type='application/json')
+        self.assertEqual(response.json()['created'], 1)
+        response = self.client.post(reverse('product-bulk'), '[{"name": ', content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class CatalogBenchmarkTests(APITestCase):
+
+    def generate(self, seed=7):
+        call_command(
+            'generate_catalog', markets=4, sellers=10, products=50, batch_size=7, seed=seed, clear=True,
+            stdout=StringIO()
+        )
+        return list(Product.objects.order_by('pk').values_list('name', 'price', 'seller__name', 'market__name'))
+
+    def test_catalog_is_reproducible(self):
+        first = self.generate()
+        self.assertEqual(len(first), 50)
+        self.assertEqual(Seller.objects.count(), 10)
+        self.assertTrue(all(seller.markets.exists() for seller in Seller.objects.all()))
+        # products are sold on a market their seller is linked to
+        self.assertFalse(Product.objects.exclude(market__sellers=F('seller')).exists())
+        self.assertEqual(self.generate(), first)
+        self.assertNotEqual(self.generate(seed=8), first)
+
+    def test_benchmark_saves_and_checks_a_baseline(self):
+        self.generate()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'baseline.json')
+            call_command('benchmark_endpoints', iterations=2, warmup=0, save=path, stdout=StringIO())
+            with open(path) as f:
+                baseline = json.load(f)
+            self.assertIn('/api/products/', baseline['endpoints'])
+            self.assertNotIn('/api/products/bulk/', baseline['endpoints'])
+            self.assertEqual(baseline['environment']['catalog']['Product'], 50)
+
+            # one query less than now is a regression of the current run
+            baseline['endpoints']['/api/products/']['queries'] -= 1
+            with open(path, 'w') as f:
+                json.dump(baseline, f)
+            with self.assertRaisesMessage(CommandError, '/api/products/ queries'):
+                call_command('benchmark_endpoints', iterations=2, warmup=0, compare=path, stdout=StringIO())
+
+
+@override_settings(MARKET_API_TIMING={'HEADER': True}, MARKET_FRAGMENT_CACHE=None)
+class ServerTimingTests(APITestCase):
+
+    def setUp(self):
+        histograms.clear()
+        market = create_market()
+        seller = create_seller(markets=[market])
+        for i in range(3):
+            create_product(market, seller, name=f'Product {i}')
+
+    def test_header_log_line_and_histogram(self):
+        with self.assertLogs('market_app.timing', 'INFO') as logs:
+            response = self.client.get(reverse('product-list'), HTTP_ACCEPT='application/json')
+        header = response['Server-Timing']
+        for metric in ['sql;dur=', 'serialize;dur=', 'render;dur=', 'total;dur=']:
+            self.assertIn(metric, header)
+        record = json.loads(logs.records[0].getMessage())
+        # the page with market and seller joined, the ETag timestamps ride along
+        self.assertEqual((record['queries'], record['repeated_queries']), (1, 0))
+        self.assertGreater(record['serialize_ms'], 0)
+        self.assertEqual(record['route'], 'GET api/products/')
+        self.assertIn('market_api_request_queries_count{route="GET api/products/"} 1', histograms.prometheus())
+
+    def test_repeated_query_shapes_are_counted(self):
+        metrics = RequestMetrics()
+        with connection.execute_wrapper(metrics):
+            for market in Market.objects.all():
+                # an N+1 loop, and one __in query whatever the list length
+                Seller.objects.filter(markets=market).count()
+                Seller.objects.filter(markets=market).count()
+            list(Product.objects.filter(pk__in=[1, 2, 3]))
+        self.assertEqual(metrics.summary()['repeated_queries'], 1)
+        self.assertEqual(metrics.queries, 4)
+
+    @override_settings(MARKET_API_TIMING=None)
+    def test_disabled_by_default(self):
+        response = self.client.get(reverse('product-list'), HTTP_ACCEPT='application/json')
+        self.assertNotIn('Server-Timing', response)
+
+
+class MarketStatsTests(APITestCase):
+
+    def setUp(self):
+        self.market = create_market()
+        self.other = create_market('Other')
+        self.seller = create_seller(markets=[self.market])
+        self.products = [
+            create_product(self.market, self.seller, name=name, price=price)
+            for name, price in [('Apple', '1.50'), ('Pear', '0.80'), ('Plum', '4.20')]
+        ]
+
+    def stats(self, market):
+        return self.client.get(reverse('market-stats', args=[market.pk])).json()
+
+    def assert_no_drift(self):
+        self.assertEqual(stats.drift(), [])
+
+    def test_stats_follow_product_writes(self):
+        data = self.stats(self.market)
+        self.assertEqual(data, {
+            'market': self.market.pk, 'product_count': 3, 'seller_count': 1, 'avg_price': '2.17',
+            'min_price': '0.80', 'max_price': '4.20', 'total_value': '6.50',
+        })
+        apple, pear, plum = self.products
+        plum.price = '2.00'
+        plum.save()
+        pear.market = self.other
+        pear.save()
+        apple.delete()
+        data = self.stats(self.market)
+        self.assertEqual((data['product_count'], data['min_price'], data['max_price']), (1, '2.00', '2.00'))
+        self.assertEqual(self.stats(self.other)['total_value'], '0.80')
+        self.assert_no_drift()
+
+    def test_stats_follow_seller_links_and_bulk_writes(self):
+        other_seller = create_seller('Other', markets=[self.market, self.other])
+        self.other.sellers.remove(other_seller)
+        self.seller.delete()
+        self.client.post(reverse('product-bulk'), [
+            {'name': 'Kiwi', 'description': 'x', 'price': '9.99', 'market_id': self.other.pk, 'seller_id': other_seller.pk}
+        ], format='json')
+        self.assertEqual(self.stats(self.market)['seller_count'], 1)
+        self.assertEqual(self.stats(self.other)['max_price'], '9.99')
+        self.assert_no_drift()
+
+    def test_requests_read_the_summary_row_only(self):
+        with self.assertNumQueries(1):
+            self.stats(self.market)
+        response = self.client.get(reverse('market-stats-list'))
+        self.assertEqual([row['market'] for row in response.json()['results']], [self.market.pk, self.other.pk])
+
+    def test_command_reports_drift_and_rebuilds(self):
+        MarketStats.objects.filter(market=self.market).update(product_count=42)
+        Market.objects.bulk_create([Market(name='Bulk', location='x', description='x', net_worth='1.00')])
+        with self.assertRaisesMessage(CommandError, 'drifted'):
+            call_command('market_stats', stdout=StringIO())
+        call_command('market_stats', fix=True, stdout=StringIO())
+        self.assert_no_drift()
+
+
+class SparseFieldsTests(APITestCase):
+
+    def setUp(self):
+        self.market = create_market('Wochenmarkt')
+        self.seller = create_seller('Hof Meyer', markets=[self.market])
+        create_product(self.market, self.seller, name='Apple', description='x' * 1000)
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, [query['sql'] for query in ctx.captured_queries]
+
+    @override_settings(MARKET_FRAGMENT_CACHE=None)
+    def test_product_fields_are_pushed_down(self):
+        response, queries = self.get(reverse('product-list') + '?fields=id,name,price')
+        self.assertEqual(list(response.data['results'][0]), ['id', 'name', 'price'])
+        self.assertFalse(any('"description"' in sql or '"market_app_market"."name"' in sql for sql in queries))
+
+    @override_settings(MARKET_FRAGMENT_CACHE=None)
+    def test_seller_markets_load_only_when_asked(self):
+        _, full = self.get(reverse('seller-list'))
+        response, sparse = self.get(reverse('seller-list') + '?fields=id,name')
+        self.assertEqual(response.data['results'][0], {'id': self.seller.pk, 'name': 'Hof Meyer'})
+        self.assertEqual(len(sparse), len(full) - 2)
+        self.assertFalse(any('COUNT' in sql for sql in sparse))
+
+        response, _ = self.get(f'/api/market/{self.market.pk}/sellers/?fields=name&expand=markets')
+        self.assertEqual(list(response.data['results'][0]), ['name', 'markets'])
+        self.assertEqual(response.data['results'][0]['markets'][0]['name'], 'Wochenmarkt')
+
+    def test_writes_save_every_field_and_render_the_selection(self):
+        response = self.client.post(
+            reverse('seller-list') + '?fields=id',
+            {'name': 'Hof Schulz', 'contact_info': 'schulz@example.com', 'market_id': [self.market.pk]},
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(set(response.data), {'id'})
+        seller = Seller.objects.get(pk=response.data['id'])
+        self.assertEqual((seller.name, seller.contact_info), ('Hof Schulz', 'schulz@example.com'))
+
+        url = reverse('seller-detail', args=[seller.pk]) + '?fields=id'
+        response = self.client.patch(url, {'name': 'Hof Schulz & Sohn'}, format='json')
+        self.assertEqual((response.status_code, set(response.data)), (status.HTTP_200_OK, {'id'}))
+        seller.refresh_from_db()
+        self.assertEqual(seller.name, 'Hof Schulz & Sohn')
+
+    def test_expand_nests_the_related_object(self):
+        response, _ = self.get(reverse('product-list') + '?fields=name&expand=market')
+        self.assertEqual(response.data['results'][0]['market']['name'], 'Wochenmarkt')
+        self.assertIn('sellers', response.data['results'][0]['market'])
+
+    def test_cached_fragments_stay_complete(self):
+        url = reverse('product-list')
+        full = self.client.get(url).content
+        sparse = self.client.get(url + '?fields=name').json()
+        self.assertEqual(sparse['results'], [{'name': 'Apple'}])
+        self.assertEqual(self.client.get(url).content, full)
+        self.client.get(reverse('seller-list') + '?fields=id')
+        self.assertIn('markets', self.client.get(reverse('seller-list')).data['results'][0])
+
+    def test_unknown_names_are_rejected(self):
+        response = self.client.get(reverse('product-list') + '?fields=id,secret&expand=price')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(set(response.data), {'fields', 'expand'})
+        self.assertEqual(self.client.get(reverse('product-list') + '?fields=market_id').status_code, 400)
+
+
+class SQLiteProfileTests(APITestCase):
+
+    def test_connections_get_the_pragmas(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 5000)
+            cursor.execute('PRAGMA temp_store')
+            self.assertEqual(cursor.fetchone()[0], 2)
+        self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+
+
+class SQLiteStressTests(TransactionTestCase):
+    """ stress_sqlite against scratch files, its threads connect to the stress_* aliases """
+    aliases = ['stress_stock', 'stress_configured']
+
+    @classmethod
+    def setUpClass(cls):
+        # the aliases are not in settings.DATABASES, where the test runner looks for a class attribute. they
+        # are declared here, once they exist
+        for alias in cls.aliases:
+            register(alias, {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'})
+        cls.databases = {'default', *cls.aliases}
+        super().setUpClass()
+
+    def setUp(self):
+        # the command registers them again with its own files and drops them when it is done
+        for alias in self.aliases:
+            unregister(alias)
+
+    def test_stress_has_no_lock_errors_with_the_profile(self):
+        out = StringIO()
+        call_command('stress_sqlite', readers=2, writers=3, seconds=0.5, products=500, check=True, stdout=out)
+        configured = next(line for line in out.getvalue().splitlines() if line.startswith('configured '))
+        self.assertEqual(configured.split()[-1], '0')
+
+
+@override_settings(MARKET_DB_REPLICAS=['replica_test'], MARKET_DB_HEALTH_INTERVAL=0, MARKET_FRAGMENT_CACHE=None)
+class ReplicaRoutingTests(TransactionTestCase):
+    """ a read-only SQLite file as replica, refreshed with sync_replicas """
+
+    @classmethod
+    def setUpClass(cls):
+        # like SQLiteStressTests the alias is declared once it exists. as a mirror of default the test
+        # case does not flush it, sync_replicas overwrites the file instead
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.path = os.path.join(cls.tmp.name, 'replica.sqlite3')
+        register('replica_test', {
+            **settings.DATABASES['default'], 'NAME': f'file:{cls.path}?mode=ro', 'TEST': {'MIRROR': 'default'},
+        })
+        cls.databases = {'default', 'replica_test'}
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        unregister('replica_test')
+        cls.tmp.cleanup()
+
+    def setUp(self):
+        pool.reset()
+        # a fresh connection to the file sync() writes
+        self.addCleanup(connections['replica_test'].close)
+        self.market = create_market('Wochenmarkt')
+        self.sync()
+
+    def sync(self):
+        call_command('sync_replicas', stdout=StringIO())
+
+    def get_sellers(self, client):
+        with CaptureQueriesContext(connections['replica_test']) as replica:
+            response = client.get(reverse('seller-list'))
+        return [seller['name'] for seller in response.data['results']], len(replica)
+
+    def test_reads_go_to_the_replica_and_writers_read_their_writes(self):
+        response = self.client.post(
+            reverse('seller-list'), {'name': 'Hof Meyer', 'contact_info': 'x', 'market_id': [self.market.pk]},
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIn('market_primary_until', response.cookies)
+
+        # the writer is pinned to the primary, everyone else reads the replica until it is synced
+        self.assertEqual(self.get_sellers(self.client), (['Hof Meyer'], 0))
+        names, replica_queries = self.get_sellers(APIClient())
+        self.assertEqual(names, [])
+        self.assertGreater(replica_queries, 0)
+        self.sync()
+        self.assertEqual(self.get_sellers(APIClient())[0], ['Hof Meyer'])
+
+    @override_settings(MARKET_DB_REPLICAS=['replica_test', 'replica_other'])
+    def test_a_request_reads_one_replica(self):
+        router = ReplicaRouter()
+        chosen = []
+        with mock.patch.object(pool, 'is_healthy', return_value=True):
+            for _ in range(2):
+                token = current.set(RoutingState(pinned=False))
+                try:
+                    chosen.append({router.db_for_read(model) for model in [Seller, Market, Seller, Product]})
+                    # related rows of an instance come from where it was read
+                    seller = Seller(pk=1)
+                    seller._state.db = 'replica_other' if chosen[-1] == {'replica_test'} else 'replica_test'
+                    self.assertEqual(router.db_for_read(Market, instance=seller), seller._state.db)
+                finally:
+                    current.reset(token)
+        # one replica per request, round robin between requests
+        self.assertEqual(sorted(chosen, key=sorted), [{'replica_other'}, {'replica_test'}])
+
+    def test_unreachable_replica_is_left_out(self):
+        create_seller('Hof Meyer', markets=[self.market])
+        connections['replica_test'].close()
+        os.remove(self.path)
+        response = APIClient().get(reverse('seller-list'))
+        self.assertEqual([seller['name'] for seller in response.data['results']], ['Hof Meyer'])
+        self.assertFalse(pool.is_healthy('replica_test'))
+
+
+class MarketPurgeTests(APITestCase):
+
+    def setUp(self):
+        self.market = create_market('Closing')
+        self.other = create_market('Staying')
+        self.seller = create_seller(markets=[self.market, self.other])
+        self.products = [create_product(self.market, self.seller, name=f'Apple {i}') for i in range(5)]
+        self.kept = create_product(self.other, self.seller, name='Pear')
+        self.market_url = f'/api/market/{self.market.pk}/'
+
+    def purge(self, **options):
+        out = StringIO()
+        call_command('purge_markets', stdout=out, **options)
+        return out.getvalue()
+
+    def test_delete_hides_the_market_at_once(self):
+        response = self.client.delete(self.market_url)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response['Location'], reverse('market-purge', args=[self.market.pk]))
+        self.assertEqual((response.data['total_products'], response.data['total_links']), (5, 1))
+
+        # nothing is deleted yet, but no list shows the market, its products or its seller link
+        self.assertEqual(Product.objects.count(), 6)
+        self.assertEqual([market['name'] for market in self.client.get('/api/market/').data['results']], ['Staying'])
+        self.assertEqual(self.client.get(self.market_url).status_code, 404)
+        self.assertEqual([product['name'] for product in self.client.get('/api/products/').data['results']], ['Pear'])
+        seller = self.client.get(reverse('seller-detail', args=[self.seller.pk])).data
+        self.assertEqual((seller['market_count'], [market['name'] for market in seller['markets']]), (1, ['Staying']))
+        rows = self.client.get(reverse('market-stats-list')).json()['results']
+        self.assertEqual([row['market'] for row in rows], [self.other.pk])
+
+    def test_purge_runs_in_batches_and_resumes(self):
+        self.client.delete(self.market_url)
+        purge = MarketPurge.objects.get(market_id=self.market.pk)
+        # a worker stopped after two batches, a fresh one continues from the saved counters
+        self.assertTrue(purge_batch(purge, batch_size=2))
+        self.assertTrue(purge_batch(purge, batch_size=2))
+        progress = self.client.get(reverse('market-purge', args=[self.market.pk])).data
+        self.assertEqual((progress['deleted_products'], progress['progress']), (4, round(4 / 6, 4)))
+
+        output = self.purge(batch_size=2)
+        self.assertIn(f'market {self.market.pk}: purged', output)
+        self.assertFalse(Market.all_objects.filter(pk=self.market.pk).exists())
+        self.assertFalse(MarketStats.objects.filter(market_id=self.market.pk).exists())
+        self.assertEqual(list(Product.objects.all()), [self.kept])
+        self.assertEqual(list(self.seller.markets.all()), [self.other])
+        progress = self.client.get(reverse('market-purge', args=[self.market.pk])).data
+        self.assertEqual((progress['deleted_products'], progress['deleted_links'], progress['progress']), (5, 1, 1.0))
+        # the FTS triggers removed the purged products from the search index
+        self.assertEqual(self.client.get(reverse('product-list'), {'q': 'apple'}).data['results'], [])
+
+    def test_stale_if_match_does_not_delete(self):
+        response = self.client.delete(self.market_url, HTTP_IF_MATCH='"stale"')
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertFalse(MarketPurge.objects.exists())
+
+
+class RelationCounterTests(APITestCase):
+
+    def setUp(self):
+        self.market = create_market()
+        self.other = create_market('Other')
+        self.seller = create_seller(markets=[self.market])
+        self.apple = create_product(self.market, self.seller)
+
+    def counts(self):
+        self.market.refresh_from_db()
+        self.other.refresh_from_db()
+        self.seller.refresh_from_db()
+        return {
+            'market': (self.market.seller_count, self.market.product_count),
+            'other': (self.other.seller_count, self.other.product_count),
+            'seller': (self.seller.market_count, self.seller.product_count),
+        }
+
+    def assert_no_drift(self):
+        self.assertEqual(counters.drift(), [])
+
+    def test_counters_follow_links_and_product_writes(self):
+        self.assertEqual(self.counts(), {'market': (1, 1), 'other': (0, 0), 'seller': (1, 1)})
+        self.other.sellers.add(self.seller)
+        self.apple.market = self.other
+        self.apple.save()
+        self.assertEqual(self.counts(), {'market': (1, 0), 'other': (1, 1), 'seller': (2, 1)})
+        self.seller.markets.remove(self.market)
+        self.apple.delete()
+        self.assertEqual(self.counts(), {'market': (0, 0), 'other': (1, 0), 'seller': (1, 0)})
+        self.assert_no_drift()
+
+    def test_bulk_paths_and_soft_delete_keep_the_counters(self):
+        self.client.post(reverse('product-bulk'), [
+            {'name': name, 'description': 'x', 'price': '1.00', 'market_id': self.other.pk, 'seller_id': self.seller.pk}
+            for name in ['Kiwi', 'Plum']
+        ], format='json')
+        response = self.client.post(reverse('seller-bulk'), [
+            {'name': 'Hof Meyer', 'contact_info': 'x', 'market_ids': [self.market.pk, self.other.pk, self.other.pk]}
+        ], format='json')
+        self.assertEqual(Seller.objects.get(pk=response.data['ids'][0]).market_count, 2)
+        self.assertEqual(self.counts(), {'market': (2, 1), 'other': (1, 2), 'seller': (1, 3)})
+        self.assert_no_drift()
+
+        self.client.delete(f'/api/market/{self.other.pk}/')
+        self.assertEqual(self.counts()['seller'], (1, 1))
+        self.assert_no_drift()
+
+    @override_settings(MARKET_FRAGMENT_CACHE=FRAGMENT_CACHE)
+    def test_repaired_counters_change_the_etag(self):
+        url = reverse('seller-detail', kwargs={'pk': self.seller.pk})
+        for options in [{'fix': True}, {'rebuild': True}]:
+            with self.subTest(options=options):
+                # drift the way a raw write would, without touching updated_at
+                Seller.objects.filter(pk=self.seller.pk).update(product_count=42)
+                response = self.client.get(url)
+                self.assertEqual(response.data['product_count'], 42)
+                call_command('market_counters', stdout=StringIO(), **options)
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(response.data['product_count'], 1)
+        # rows that were right are left alone
+        before = Market.objects.get(pk=self.market.pk).updated_at
+        call_command('market_counters', rebuild=True, stdout=StringIO())
+        self.assertEqual(Market.objects.get(pk=self.market.pk).updated_at, before)
+
+    def test_responses_read_the_columns(self):
+        response = self.client.post(
+            reverse('seller-list'), {'name': 'New', 'contact_info': 'x', 'market_id': [self.market.pk, self.other.pk]},
+            format='json',
+        )
+        self.assertEqual((response.data['market_count'], response.data['product_count']), (2, 0))
+        seller = Seller.objects.get(pk=self.seller.pk)
+        context = {'selection': FieldSelection(['id', 'market_count', 'product_count'])}
+        with self.assertNumQueries(0):
+            data = SellerSerializer(seller, context=context).data
+        self.assertEqual(data, {'id': self.seller.pk, 'market_count': 1, 'product_count': 1})
+
+    def test_command_reports_drift_and_repairs(self):
+        Seller.objects.filter(pk=self.seller.pk).update(market_count=7)
+        Market.objects.filter(pk=self.market.pk).update(product_count=0)
+        with self.assertRaisesMessage(CommandError, '2 drifted counters'):
+            call_command('market_counters', stdout=StringIO())
+        call_command('market_counters', fix=True, stdout=StringIO())
+        self.assert_no_drift()
+
+
+class MultiGetTests(APITestCase):
+
+    def setUp(self):
+        self.market = create_market()
+        self.seller = create_seller(markets=[self.market])
+        Product.objects.bulk_create([
+            Product(name=f'Product {i}', description='x', price='1.00', market=self.market, seller=self.seller)
+            for i in range(100)
+        ])
+        self.pks = list(Product.objects.order_by('pk').values_list('pk', flat=True))
+
+    def get_ids(self, ids, url=None):
+        response = self.client.get(url or reverse('product-list'), {'ids': ','.join(map(str, ids))})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_requested_order_and_missing_ids(self):
+        data = self.get_ids([self.pks[2], 999999, self.pks[0], self.pks[2]])
+        self.assertEqual([product['id'] for product in data['results']], [self.pks[2], self.pks[0]])
+        self.assertEqual(data['missing'], [999999])
+        data = self.get_ids([self.seller.pk], reverse('seller-list'))
+        self.assertEqual([seller['name'] for seller in data['results']], ['Seller'])
+
+    def test_hundred_ids_cost_the_same_queries_as_one(self):
+        with override_settings(MARKET_FRAGMENT_CACHE=None):
+            with CaptureQueriesContext(connection) as one:
+                self.get_ids(self.pks[:1])
+            with CaptureQueriesContext(connection) as hundred:
+                self.assertEqual(len(self.get_ids(self.pks)['results']), 100)
+        self.assertEqual(len(one), len(hundred))
+
+    def test_post_variant_and_limits(self):
+        response = self.client.post(reverse('product-ids'), {'ids': self.pks[:3]}, format='json')
+        self.assertEqual([product['id'] for product in response.data['results']], self.pks[:3])
+        response = self.client.post(reverse('market-ids'), [self.market.pk], format='json')
+        self.assertEqual([market['name'] for market in response.data['results']], ['Market'])
+        with override_settings(MARKET_API_MAX_IDS=10):
+            response = self.client.post(reverse('product-ids'), {'ids': self.pks[:11]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('ids', response.data)
+        response = self.client.get(reverse('product-list'), {'ids': '1,abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(MARKET_FRAGMENT_CACHE=FRAGMENT_CACHE)
+    def test_cached_fragments_of_hidden_rows_are_not_returned(self):
+        self.get_ids(self.pks[:2])
+        self.client.delete(f'/api/market/{self.market.pk}/')
+        self.assertEqual(self.get_ids(self.pks[:2]), {'results': [], 'missing': self.pks[:2]})
+
+
+class ChangeFeedTests(APITestCase):
+
+    def setUp(self):
+        self.market = create_market()
+        self.seller = create_seller(markets=[self.market])
+        self.products = [create_product(self.market, self.seller, name=f'Product {i}') for i in range(3)]
+        self.since = latest_seq()
+
+    def feed(self, url, since, **params):
+        response = self.client.get(url, {'since': since, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_feed_reports_upserts_and_tombstones(self):
+        first, second, third = self.products
+        first.price = '9.99'
+        first.save()
+        Product.objects.filter(pk=second.pk).update(name='Renamed')
+        third_pk = third.pk
+        third.delete()
+        data = self.feed(reverse('product-list'), self.since)
+        self.assertEqual([(row['id'], row['name']) for row in data['results']], [(first.pk, first.name), (second.pk, 'Renamed')])
+        self.assertEqual((data['deleted'], data['has_more']), ([third_pk], False))
+        # nothing after the new cursor
+        data = self.feed(reverse('product-list'), data['next_since'])
+        self.assertEqual((data['results'], data['deleted']), ([], []))
+
+    def test_soft_deleted_market_and_its_purged_products_are_tombstones(self):
+        self.client.delete(f'/api/market/{self.market.pk}/')
+        self.assertEqual(self.feed('/api/market/', self.since)['deleted'], [self.market.pk])
+        # the seller lost its market, so it changed as well
+        self.assertEqual([row['id'] for row in self.feed(reverse('seller-list'), self.since)['results']], [self.seller.pk])
+        # the products left the list with their market, long before the purge removes them
+        data = self.feed(reverse('product-list'), self.since)
+        self.assertEqual((data['results'], sorted(data['deleted'])), ([], [product.pk for product in self.products]))
+        call_command('purge_markets', stdout=StringIO())
+        data = self.feed(reverse('product-list'), self.since)
+        self.assertEqual(sorted(data['deleted']), sorted(product.pk for product in self.products))
+
+    def test_pages_follow_the_sequence(self):
+        for product in self.products:
+            product.save()
+        data = self.feed(reverse('product-list'), self.since, page_size=2)
+        self.assertEqual(([row['id'] for row in data['results']], data['has_more']), ([p.pk for p in self.products[:2]], True))
+        data = self.feed(reverse('product-list'), data['next_since'], page_size=2)
+        self.assertEqual(([row['id'] for row in data['results']], data['has_more']), ([self.products[2].pk], False))
+
+    def test_pruned_cursor_answers_gone(self):
+        create_product(self.market, self.seller, name='Fresh')
+        call_command('prune_changes', days=0, stdout=StringIO())
+        response = self.client.get(reverse('product-list'), {'since': 0})
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+        self.assertGreater(response.data['since'], self.since)
+        self.assertEqual(self.client.get(reverse('product-list'), {'since': 'x'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class HyperlinkTemplateTests(APITestCase):
+
+    def setUp(self):
+        self.markets = [create_market(f'Market {i}') for i in range(3)]
+        self.seller = create_seller(markets=self.markets)
+        self.product = create_product(self.markets[0], self.seller)
+
+    def request(self, path, **extra):
+        return Request(APIRequestFactory().get(path, **extra))
+
+    def test_links_match_drf_reverse(self):
+        for path, extra in [('/api/market/', {}), ('/api/market/?format=json', {'secure': True})]:
+            request = self.request(path, **extra)
+            context = {'request': request}
+            expected = [
+                (MarketHyperlinkedSerializer(self.markets[1], context=context).data['url'],
+                 drf_reverse('market-detail', kwargs={'pk': self.markets[1].pk}, request=request)),
+                (SellerListSerializer(self.seller, context=context).data['url'],
+                 drf_reverse('seller-detail', kwargs={'pk': self.seller.pk}, request=request)),
+                (ProductHyperlinkedSerializer(self.product, context=context).data['url'],
+                 drf_reverse('product-detail', kwargs={'pk': self.product.pk}, request=request)),
+                (MarketSerializer(self.markets[0], context=context).data['sellers'],
+                 [drf_reverse('seller-detail', kwargs={'pk': self.seller.pk}, request=request)]),
+            ]
+            for actual, reversed_url in expected:
+                with self.subTest(path=path, url=reversed_url):
+                    self.assertEqual(actual, reversed_url)
+
+    def test_pattern_is_reversed_once_per_process(self):
+        links._paths.clear()
+        with mock.patch.object(links, 'reverse', wraps=reverse) as reverse_calls:
+            for _ in range(2):
+                context = {'request': self.request('/api/market/')}
+                data = MarketHyperlinkedSerializer(self.markets, many=True, context=context).data
+                self.assertEqual(len({market['url'] for market in data}), 3)
+        self.assertEqual(reverse_calls.call_count, 1)
+
+
+class WriteQueryCountTests(APITestCase):
+    """
+    every write validates each relation with one query and renders the response from loaded rows.
+    the counts are for the default settings, where FRAGMENT_CACHE is off. with the cache on, each
+    write also runs the queries that invalidate its fragments
+    """
+
+    def setUp(self):
+        self.markets = [create_market(f'Market {i}') for i in range(3)]
+        self.seller = create_seller(markets=self.markets[:1])
+        self.product = create_product(self.markets[0], self.seller)
+        self.factory = APIRequestFactory()
+
+    def test_product_writes(self):
+        data = {'name': 'Pear', 'description': 'Ripe', 'price': '2.00',
+                'market_id': self.markets[1].pk, 'seller_id': self.seller.pk}
+        # market and seller lookups, insert, stats and both counters
+        with self.assertNumQueries(6):
+            response = products_view(self.factory.post('/api/product/', data, format='json'))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual((response.data['market'], response.data['seller']), ('Market 1', 'Seller'))
+
+        # the row with market and seller, the update, the stats
+        with self.assertNumQueries(3):
+            response = product_single_view(self.factory.put('/', {'price': '3.00'}, format='json'), pk=self.product.pk)
+        self.assertEqual((response.data['price'], response.data['market']), ('3.00', 'Market 0'))
+        self.assertEqual(MarketStats.objects.get(market=self.markets[0]).total_value, 3)
+
+        with self.assertNumQueries(5):
+            response = product_single_view(self.factory.delete('/'), pk=self.product.pk)
+        self.assertTrue(response.data['url'].endswith(f'/api/products/{self.product.pk}/'))
+        self.assertEqual(Market.objects.get(pk=self.markets[0].pk).product_count, 0)
+
+    def test_product_create_serializer(self):
+        serializer = ProductCreateSerializer(data={'name': 'Pear', 'description': 'Ripe', 'price': '2.00',
+                                                   'market_id': 999, 'seller_id': self.seller.pk})
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors['market_id'], ['Market not found'])
+
+        serializer = ProductCreateSerializer(self.product, data={'seller_id': self.seller.pk, 'price': '4.00'}, partial=True)
+        with self.assertNumQueries(3):
+            self.assertTrue(serializer.is_valid())
+            product = serializer.save()
+        self.assertEqual((product.seller_id, product.market_id), (self.seller.pk, self.markets[0].pk))
+
+    def test_seller_create_does_not_grow_with_markets(self):
+        counts = []
+        for markets, seller_counts in [(self.markets[:1], [2]), (self.markets, [3, 1, 1])]:
+            data = {'name': 'New', 'contact_info': 'new@example.com', 'market_id': [m.pk for m in markets]}
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.post(reverse('seller-list'), data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            # fresh counters, the links were added after validation loaded the markets
+            self.assertEqual([m['seller_count'] for m in response.data['markets']], seller_counts)
+            counts.append(len(ctx))
+        self.assertEqual(counts, [13, 13])
+
+    def test_other_write_endpoints(self):
+        market = self.markets[0]
+        # the updates run in a transaction for their If-Match check, its SAVEPOINT and RELEASE count here
+        cases = [
+            ('seller update', 9, lambda: self.client.patch(
+                reverse('seller-detail', args=[self.seller.pk]), {'name': 'Renamed'}, format='json')),
+            ('seller of market', 12, lambda: self.client.post(
+                f'/api/market/{market.pk}/sellers/',
+                {'name': 'Local', 'contact_info': 'l@example.com', 'market_id': [self.markets[1].pk]}, format='json')),
+            ('market update', 7, lambda: self.client.patch(f'/api/market/{market.pk}/', {'name': 'Renamed'}, format='json')),
+        ]
+        for name, expected, request in cases:
+            with self.subTest(name), self.assertNumQueries(expected):
+                response = request()
+            self.assertLess(response.status_code, 300)
+
+
+class ConditionalWriteTransactionTests(APITransactionTestCase):
+
+    def test_if_match_check_and_write_share_a_transaction(self):
+        market = create_market()
+        url = f'/api/market/{market.pk}/'
+        etag = self.client.get(url)['ETag']
+        transactions = []
+
+        def record(*args, **kwargs):
+            transactions.append(connection.atomic_blocks[0] if connection.in_atomic_block else None)
+
+        get_validators = MarketSingleView.get_validators
+
+        def validators(view, request):
+            record()
+            return get_validators(view, request)
+
+        post_save.connect(record, sender=Market, dispatch_uid='record_transaction')
+        try:
+            with mock.patch.object(MarketSingleView, 'get_validators', validators):
+                response = self.client.patch(url, {'name': 'Nachtmarkt'}, format='json', HTTP_IF_MATCH=etag)
+        finally:
+            post_save.disconnect(sender=Market, dispatch_uid='record_transaction')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # the If-Match check, the save and the validators of the response in the same transaction
+        self.assertEqual(len(transactions), 3)
+        self.assertIsNotNone(transactions[0])
+        self.assertTrue(all(block is transactions[0] for block in transactions))
@@ -42,6 +42,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # only active when MARKET_API_TIMING is set
+    'market_app.api.timing.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -50,6 +52,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # routes the reads of the views to MARKET_DB_REPLICAS, see market_app.routers
+    'market_app.routers.ReplicaPinningMiddleware',
 ]
 
 CSRF_TRUSTED_ORIGINS = [
@@ -69,6 +73,59 @@ CORS_ALLOWED_ORIGINS = [
 ]
 
 
+REST_FRAMEWORK = {
+    'DEFAULT_PAGINATION_CLASS': 'market_app.api.pagination.KeysetPagination',
+    'PAGE_SIZE': 100,
+    # orjson based, fall back to DRF's own when orjson is not installed
+    'DEFAULT_RENDERER_CLASSES': [
+        'market_app.api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'market_app.api.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+}
+
+# upper bound for ?page_size=, so one client cannot pull a whole table
+MARKET_API_MAX_PAGE_SIZE = 1000
+
+# ids per ?ids= / POST .../ids/ lookup (market_app.api.mixins.MultiGetMixin)
+MARKET_API_MAX_IDS = 100
+
+# rows per transaction of the bulk product upload
+MARKET_API_BULK_CHUNK_SIZE = 1000
+
+# rows fetched per round trip by the streaming product export
+MARKET_API_EXPORT_CHUNK_SIZE = 2000
+
+# read routes served by the async views under ASGI, any of 'products', 'sellers', 'markets'
+MARKET_API_ASYNC_ROUTES = []
+
+# list pages are serialized by market_app.api.fast.FastSerializer instead of DRF's field by field loop,
+# same output. False goes back to plain DRF serializers
+MARKET_API_FAST_SERIALIZERS = True
+
+# Server-Timing headers, log lines and per-route histograms of query count, SQL, serializer
+# and render time (market_app.api.timing), e.g. {'SAMPLE_RATE': 0.05}. None disables it
+MARKET_API_TIMING = None
+
+# per-object serialized fragments for the list endpoints, None disables them. with more than one worker
+# (or the management commands writing next to the server) they belong in a cache all processes share:
+#
+# CACHES['fragments'] = {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://...'}
+# MARKET_FRAGMENT_CACHE = {
+#     'BACKEND': 'market_app.api.cache.DjangoCacheBackend',
+#     'OPTIONS': {'alias': 'fragments', 'timeout': 300},
+#     'VERSION': 1,
+# }
+#
+# 'market_app.api.cache.LocMemLRUBackend' with OPTIONS {'max_entries': ..., 'timeout': ...} keeps them in
+# the process, for a single worker
+MARKET_FRAGMENT_CACHE = None
+
+
 ROOT_URLCONF = 'supermarket.urls'
 
 TEMPLATES = [
@@ -93,13 +150,52 @@ WSGI_APPLICATION = 'supermarket.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# run on every new SQLite connection through OPTIONS['init_command'].
+# WAL lets readers go on while a writer commits instead of waiting for the journal,
+# with synchronous=NORMAL only checkpoints fsync (the last commits can be lost on power loss, the file stays intact)
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,           # ms a connection waits for a lock before "database is locked"
+    'cache_size': -65536,           # negative is KiB, 64 MiB page cache per connection
+    'mmap_size': 268435456,         # 256 MiB of the file read through mmap
+    'temp_store': 'MEMORY',
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # connections are reused across requests, checked before reuse
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # atomic() takes the write lock at BEGIN, so a second writer waits on busy_timeout instead of
+            # failing at once when it upgrades a read transaction. compare with `manage.py stress_sqlite`
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': ';'.join(f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items()),
+        },
     }
 }
 
+DATABASE_ROUTERS = ['market_app.routers.ReplicaRouter']
+
+# read replicas, aliases in DATABASES. Locally they can be read-only SQLite copies of db.sqlite3
+# refreshed with `python manage.py sync_replicas`, e.g.
+#     DATABASES['replica1'] = {
+#         **DATABASES['default'],
+#         'NAME': f'file:{BASE_DIR / "replica1.sqlite3"}?mode=ro',
+#         'TEST': {'MIRROR': 'default'},
+#     }
+#     MARKET_DB_REPLICAS = ['replica1']
+MARKET_DB_REPLICAS = []
+
+# after a write the client reads from the primary for this many seconds, so it sees its own write
+MARKET_DB_STICKY_SECONDS = 5
+
+# seconds until an unreachable replica is checked again
+MARKET_DB_HEALTH_INTERVAL = 10
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators